@@ -0,0 +1,78 @@
+import time
+
+INTERVAL_MS = 60000   # 入力が続いていても、最初の変更からこの時間内には保存する
+IDLE_MS = 3000        # 入力が止まってからこの時間がたったら保存する
+LARGE_EDIT = 2000     # 未保存の変更がこの文字数を超えたら、すぐに保存する
+LARGE_EDIT_MS = 300
+
+
+class AutoSaver:
+    # 変更があったときだけ保存する自動保存
+    #
+    # changed() で変更を知らせると、続けて入力している間は保存をまとめ、
+    # 入力が止まったとき（または最初の変更からINTERVAL_MS後）に1回だけ save() を呼ぶ。
+    # 念のためINTERVAL_MSごとに is_dirty() を確かめ、変更が無ければ何もしない（スキップとして数える）。
+
+    def __init__(self, root, save, is_dirty, interval_ms=INTERVAL_MS, idle_ms=IDLE_MS,
+                 large_edit=LARGE_EDIT, large_edit_ms=LARGE_EDIT_MS):
+        self.root = root
+        self.save = save
+        self.is_dirty = is_dirty
+        self.interval_ms = interval_ms
+        self.idle_ms = idle_ms
+        self.large_edit = large_edit
+        self.large_edit_ms = large_edit_ms
+
+        self.saves = 0
+        self.skipped = 0
+        self.last_latency = None  # 秒
+        self._timer = None
+        self._heartbeat = None
+        self._first_change = None
+        self._pending_chars = 0
+
+    def start(self):
+        self._heartbeat = self.root.after(self.interval_ms, self._tick)
+
+    def stop(self):
+        for timer in (self._timer, self._heartbeat):
+            if timer is not None:
+                self.root.after_cancel(timer)
+        self._timer = self._heartbeat = None
+
+    def changed(self, size=0):
+        now = time.monotonic()
+        if self._first_change is None:
+            self._first_change = now
+        self._pending_chars += size
+
+        delay = self.large_edit_ms if self._pending_chars >= self.large_edit else self.idle_ms
+        remaining = (self._first_change - now) * 1000 + self.interval_ms
+        self._schedule(max(0, min(delay, remaining)))
+
+    def _schedule(self, delay_ms):
+        if self._timer is not None:
+            self.root.after_cancel(self._timer)
+        self._timer = self.root.after(int(delay_ms), self.run)
+
+    def _tick(self):
+        self._heartbeat = self.root.after(self.interval_ms, self._tick)
+        if self._timer is None:
+            self.run()
+
+    def run(self):
+        if self._timer is not None:
+            self.root.after_cancel(self._timer)
+            self._timer = None
+        self._first_change = None
+        self._pending_chars = 0
+        if not self.is_dirty():
+            self.skipped += 1
+            return False
+        self.save()
+        return True
+
+    def saved(self, latency):
+        # 保存が終わったとき（作業スレッドでの書き込み完了後）に呼ぶ
+        self.saves += 1
+        self.last_latency = latency
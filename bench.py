@@ -0,0 +1,322 @@
+import argparse
+import json
+import os
+import platform
+import random
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import diff
+import export
+from charclass import BalanceAnalyzer
+from corpus import generate_library, library_chars
+from lint import LintEngine
+from ngram import find_repetitions
+from sessions import SessionLog
+from stats import ProjectStats
+from storage import ProjectStore
+
+# 画面を使わない計測
+#
+#   python bench.py --chapters 20 --episodes 20 --chars 5000 --versions 3
+#   python bench.py --save-baseline          基準値を bench_baseline.json に保存
+#   python bench.py                          基準値と比べ、遅くなった項目があれば終了コード1
+#
+# 合成コーパス（corpus.py）で作ったライブラリに対して、保存・読み込み・文章チェック・
+# 進捗の集計・書き出しを画面と同じ関数で実行し、時間・処理速度・最大メモリを表にする。
+
+BASELINE_FILE = "bench_baseline.json"
+THRESHOLD = 0.2  # 基準値よりこの割合以上遅ければ「遅くなった」とみなす
+
+# 計測名 -> 計測関数（@benchmarkで登録）
+# 計測関数は Context を受け取って準備をし、時間を計る処理（引数なしの関数）を返す
+BENCHMARKS = {}
+
+
+def benchmark(name):
+    def register(fn):
+        BENCHMARKS[name] = fn
+        return fn
+    return register
+
+
+class Context:
+    def __init__(self, library, history, backend, work_dir):
+        self.library = library
+        self.history = history
+        self.backend = backend
+        self.work_dir = work_dir
+        self.chars = library_chars(library)
+        self._count = 0
+
+    def new_dir(self):
+        self._count += 1
+        return os.path.join(self.work_dir, f"run{self._count}")
+
+    def open_store(self, path):
+        if self.backend == "sqlite":
+            from sqlstore import SQLiteStore
+            os.makedirs(path, exist_ok=True)
+            return SQLiteStore(os.path.join(path, "novels.db"))
+        return ProjectStore(path)
+
+    def saved_store(self):
+        # ライブラリを保存済みの保存先（読み込みの計測用）
+        path = self.new_dir()
+        store = self.open_store(path)
+        store.mark_all(self.library)
+        store.save(self.library, 0)
+        store.close()
+        return path
+
+    def session_log(self, days=3 * 365, per_day=50):
+        # 数年分の執筆記録（全体を集計し直す計測用。集計ファイルは書かない）
+        path = os.path.join(self.work_dir, "sessions.bin")
+        if not os.path.exists(path):
+            rng = random.Random(0)
+            log = SessionLog(path)
+            episodes = [(p.id, ep.id) for p in self.library for ch in p.chapters for ep in ch.episodes]
+            start = int(time.time()) - days * 86400
+            for day in range(days):
+                for _ in range(per_day if rng.random() < 0.8 else 0):
+                    pid, eid = rng.choice(episodes)
+                    log.record(pid, eid, rng.randint(-50, 150), start + day * 86400 + rng.randrange(86400))
+            log.flush()
+        return path
+
+    def documents(self):
+        # チェック機能に渡すのと同じ (ラベル, 本文を返す関数) のリスト
+        return [(ep.title, lambda text=ep.content: text)
+                for p in self.library for ch in p.chapters for ep in ch.episodes]
+
+
+@benchmark("save")
+def bench_save(ctx):
+    # save_all: 全体を書き込み対象にして保存する（JSON化・ジャーナル・チェックポイント）
+    store = ctx.open_store(ctx.new_dir())
+
+    def run():
+        store.mark_all(ctx.library)
+        store.save(ctx.library, 0)
+        store.close()
+    return run
+
+
+@benchmark("load")
+def bench_load(ctx):
+    # load_projects: 目次を読み込み、すべての本文を開く
+    path = ctx.saved_store()
+
+    def run():
+        store = ctx.open_store(path)
+        projects, _ = store.load()
+        for project in projects:
+            for ch in project.chapters:
+                for ep in ch.episodes:
+                    store.content(project, ep)
+        store.close()
+    return run
+
+
+@benchmark("versions")
+def bench_versions(ctx):
+    # バージョン履歴への追記（差分の計算と圧縮を含む）
+    store = ctx.open_store(ctx.new_dir())
+
+    def run():
+        for (pid, eid), texts in ctx.history.items():
+            for i, text in enumerate(texts):
+                store.versions.append(pid, eid, text, "draft", f"v{i + 1}", "")
+        store.close()
+    return run
+
+
+@benchmark("diff")
+def bench_diff(ctx):
+    # バージョンの比較: 隣り合う版どうしの差分（キャッシュを通さない）
+    pairs = [(texts[i], texts[i + 1]) for texts in ctx.history.values() for i in range(len(texts) - 1)]
+
+    def run():
+        for old, new in pairs:
+            diff.compare(old, new)
+    return run
+
+
+@benchmark("check_repetition")
+def bench_repetition(ctx):
+    docs = ctx.documents()
+    return lambda: find_repetitions(docs, n=3)
+
+
+@benchmark("check_balance")
+def bench_balance(ctx):
+    docs = ctx.documents()
+    return lambda: BalanceAnalyzer().analyze_documents(docs)  # キャッシュの効かない初回の分析
+
+
+@benchmark("check_punctuation")
+def bench_punctuation(ctx):
+    docs = ctx.documents()
+    return lambda: LintEngine().check_documents(docs, with_labels=True)
+
+
+@benchmark("update_progress")
+def bench_progress(ctx):
+    # 進捗タブの集計（プロジェクトを開いたときの合計の作り直しと章別の表）
+    def run():
+        for project in ctx.library:
+            ProjectStats(project).chapter_rows()
+    return run
+
+
+@benchmark("sessions")
+def bench_sessions(ctx):
+    # 進捗タブの執筆記録: ログから日別の集計を作り、今日・直近7日・4週・連続日数を出す
+    path = ctx.session_log()
+    pid = ctx.library[0].id
+
+    def run():
+        log = SessionLog(path)
+        log.day(pid)
+        log.daily(pid, days=7)
+        log.weekly(pid, weeks=4)
+        log.streak(pid, goal=2000)
+    return run
+
+
+def _export_benchmark(fmt):
+    def bench(ctx):
+        path = ctx.new_dir() + export.WRITERS[fmt].extension
+        chapters = [(ch.title, [(ep.title, ep.content) for ep in ch.episodes])
+                    for p in ctx.library for ch in p.chapters]
+        return lambda: export.export(fmt, path, "計測", chapters)
+    return bench
+
+
+for _fmt in export.WRITERS:
+    benchmark(f"export_{_fmt}")(_export_benchmark(_fmt))
+
+
+def measure(name, ctx, repeat, memory=True):
+    # 時間はrepeat回の最小値と中央値。最大メモリは別に1回、tracemallocを有効にして計る
+    times = []
+    for _ in range(repeat):
+        run = BENCHMARKS[name](ctx)
+        start = time.perf_counter()
+        run()
+        times.append(time.perf_counter() - start)
+    result = {
+        "seconds": min(times),
+        "median": statistics.median(times),
+        "chars_per_sec": ctx.chars / min(times) if min(times) else None,
+    }
+    if memory:
+        run = BENCHMARKS[name](ctx)
+        tracemalloc.start()
+        try:
+            run()
+            result["peak_bytes"] = tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+    return result
+
+
+def compare(results, baseline, threshold=THRESHOLD):
+    # 基準値より遅くなった項目の (名前, 今回/基準) のリスト
+    regressions = []
+    for name, result in results.items():
+        base = baseline.get("results", {}).get(name)
+        if not base or not base.get("seconds"):
+            continue
+        ratio = result["seconds"] / base["seconds"]
+        result["ratio"] = ratio
+        if ratio > 1 + threshold:
+            regressions.append((name, ratio))
+    return regressions
+
+
+def format_table(results):
+    lines = [f"{'計測':<20}{'最小':>10}{'中央値':>10}{'字/秒':>14}{'最大メモリ':>12}{'基準比':>8}"]
+    for name, r in results.items():
+        speed = f"{r['chars_per_sec']:,.0f}" if r.get("chars_per_sec") else "-"
+        peak = f"{r['peak_bytes'] / (1 << 20):.1f}MB" if "peak_bytes" in r else "-"
+        ratio = f"{r['ratio']:.2f}" if "ratio" in r else "-"
+        lines.append(f"{name:<20}{r['seconds'] * 1000:>8.1f}ms{r['median'] * 1000:>8.1f}ms"
+                     f"{speed:>14}{peak:>12}{ratio:>8}")
+    return "\n".join(lines)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="保存・読み込み・文章チェック・書き出しの計測")
+    parser.add_argument("--projects", type=int, default=1)
+    parser.add_argument("--chapters", type=int, default=10)
+    parser.add_argument("--episodes", type=int, default=10, help="1章あたりの話数")
+    parser.add_argument("--chars", type=int, default=4000, help="1話あたりの文字数")
+    parser.add_argument("--versions", type=int, default=3, help="1話あたりの版の数")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--backend", choices=("files", "sqlite"), default="files")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--only", help="計測する項目（カンマ区切り）")
+    parser.add_argument("--no-memory", action="store_true", help="最大メモリを計らない（速くなる）")
+    parser.add_argument("--baseline", default=BASELINE_FILE)
+    parser.add_argument("--save-baseline", action="store_true", help="今回の結果を基準値として保存する")
+    parser.add_argument("--threshold", type=float, default=THRESHOLD)
+    parser.add_argument("--json", help="結果をJSONで書き出すファイル")
+    args = parser.parse_args(argv)
+
+    names = args.only.split(",") if args.only else list(BENCHMARKS)
+    unknown = [name for name in names if name not in BENCHMARKS]
+    if unknown:
+        parser.error(f"不明な計測: {', '.join(unknown)}（{', '.join(BENCHMARKS)}）")
+    if not args.versions and "versions" in names and not args.only:
+        names.remove("versions")
+
+    scale = {"projects": args.projects, "chapters": args.chapters, "episodes": args.episodes,
+             "chars": args.chars, "versions": args.versions, "seed": args.seed, "backend": args.backend}
+    library, history = generate_library(args.projects, args.chapters, args.episodes, args.chars,
+                                        args.versions, seed=args.seed)
+    work_dir = tempfile.mkdtemp(prefix="novel-bench-")
+    ctx = Context(library, history, args.backend, work_dir)
+    print(f"ライブラリ: {ctx.chars:,}字 / {sum(len(ch.episodes) for p in library for ch in p.chapters)}話"
+          f" / 版 {sum(len(v) for v in history.values())}")
+
+    results = {}
+    try:
+        for name in names:
+            results[name] = measure(name, ctx, args.repeat, memory=not args.no_memory)
+            print(f"  {name}: {results[name]['seconds'] * 1000:.1f}ms", file=sys.stderr)
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    regressions = []
+    if os.path.exists(args.baseline) and not args.save_baseline:
+        with open(args.baseline, 'r', encoding='utf-8') as f:
+            baseline = json.load(f)
+        if baseline.get("scale") != scale:
+            print(f"注意: 基準値（{args.baseline}）とライブラリの規模・設定が違います")
+        regressions = compare(results, baseline, args.threshold)
+
+    print(format_table(results))
+    report = {"scale": scale, "python": platform.python_version(), "chars": ctx.chars, "results": results}
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+    if args.save_baseline:
+        with open(args.baseline, 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        print(f"基準値を保存しました: {args.baseline}")
+
+    if regressions:
+        print("遅くなった項目:")
+        for name, ratio in regressions:
+            print(f"  {name}: 基準の{ratio:.2f}倍")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,95 @@
+import argparse
+import os
+import shutil
+import tempfile
+import time
+
+from corpus import generate_library, library_chars
+from sqlstore import SQLiteStore
+from storage import ProjectStore
+
+# 保存先（分割ファイル／SQLite）の読み込み・保存・検索の時間を比べる
+#
+#   python bench_storage.py --chars 5000000
+#
+# 合成したライブラリ（既定で500万字）を一時フォルダに作り、それぞれの保存先で計測する。
+
+QUERY = "懐かしい図書館"
+
+
+def synthetic_library(total_chars, projects=5, chapters=10, episode_chars=5000, seed=1):
+    # 全体でおよそtotal_chars字になるように、同じ大きさの話を並べる
+    episodes = max(1, total_chars // episode_chars // (projects * chapters))
+    library, _ = generate_library(projects, chapters, episodes, episode_chars, seed=seed)
+    return library
+
+
+def timed(fn):
+    start = time.perf_counter()
+    result = fn()
+    return time.perf_counter() - start, result
+
+
+def run(name, open_store, library):
+    results = {}
+    store = open_store()
+    store.mark_all(library)
+    results["初回保存"], _ = timed(lambda: store.save(library, 0))
+    store.close()
+
+    store = open_store()
+    results["読み込み（目次）"], (projects, _) = timed(store.load)
+
+    def read_all():
+        for project in projects:
+            for ch in project.chapters:
+                for ep in ch.episodes:
+                    store.content(project, ep)
+    results["読み込み（本文すべて）"], _ = timed(read_all)
+
+    def edit_and_save():
+        project = projects[0]
+        for ep in project.chapters[0].episodes[:10]:
+            ep.content += "追記。"
+            store.mark_episode(project, ep)
+        store.mark_chapter(project, project.chapters[0])
+        return store.save(projects, 0)
+    results["10話を保存"], _ = timed(edit_and_save)
+
+    search = store.search_engine()
+    results["検索の準備"], _ = timed(lambda: [search.ensure(p) for p in projects])
+    results["検索"], hits = timed(lambda: search.search(projects, QUERY))
+    store.close()
+    return results, len(hits)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="保存先の読み込み・保存・検索の時間を比べる")
+    parser.add_argument("--chars", type=int, default=5000000, help="合成するライブラリの文字数")
+    args = parser.parse_args()
+
+    library = synthetic_library(args.chars)
+    total = library_chars(library)
+    print(f"合成ライブラリ: {total:,}字 / {sum(len(ch.episodes) for p in library for ch in p.chapters)}話")
+
+    work = tempfile.mkdtemp()
+    try:
+        backends = [
+            ("ファイル", lambda: ProjectStore(os.path.join(work, "files"))),
+            ("SQLite", lambda: SQLiteStore(os.path.join(work, "novels.db"))),
+        ]
+        rows = {}
+        for name, open_store in backends:
+            rows[name], hits = run(name, open_store, synthetic_library(args.chars))
+            print(f"{name}: 検索結果 {hits}件")
+
+        labels = list(next(iter(rows.values())))
+        print(f"{'':<20}" + "".join(f"{name:>12}" for name in rows))
+        for label in labels:
+            print(f"{label:<20}" + "".join(f"{rows[name][label] * 1000:>10.1f}ms" for name in rows))
+    finally:
+        shutil.rmtree(work, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
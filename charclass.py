@@ -0,0 +1,113 @@
+import hashlib
+import unicodedata
+from collections import Counter, OrderedDict
+from functools import lru_cache
+
+CLASSES = [
+    ("kanji", "漢字"),
+    ("hiragana", "ひらがな"),
+    ("katakana", "カタカナ"),
+    ("halfwidth_katakana", "半角カナ"),
+    ("latin", "英字"),
+    ("digit", "数字"),
+    ("punctuation", "句読点・記号"),
+    ("space", "空白・改行"),
+    ("other", "その他"),
+]
+CLASS_LABELS = dict(CLASSES)
+CACHE_SIZE = 4096
+
+_RANGES = [
+    (0x3400, 0x4DBF, "kanji"),      # CJK統合漢字拡張A
+    (0x4E00, 0x9FFF, "kanji"),
+    (0xF900, 0xFAFF, "kanji"),      # CJK互換漢字
+    (0x20000, 0x3134F, "kanji"),    # CJK統合漢字拡張B以降
+    (0x3040, 0x309F, "hiragana"),
+    (0x30A0, 0x30FF, "katakana"),
+    (0x31F0, 0x31FF, "katakana"),   # アイヌ語用小書きカタカナ
+    (0xFF66, 0xFF9F, "halfwidth_katakana"),
+    (0xFF10, 0xFF19, "digit"),
+    (0xFF21, 0xFF3A, "latin"),
+    (0xFF41, 0xFF5A, "latin"),
+]
+_KANJI_MARKS = "々〆〇ヶ"
+
+
+@lru_cache(maxsize=None)
+def classify(ch):
+    if ch in _KANJI_MARKS:
+        return "kanji"
+    code = ord(ch)
+    for start, end, name in _RANGES:
+        if start <= code <= end:
+            # 中黒「・」はカタカナの範囲にあるが記号として扱う
+            return "punctuation" if ch == "・" else name
+    if ch.isspace():
+        return "space"
+    if "0" <= ch <= "9":
+        return "digit"
+    category = unicodedata.category(ch)
+    if category[0] == "L" and code < 0x0250:
+        return "latin"
+    if category[0] in "PS":
+        return "punctuation"
+    return "other"
+
+
+def histogram(text):
+    # 文字ごとの出現数を1回のパス（Counter、C実装）で数え、種類の少ない文字側で分類する
+    result = dict.fromkeys(CLASS_LABELS, 0)
+    for ch, count in Counter(text).items():
+        result[classify(ch)] += count
+    return result
+
+
+def merge(histograms):
+    result = dict.fromkeys(CLASS_LABELS, 0)
+    for hist in histograms:
+        for name, count in hist.items():
+            result[name] += count
+    return result
+
+
+class BalanceAnalyzer:
+    # 本文のハッシュをキーに結果を覚えておき、変わっていない話は数え直さない
+
+    def __init__(self, max_entries=CACHE_SIZE):
+        self.max_entries = max_entries
+        self._cache = OrderedDict()
+
+    def analyze(self, text):
+        key = hashlib.blake2b(text.encode("utf-8"), digest_size=16).digest()
+        hist = self._cache.get(key)
+        if hist is None:
+            hist = histogram(text)
+            self._cache[key] = hist
+            if len(self._cache) > self.max_entries:
+                self._cache.popitem(last=False)
+        else:
+            self._cache.move_to_end(key)
+        return hist
+
+    def analyze_documents(self, docs):
+        # docs: (ラベル, 本文を返す関数) のリスト。話ごとの結果と合計を返す
+        per_doc = [(label, self.analyze(load())) for label, load in docs]
+        return per_doc, merge(hist for _, hist in per_doc)
+
+
+# 小説の地の文で目安とされる文字種の割合（%）
+RECOMMENDED = {"kanji": (20, 30), "hiragana": (60, 70), "katakana": (5, 10)}
+
+
+def evaluate(hist):
+    # 文字種ごとに目安の範囲に入っているか
+    return {name: low <= ratio(hist, name) <= high for name, (low, high) in RECOMMENDED.items()}
+
+
+def letter_total(hist):
+    return sum(count for name, count in hist.items() if name != "space")
+
+
+def ratio(hist, name):
+    total = letter_total(hist)
+    return hist[name] / total * 100 if total else 0.0
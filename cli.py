@@ -0,0 +1,205 @@
+import argparse
+import json
+import os
+import re
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import export
+import report
+from model import Project
+from ngram import MAX_N, MIN_N
+from storage import DATA_DIR, DATABASE_FILE, LEGACY_FILE, ProjectStore
+
+# 画面を開かずに、多数のデータ（novels_data.json・分割保存のフォルダ・SQLiteのデータベース）を
+# まとめてチェック・集計・書き出しする。結果はJSONで出力する。
+#
+#   python cli.py novels/*.json --checks stats,repetition --jobs 8 --output report.json
+#   python cli.py novels_data --export epub --out exports
+#
+# プロジェクトごとに別のプロセスで処理する（tkinterは読み込まない）。
+
+CHECKS = ("stats", "repetition", "balance", "punctuation")
+
+
+class Source:
+    # 読み込み専用で開いたデータ
+
+    def __init__(self, path):
+        self.path = path
+        self.store = None
+        if os.path.isdir(path):
+            self.store = ProjectStore(path, legacy_file="")
+        elif path.lower().endswith(".db"):
+            from sqlstore import SQLiteStore
+            self.store = SQLiteStore(path)
+        if self.store is not None:
+            self.store.read_only = True  # ジャーナルの反映や形式の移行でも書き込まない
+            self.projects, _ = self.store.load()
+        else:
+            # 単一のJSON（旧形式・「プロジェクトを開く」で読む形式）は本文まで含む
+            with open(path, 'r', encoding='utf-8') as f:
+                self.projects = [Project.from_dict(p) for p in json.load(f).get("projects", [])]
+
+    def content(self, project, episode):
+        if self.store is not None:
+            return self.store.content(project, episode)
+        return episode.content or ""
+
+
+_sources = {}  # プロセスごとに開いたデータ（同じファイルの別プロジェクトで使い回す）
+
+
+def open_source(path):
+    if path not in _sources:
+        _sources[path] = Source(path)
+    return _sources[path]
+
+
+def find_sources(paths):
+    # 指定されたパスを処理対象のデータに展開する
+    # データそのものでないフォルダは、中のnovels_data.json・*.db・分割保存のフォルダを探す
+    found = []
+    for path in paths:
+        if os.path.isfile(path) or os.path.exists(os.path.join(path, "library.json")):
+            found.append(path)
+            continue
+        for directory, dirs, files in os.walk(path):
+            if "library.json" in files:
+                found.append(directory)
+                dirs[:] = []
+                continue
+            found.extend(os.path.join(directory, name) for name in sorted(files)
+                         if name == LEGACY_FILE or name.lower().endswith(".db"))
+            dirs.sort()
+    return found
+
+
+def default_sources():
+    # 引数が無ければ、画面と同じ順（SQLite・分割保存・旧形式）で手元のデータを使う
+    for path in (DATABASE_FILE, DATA_DIR, LEGACY_FILE):
+        if os.path.exists(path):
+            return [path]
+    return []
+
+
+def _filename(name):
+    return re.sub(r'[\\/:*?"<>|]', "_", name).strip() or "untitled"
+
+
+def process_project(path, index, options):
+    # 1つのプロジェクトを処理する（作業プロセスで実行される）
+    start = time.perf_counter()
+    source = open_source(path)
+    project = source.projects[index]
+    result = {"source": path, "project": project.name, "id": project.id}
+    docs = report.project_documents(project, source.content)
+    checks = options["checks"]
+
+    if "stats" in checks:
+        result["stats"] = report.stats_report(project)
+    if "repetition" in checks:
+        result["repetition"] = report.repetition_report(docs, n=options["ngram"])
+    if "balance" in checks:
+        result["balance"] = report.balance_report(docs)
+    if "punctuation" in checks:
+        result["punctuation"] = report.punctuation_report(docs, max_issues=options["max_issues"])
+    if options.get("export"):
+        fmt = options["export"]
+        os.makedirs(options["out"], exist_ok=True)
+        name = _filename(project.name)
+        if options["prefix_source"]:
+            # 別のデータの同名プロジェクトと重ならないよう、データのパスを前に付ける
+            name = f"{_filename(os.path.normpath(path))}_{name}"
+        out_path = os.path.join(options["out"], name + export.WRITERS[fmt].extension)
+        chapters = [(ch.title, [(ep.title, source.content(project, ep)) for ep in ch.episodes])
+                    for ch in project.chapters]
+        export.export(fmt, out_path, project.name, chapters, book_id=project.id or "")
+        result["export"] = {"format": fmt, "path": out_path}
+
+    result["seconds"] = round(time.perf_counter() - start, 4)
+    return result
+
+
+def list_projects(path):
+    source = open_source(path)
+    return [project.name for project in source.projects]
+
+
+def run(paths, options, jobs=None, names=None):
+    # すべてのデータのプロジェクトを作業プロセスに振り分け、(結果, エラー) を返す
+    results = []
+    errors = []
+    with ProcessPoolExecutor(max_workers=jobs) as pool:
+        listing = {pool.submit(list_projects, path): path for path in paths}
+        work = {}
+        for future in as_completed(listing):
+            path = listing[future]
+            try:
+                projects = future.result()
+            except Exception as e:
+                errors.append({"source": path, "error": f"{type(e).__name__}: {e}"})
+                continue
+            for index, name in enumerate(projects):
+                if names and name not in names:
+                    continue
+                work[pool.submit(process_project, path, index, options)] = (path, name)
+        for future in as_completed(work):
+            path, name = work[future]
+            try:
+                results.append(future.result())
+            except Exception as e:
+                errors.append({"source": path, "project": name, "error": f"{type(e).__name__}: {e}"})
+    order = {path: i for i, path in enumerate(paths)}
+    results.sort(key=lambda r: (order[r["source"]], r["project"]))
+    return results, errors
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="小説データのチェック・集計・書き出しをまとめて行う")
+    parser.add_argument("paths", nargs="*",
+                        help="novels_data.json・*.db・分割保存のフォルダ、またはそれらを含むフォルダ")
+    parser.add_argument("--checks", default=",".join(CHECKS),
+                        help=f"実行するチェック（カンマ区切り: {', '.join(CHECKS)}。空なら実行しない）")
+    parser.add_argument("--ngram", type=int, default=3, help="繰り返し語句の長さ")
+    parser.add_argument("--max-issues", type=int, default=100, help="プロジェクトごとに出力する問題の上限")
+    parser.add_argument("--project", action="append", help="処理するプロジェクト名（複数指定可）")
+    parser.add_argument("--export", choices=list(export.WRITERS), help="書き出す形式")
+    parser.add_argument("--out", default="exports", help="書き出し先のフォルダ")
+    parser.add_argument("--jobs", type=int, default=None, help="作業プロセスの数（既定: CPUの数）")
+    parser.add_argument("--output", help="結果のJSONを書くファイル（既定: 標準出力）")
+    args = parser.parse_args(argv)
+
+    checks = [c for c in args.checks.split(",") if c]
+    unknown = [c for c in checks if c not in CHECKS]
+    if unknown:
+        parser.error(f"不明なチェック: {', '.join(unknown)}")
+    if not MIN_N <= args.ngram <= MAX_N:
+        parser.error(f"--ngram は{MIN_N}〜{MAX_N}で指定してください")
+    paths = find_sources(args.paths) if args.paths else default_sources()
+    if not paths:
+        parser.error("処理するデータが見つかりません")
+
+    options = {"checks": checks, "ngram": args.ngram, "max_issues": args.max_issues,
+               "export": args.export, "out": args.out, "prefix_source": len(paths) > 1}
+    start = time.perf_counter()
+    results, errors = run(paths, options, args.jobs, set(args.project) if args.project else None)
+    output = {
+        "sources": paths,
+        "projects": results,
+        "errors": errors,
+        "seconds": round(time.perf_counter() - start, 3),
+    }
+
+    text = json.dumps(output, ensure_ascii=False, indent=2)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(text + "\n")
+    else:
+        print(text)
+    return 1 if errors else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,133 @@
+import random
+
+from importer import new_project
+
+# 計測用の合成コーパス
+#
+# 小説らしい文字種の割合（漢字3割弱・ひらがな5割強・カタカナ1割弱）になるように、
+# 語を組み合わせて文・段落・話を作る。会話文・ルビ・三点リーダーや、
+# 句読点チェックに引っかかる表記もときどき混ぜる。乱数の種が同じなら同じ文章になる。
+
+NOUNS = ["少女", "少年", "魔法", "王都", "騎士", "記憶", "約束", "夜明け", "図書館", "手紙", "森", "湖",
+         "学園", "剣", "空", "雨", "月", "扉", "地図", "時計", "城", "旅人", "商人", "祭り", "歌", "風"]
+KATAKANA = ["ギルド", "ポーション", "ダンジョン", "ランプ", "マント", "スープ", "パン", "ノート", "ベル"]
+NAMES = ["アリス", "レオン", "ミレイ", "カイ", "セシル", "ルカ", "エマ", "ノア", "リタ", "ユリウス"]
+ADVERBS = ["静かに", "ふいに", "ゆっくりと", "まっすぐに", "そっと", "思わず", "しばらく", "もう一度"]
+VERBS = ["見つめた", "歩き出した", "思い出した", "笑った", "黙っていた", "うなずいた", "振り返った",
+         "手に取った", "耳を澄ませた", "ため息をついた", "駆け出した", "目を閉じた"]
+ADJECTIVES = ["古い", "小さな", "冷たい", "懐かしい", "静かな", "遠い", "赤い", "不思議な", "やわらかな"]
+PARTICLES = ["は", "が", "を", "に", "で", "と", "の", "へ", "から"]
+LINES = ["それで、どうするの", "待ってくれ", "本当にそれでいいのか", "大丈夫だよ", "ねえ、聞いてる",
+         "そんなはずはない", "行こう", "ありがとう", "まだ間に合うさ"]
+RUBIES = [("魔導書", "グリモワール"), ("聖剣", "せいけん"), ("黄昏", "たそがれ"), ("刹那", "せつな")]
+# 句読点チェックが見つける表記（ごくたまに混ぜる）
+SLIPS = ["、、", "。。", "…", "・・・", "—"]
+
+
+class CorpusGenerator:
+    def __init__(self, seed=0, slip_rate=0.02):
+        self.rng = random.Random(seed)
+        self.slip_rate = slip_rate
+
+    def word(self):
+        rng = self.rng
+        roll = rng.random()
+        if roll < 0.5:
+            return rng.choice(NOUNS)
+        if roll < 0.7:
+            return rng.choice(ADJECTIVES) + rng.choice(NOUNS)
+        if roll < 0.85:
+            return rng.choice(NAMES)
+        if roll < 0.95:
+            return rng.choice(KATAKANA)
+        base, reading = rng.choice(RUBIES)
+        return f"|{base}《{reading}》"
+
+    def sentence(self):
+        rng = self.rng
+        parts = []
+        for _ in range(rng.randint(1, 3)):
+            parts.append(self.word() + rng.choice(PARTICLES))
+        if rng.random() < 0.5:
+            parts.append(rng.choice(ADVERBS))
+        parts.append(rng.choice(VERBS))
+        if rng.random() < 0.3:
+            parts.insert(rng.randint(1, len(parts) - 1), "、")
+        text = "".join(parts)
+        if rng.random() < self.slip_rate:
+            text += rng.choice(SLIPS)
+        return text + "。"
+
+    def paragraph(self):
+        rng = self.rng
+        if rng.random() < 0.25:
+            line = rng.choice(LINES)
+            if rng.random() < 0.3:
+                line += "……"
+            return f"「{line}」"
+        return "　" + "".join(self.sentence() for _ in range(rng.randint(1, 5)))
+
+    def text(self, chars):
+        # chars字ほどの本文（段落の途中では切らないので少し長くなる）
+        paragraphs = []
+        size = 0
+        while size < chars:
+            paragraph = self.paragraph()
+            paragraphs.append(paragraph)
+            size += len(paragraph) + 1
+        return "\n".join(paragraphs)
+
+    def revise(self, text):
+        # 推敲前の版: 段落をいくつか消したり書き換えたりしたもの
+        rng = self.rng
+        paragraphs = text.split("\n")
+        for _ in range(max(1, len(paragraphs) // 10)):
+            i = rng.randrange(len(paragraphs))
+            if rng.random() < 0.5 and len(paragraphs) > 1:
+                del paragraphs[i]
+            else:
+                paragraphs[i] = self.paragraph()
+        return "\n".join(paragraphs)
+
+    def project(self, name, chapters=10, episodes=10, episode_chars=4000, versions=0, characters=8):
+        # (プロジェクト, {話ID: 古い順の版のリスト（最後が現在の本文）})
+        rng = self.rng
+        chs = []
+        drafts = []
+        for c in range(chapters):
+            eps = []
+            for e in range(episodes):
+                content = self.text(episode_chars)
+                eps.append({"title": f"第{e + 1}話", "content": content,
+                            "memo": rng.choice(LINES) if rng.random() < 0.3 else "",
+                            "word_count": len(content)})
+                history = [content]
+                for _ in range(versions - 1):
+                    history.append(self.revise(history[-1]))
+                drafts.append(history[::-1] if versions else [])
+            chs.append({"title": f"第{c + 1}章", "episodes": eps})
+        project = new_project(name, chs)
+        project.characters = [{"name": NAMES[i % len(NAMES)], "age": str(rng.randint(10, 60)),
+                                  "personality": "", "background": self.text(200)}
+                                 for i in range(characters)]
+        project.settings = [{"name": rng.choice(NOUNS), "detail": self.text(200)}
+                               for _ in range(characters // 2)]
+        episodes_by_order = [ep for ch in project.chapters for ep in ch.episodes]
+        history = {ep.id: texts for ep, texts in zip(episodes_by_order, drafts) if texts}
+        return project, history
+
+
+def generate_library(projects=1, chapters=10, episodes=10, episode_chars=4000, versions=0, characters=8, seed=0):
+    # 計測用のライブラリ。(プロジェクトのリスト, {(プロジェクトID, 話ID): 版のリスト})
+    generator = CorpusGenerator(seed)
+    library = []
+    history = {}
+    for p in range(projects):
+        project, drafts = generator.project(f"作品{p + 1}", chapters, episodes, episode_chars, versions, characters)
+        library.append(project)
+        history.update(((project.id, eid), texts) for eid, texts in drafts.items())
+    return library, history
+
+
+def library_chars(library):
+    return sum(ep.word_count for p in library for ch in p.chapters for ep in ch.episodes)
@@ -0,0 +1,334 @@
+import bisect
+import hashlib
+import re
+import threading
+import time
+from collections import OrderedDict
+
+from profiler import timed
+
+# 2つの本文の差分（バージョンの比較用）
+#
+# 日本語の文章には単語の区切りが無いので、まず文（。！？や改行まで）を単位に比べ、
+# 変わった文のまとまり（変更箇所）の中だけを1字単位で比べ直す。
+#
+# 文の比較はpatience diff（両方に1度ずつしか出てこない文を手がかりに区切る）で、
+# 手がかりの無い部分と1字単位の比較はMyersの方法（中央の一致区間で分割していくので
+# メモリは長さに比例する分だけ）で行う。1か所で調べる量には上限があり、超えた部分は
+# 丸ごと書き換えたものとみなす（全く別の文章どうしでも時間がかからない）。
+# 比較全体にも時間の上限があり、超えたら残りの部分は同じく丸ごと置き換えとする。
+
+SENTENCE = re.compile(r"[^。！？!?\n]*(?:[。！？!?]+[」』）)】]*\n?|\n)|[^。！？!?\n]+")
+MAX_D = 500     # 1か所の分割で調べる手数の上限（手数の2乗に比例して時間がかかる）
+TIMEOUT = 0.5   # 比較全体の時間の上限（秒）
+CACHE_SIZE = 16
+
+
+def split_sentences(text):
+    return SENTENCE.findall(text)
+
+
+# Myersの方法（線形メモリ版）
+def _split(a, a0, a1, b, b0, b1, max_d, deadline):
+    # 最短の編集の道筋を前後から同時にたどり、出会った点 (x, y) を返す（max_d手で出会わなければNone）
+    n = a1 - a0
+    m = b1 - b0
+    delta = n - m
+    front = delta & 1  # 奇数なら前からたどった側で出会いを調べる
+    size = 2 * max_d + 2
+    forward = [-1] * size
+    backward = [-1] * size
+    forward[max_d + 1] = 0
+    backward[max_d + 1] = 0
+    # 表の外にはみ出した斜線はそれ以上調べない
+    k1start = k1end = k2start = k2end = 0
+    for d in range(max_d):
+        if d & 31 == 31 and time.perf_counter() > deadline:
+            return None
+        for k in range(-d + k1start, d + 1 - k1end, 2):
+            i = max_d + k
+            if k == -d or (k != d and forward[i - 1] < forward[i + 1]):
+                x = forward[i + 1]
+            else:
+                x = forward[i - 1] + 1
+            y = x - k
+            while x < n and y < m and a[a0 + x] == b[b0 + y]:
+                x += 1
+                y += 1
+            forward[i] = x
+            if x > n:
+                k1end += 2
+            elif y > m:
+                k1start += 2
+            elif front:
+                j = max_d + delta - k
+                if 0 <= j < size and backward[j] != -1 and x >= n - backward[j]:
+                    return a0 + x, b0 + y
+        for k in range(-d + k2start, d + 1 - k2end, 2):
+            i = max_d + k
+            if k == -d or (k != d and backward[i - 1] < backward[i + 1]):
+                x = backward[i + 1]
+            else:
+                x = backward[i - 1] + 1
+            y = x - k
+            while x < n and y < m and a[a1 - 1 - x] == b[b1 - 1 - y]:
+                x += 1
+                y += 1
+            backward[i] = x
+            if x > n:
+                k2end += 2
+            elif y > m:
+                k2start += 2
+            elif not front:
+                j = max_d + delta - k
+                if 0 <= j < size and forward[j] != -1 and forward[j] >= n - x:
+                    x = forward[j]
+                    return a0 + x, b0 + x - (delta - k)
+    return None
+
+
+def _myers(a, a0, a1, b, b0, b1, blocks, deadline, rewrite=False):
+    # a[a0:a1] と b[b0:b1] の一致区間 (i, j, 長さ) を順にblocksに足す
+    # rewriteなら、半分以上が食い違う部分は細かく比べずに丸ごと置き換えとする（書き直した段落など）
+    start = len(blocks)
+    tail = []
+    while True:
+        # 前後の共通部分は先に除く
+        i, j = a0, b0
+        while i < a1 and j < b1 and a[i] == b[j]:
+            i += 1
+            j += 1
+        if i > a0:
+            blocks.append((a0, b0, i - a0))
+        a0, b0 = i, j
+        i, j = a1, b1
+        while i > a0 and j > b0 and a[i - 1] == b[j - 1]:
+            i -= 1
+            j -= 1
+        if i < a1:
+            tail.append((i, j, a1 - i))
+        a1, b1 = i, j
+        if a0 == a1 or b0 == b1:
+            break
+        length = a1 - a0 + b1 - b0
+        point = _split(a, a0, a1, b, b0, b1, min(length // 4 + 1 if rewrite else (length + 1) // 2, MAX_D),
+                       deadline)
+        if point is None:
+            break  # 違いが多すぎるので、残りは丸ごと置き換え
+        x, y = point
+        _myers(a, a0, x, b, b0, y, blocks, deadline, rewrite)
+        a0, b0 = x, y  # 後半は繰り返しで続ける
+    blocks.extend(reversed(tail))
+    return len(blocks) - start
+
+
+# patience diff（文の比較）
+def _patience(a, a0, a1, b, b0, b1, blocks, deadline):
+    counts = {}
+    for i in range(a0, a1):
+        counts[a[i]] = counts.get(a[i], 0) + 1
+    unique_a = {a[i]: i for i in range(a0, a1) if counts[a[i]] == 1}
+    counts = {}
+    for j in range(b0, b1):
+        counts[b[j]] = counts.get(b[j], 0) + 1
+    pairs = [(unique_a[b[j]], j) for j in range(b0, b1) if counts[b[j]] == 1 and b[j] in unique_a]
+    if not pairs:
+        _myers(a, a0, a1, b, b0, b1, blocks, deadline)
+        return
+
+    # 両方で1度ずつの文のうち、順序の入れ替わらない最長の並び（最長増加部分列）を手がかりにする
+    tops = []   # 長さごとの末尾の要素の位置（aの位置の昇順）
+    links = []  # 要素 -> 1つ前の要素
+    top_values = []
+    for n, (i, j) in enumerate(pairs):
+        pos = bisect.bisect_left(top_values, i)
+        links.append(tops[pos - 1] if pos else -1)
+        if pos == len(tops):
+            tops.append(n)
+            top_values.append(i)
+        else:
+            tops[pos] = n
+            top_values[pos] = i
+    anchors = []
+    n = tops[-1]
+    while n >= 0:
+        anchors.append(pairs[n])
+        n = links[n]
+    anchors.reverse()
+
+    for i, j in anchors:
+        if i > a0 or j > b0:
+            _patience(a, a0, i, b, b0, j, blocks, deadline)
+        blocks.append((i, j, 1))
+        a0, b0 = i + 1, j + 1
+    if a0 < a1 or b0 < b1:
+        _patience(a, a0, a1, b, b0, b1, blocks, deadline)
+
+
+def matching_blocks(a, b, patience=False, deadline=None):
+    # 一致区間 (i, j, 長さ) のリスト（隣り合うものはまとめる）
+    if deadline is None:
+        deadline = time.perf_counter() + TIMEOUT
+    blocks = []
+    if patience:
+        _patience(a, 0, len(a), b, 0, len(b), blocks, deadline)
+    else:
+        _myers(a, 0, len(a), b, 0, len(b), blocks, deadline)
+    return _merge(blocks)
+
+
+def _merge(blocks):
+    merged = []
+    for i, j, size in blocks:
+        if merged and merged[-1][0] + merged[-1][2] == i and merged[-1][1] + merged[-1][2] == j:
+            merged[-1] = (merged[-1][0], merged[-1][1], merged[-1][2] + size)
+        elif size:
+            merged.append((i, j, size))
+    return merged
+
+
+def opcodes(blocks, n, m, i=0, j=0):
+    # difflib.SequenceMatcher.get_opcodes() と同じ形 (tag, i1, i2, j1, j2) に直す
+    ops = []
+    for bi, bj, size in list(blocks) + [(n, m, 0)]:
+        if i < bi and j < bj:
+            ops.append(("replace", i, bi, j, bj))
+        elif i < bi:
+            ops.append(("delete", i, bi, j, bj))
+        elif j < bj:
+            ops.append(("insert", i, bi, j, bj))
+        if size:
+            ops.append(("equal", bi, bi + size, bj, bj + size))
+        i, j = bi + size, bj + size
+    return ops
+
+
+def _cleanup(ops):
+    # 変更に挟まれた短い一致（「の」「に」だけ合っているなど）は変更に含めて読みやすくする
+    result = []
+    for n, op in enumerate(ops):
+        if op[0] == "equal" and 0 < n < len(ops) - 1:
+            size = op[2] - op[1]
+            before = ops[n - 1]
+            after = ops[n + 1]
+            if (size <= max(before[2] - before[1], before[4] - before[3])
+                    and size <= max(after[2] - after[1], after[4] - after[3])):
+                op = ("replace",) + op[1:]
+        if result and op[0] != "equal" and result[-1][0] != "equal":
+            last = result.pop()
+            i1, j1 = last[1], last[3]
+            i2, j2 = op[2], op[4]
+            tag = "replace" if i1 < i2 and j1 < j2 else ("delete" if i1 < i2 else "insert")
+            op = (tag, i1, i2, j1, j2)
+        result.append(op)
+    return result
+
+
+class Hunk:
+    # 1つの変更箇所（旧 a[a1:a2] が 新 b[b1:b2] になった）と、その中の1字単位の差分
+    __slots__ = ("a1", "a2", "b1", "b2", "ops")
+
+    def __init__(self, a1, a2, b1, b2, ops):
+        self.a1 = a1
+        self.a2 = a2
+        self.b1 = b1
+        self.b2 = b2
+        self.ops = ops
+
+
+class Diff:
+    def __init__(self, a, b, hunks):
+        self.a = a
+        self.b = b
+        self.hunks = hunks
+
+    def opcodes(self):
+        # 本文全体の (tag, i1, i2, j1, j2)（変更箇所のあいだは "equal"）
+        ops = []
+        i = j = 0
+        for hunk in self.hunks:
+            if hunk.a1 > i:
+                ops.append(("equal", i, hunk.a1, j, hunk.b1))
+            ops.extend(hunk.ops)
+            i, j = hunk.a2, hunk.b2
+        if i < len(self.a):
+            ops.append(("equal", i, len(self.a), j, len(self.b)))
+        return ops
+
+    def changed(self):
+        # (削除された字数, 追加された字数)
+        deleted = inserted = 0
+        for hunk in self.hunks:
+            for tag, i1, i2, j1, j2 in hunk.ops:
+                if tag != "equal":
+                    deleted += i2 - i1
+                    inserted += j2 - j1
+        return deleted, inserted
+
+    def revert(self, selected):
+        # 新しい本文のうち、選んだ変更箇所（番号）だけを古い本文に戻したもの
+        parts = []
+        pos = 0
+        for n in sorted(set(selected)):
+            hunk = self.hunks[n]
+            parts.append(self.b[pos:hunk.b1])
+            parts.append(self.a[hunk.a1:hunk.a2])
+            pos = hunk.b2
+        parts.append(self.b[pos:])
+        return "".join(parts)
+
+
+@timed("diff.compare")
+def compare(a, b):
+    # 古い本文aと新しい本文bの差分
+    sa = split_sentences(a)
+    sb = split_sentences(b)
+    ids = {}
+    ia = [ids.setdefault(s, len(ids)) for s in sa]
+    ib = [ids.setdefault(s, len(ids)) for s in sb]
+    starts_a = _offsets(sa)
+    starts_b = _offsets(sb)
+
+    deadline = time.perf_counter() + TIMEOUT
+    hunks = []
+    for tag, i1, i2, j1, j2 in opcodes(matching_blocks(ia, ib, True, deadline), len(ia), len(ib)):
+        if tag == "equal":
+            continue
+        a1, a2 = starts_a[i1], starts_a[i2]
+        b1, b2 = starts_b[j1], starts_b[j2]
+        if tag == "replace":
+            blocks = []
+            _myers(a, a1, a2, b, b1, b2, blocks, deadline, rewrite=True)
+            ops = _cleanup(opcodes(_merge(blocks), a2, b2, a1, b1))
+        else:
+            ops = [(tag, a1, a2, b1, b2)]
+        hunks.append(Hunk(a1, a2, b1, b2, ops))
+    return Diff(a, b, hunks)
+
+
+def _offsets(parts):
+    # 各部分の先頭の位置（末尾に全体の長さ）
+    offsets = [0]
+    for part in parts:
+        offsets.append(offsets[-1] + len(part))
+    return offsets
+
+
+_cache = OrderedDict()  # (旧の要約, 新の要約) -> Diff
+_cache_lock = threading.Lock()  # 作業スレッドから呼ばれる
+
+
+def cached_compare(a, b):
+    # 同じ2つの本文の比較は覚えておく（同じ版どうしを何度も比べ直すことが多い）
+    key = (hashlib.sha1(a.encode("utf-8")).digest(), hashlib.sha1(b.encode("utf-8")).digest())
+    with _cache_lock:
+        result = _cache.get(key)
+        if result is not None:
+            _cache.move_to_end(key)
+            return result
+    result = compare(a, b)
+    with _cache_lock:
+        _cache[key] = result
+        while len(_cache) > CACHE_SIZE:
+            _cache.popitem(last=False)
+    return result
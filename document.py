@@ -0,0 +1,116 @@
+PAGE_THRESHOLD = 200000  # これより長い話は分割して表示する（文字数）
+PAGE_LINES = 500         # 分割表示の1ページの行数
+
+
+def widget_units(text):
+    # Tcl 8.6のTextウィジェットでの長さ（基本多言語面の外の文字（𠮷など）は2と数える）
+    return len(text.encode("utf-16-le")) // 2
+
+
+def char_column(line, col):
+    # ウィジェットの桁colを、lineの中の文字の位置に直す
+    if line.isascii() or (col <= len(line) and widget_units(line[:col]) == col):
+        return col  # colより前に2と数える文字が無い
+    units = 0
+    for i, ch in enumerate(line):
+        if units >= col:
+            return i
+        units += 2 if ord(ch) > 0xFFFF else 1
+    return len(line)
+
+
+class Document:
+    # 編集中の本文を行のリストで持つ
+    #
+    # Textウィジェットの位置（行.桁）をそのまま使えるので、挿入・削除のたびに
+    # その行だけを書き換えればよく、保存時にウィジェットから全文を読み直さずに済む。
+    # 分割表示では、ウィジェットには first 行目から count 行だけを出しておく。
+    # wide なら、ウィジェットの桁は基本多言語面の外の文字を2と数えたもの（Tcl 8.6）。
+
+    def __init__(self, text="", wide=False):
+        self.wide = wide
+        self.reset(text)
+
+    def reset(self, text, window_lines=None, owner=None):
+        self.owner = owner  # 表示中の話のID
+        self._lines = text.split("\n")
+        self.length = len(text)
+        self.modified = False
+        self.stale = False  # 変化を追えなかった（元に戻す・やり直し）
+        self.paged = window_lines is not None
+        self.window_lines = window_lines or len(self._lines)
+        self.first = 1
+        self.count = min(self.window_lines, len(self._lines))
+
+    def text(self):
+        return "\n".join(self._lines)
+
+    @property
+    def line_count(self):
+        return len(self._lines)
+
+    # ウィジェットに出している範囲
+    def window_text(self):
+        return "\n".join(self._lines[self.first - 1:self.first - 1 + self.count])
+
+    def end_index(self):
+        # ウィジェットの "end-1c" と一致するはずの位置（食い違えば追えていない変化がある）
+        last = self._lines[self.first - 1 + self.count - 1]
+        return f"{self.count}.{widget_units(last) if self.wide else len(last)}"
+
+    def set_window(self, first):
+        first = max(1, min(first, len(self._lines)))
+        self.first = first
+        self.count = min(self.window_lines, len(self._lines) - first + 1)
+
+    def page(self):
+        # (今のページ, 全ページ数)
+        total = (len(self._lines) + self.window_lines - 1) // self.window_lines
+        return (self.first - 1) // self.window_lines + 1, max(1, total)
+
+    # ウィジェット上の位置（行は1始まり）での編集
+    def _column(self, i, col):
+        return char_column(self._lines[i], col) if self.wide else col
+
+    def insert(self, line, col, text):
+        i = self.first - 1 + line - 1
+        current = self._lines[i]
+        col = self._column(i, col)
+        parts = text.split("\n")
+        if len(parts) == 1:
+            self._lines[i] = current[:col] + text + current[col:]
+        else:
+            parts[0] = current[:col] + parts[0]
+            parts[-1] = parts[-1] + current[col:]
+            self._lines[i:i + 1] = parts
+            self.count += len(parts) - 1
+        self.length += len(text)
+        self.modified = True
+
+    def delete(self, line1, col1, line2, col2):
+        i = self.first - 1 + line1 - 1
+        j = self.first - 1 + line2 - 1
+        col1 = self._column(i, col1)
+        col2 = self._column(j, col2)
+        if (i, col1) >= (j, col2):
+            return
+        lines = self._lines
+        if i == j:
+            removed = col2 - col1
+        else:
+            removed = len(lines[i]) - col1 + sum(len(line) + 1 for line in lines[i + 1:j]) + 1 + col2
+        lines[i:j + 1] = [lines[i][:col1] + lines[j][col2:]]
+        self.count -= j - i
+        self.length -= removed
+        self.modified = True
+
+    def sync(self, window_text):
+        # 追えなかった変化のあと、ウィジェットに出している範囲だけを読み直す
+        start = self.first - 1
+        old = self._lines[start:start + self.count]
+        new = window_text.split("\n")
+        self._lines[start:start + self.count] = new
+        self.length += len(window_text) - (sum(len(line) for line in old) + len(old) - 1)
+        self.count = len(new)
+        self.stale = False
+        self.modified = True
@@ -0,0 +1,50 @@
+class TextChangeTracker:
+    # Textウィジェットのコマンドを差し替え、insert/deleteをその場で通知する
+    # （<KeyRelease>で全文を読み直さずに済むようにするため）
+    #
+    # on_insert(index, text)  挿入直前に呼ばれる
+    # on_delete(index1, index2, text)  削除直前に呼ばれる。全文削除のときtextはNone
+    # on_reset()  元に戻す・やり直しなど、内容の変化を追えなかったとき
+
+    def __init__(self, widget, on_insert=None, on_delete=None, on_reset=None):
+        self.widget = widget
+        self.on_insert = on_insert
+        self.on_delete = on_delete
+        self.on_reset = on_reset
+        self._orig = widget._w + "_orig"
+        widget.tk.call("rename", widget._w, self._orig)
+        widget.tk.createcommand(widget._w, self._proxy)
+
+    def call(self, *args):
+        return self.widget.tk.call((self._orig,) + args)
+
+    def _is_whole(self, index1, index2):
+        return (self.call("compare", index1, "<=", "1.0") and
+                self.call("compare", index2, ">=", "end-1c"))
+
+    def _deleted_range(self, index1, index2):
+        if index2 is None:
+            index2 = f"{index1}+1c"
+        # 末尾の改行は削除されないので範囲から外す
+        if self.call("compare", index2, ">", "end-1c"):
+            index2 = "end-1c"
+        if self._is_whole(index1, index2):
+            return index1, index2, None
+        return index1, index2, self.call("get", index1, index2)
+
+    def _proxy(self, *args):
+        cmd = args[0] if args else ""
+        if cmd == "insert" and self.on_insert:
+            self.on_insert(args[1], "".join(args[2::2]))
+        elif cmd == "delete" and self.on_delete:
+            self.on_delete(*self._deleted_range(args[1], args[2] if len(args) > 2 else None))
+        elif cmd == "replace":
+            if self.on_delete:
+                self.on_delete(*self._deleted_range(args[1], args[2]))
+            if self.on_insert:
+                self.on_insert(args[1], "".join(args[3::2]))
+        elif cmd == "edit" and len(args) > 1 and args[1] in ("undo", "redo") and self.on_reset:
+            result = self.call(*args)
+            self.on_reset()
+            return result
+        return self.call(*args)
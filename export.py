@@ -0,0 +1,303 @@
+import html
+import os
+import re
+import zipfile
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+
+from profiler import timed
+
+RENDER_WORKERS = 4
+
+# ルビ記法: 「|漢字《かんじ》」「｜漢字《かんじ》」と、縦棒なしで漢字の直後に《》を置く形
+RUBY = re.compile(r"[|｜]([^|｜《》\n]+)《([^《》\n]+)》|([々〆〇ヶ㐀-鿿豈-﫿]+)《([^《》\n]+)》")
+
+# Markdownで行頭にあると見出し・箇条書き・区切り線・コードなどになるもの
+MARKDOWN_INDENT = re.compile(r"^[ \t]+")
+MARKDOWN_BLOCK = re.compile(r"^(?:([#>*+\-=_`~|])|(\d+)([.)]))")
+
+# 形式名 -> 書き出しクラス（@writerで登録）
+WRITERS = {}
+
+
+def writer(name):
+    def register(cls):
+        cls.name = name
+        WRITERS[name] = cls
+        return cls
+    return register
+
+
+def escape_markdown_line(line):
+    # 本文の1行がMarkdownの書式として解釈されないよう、行頭の記号を打ち消す
+    # （「* * *」の場面転換が区切り線に、「1.」が番号付きリストになるなど）
+    line = MARKDOWN_INDENT.sub(lambda m: "&nbsp;" * len(m.group()), line)  # 4字以上の字下げはコードになる
+    return MARKDOWN_BLOCK.sub(lambda m: "\\" + m.group(1) if m.group(1) else m.group(2) + "\\" + m.group(3),
+                              line)
+
+
+def convert_ruby(text, replace):
+    # replace(親文字, ルビ) の結果でルビ記法を置き換える。ルビ以外の部分はそのまま
+    def sub(match):
+        base, reading = (match.group(1), match.group(2)) if match.group(1) else (match.group(3), match.group(4))
+        return replace(base, reading)
+    return RUBY.sub(sub, text)
+
+
+def select_episodes(chapters, chapter_indices=None, first=None, last=None):
+    # chapters: (章タイトル, [(話タイトル, 本文), ...]) のリスト
+    # chapter_indices: 書き出す章の番号（Noneならすべて）。first/last: 通し番号（1始まり）での話の範囲
+    selected = []
+    number = 0
+    for i, (title, episodes) in enumerate(chapters):
+        kept = []
+        for episode in episodes:
+            number += 1
+            if first is not None and number < first:
+                continue
+            if last is not None and number > last:
+                continue
+            kept.append(episode)
+        if kept and (chapter_indices is None or i in chapter_indices):
+            selected.append((title, kept))
+    return selected
+
+
+class ExportWriter:
+    # 書き出し形式の基底クラス
+    #
+    # render_chapter() は作業スレッドで並行に呼ばれるので、書き出し先の状態には触れない。
+    # write_chapter() は章の順に1つずつ呼ばれ、描画済みの章をファイルへ流し込む。
+    extension = ".txt"
+    label = ""
+
+    def __init__(self, path, title, book_id=""):
+        self.path = path
+        self.title = title
+        self.book_id = book_id
+
+    def open(self):
+        self.file = open(self.path, 'w', encoding='utf-8')
+
+    def render_chapter(self, index, title, episodes):
+        raise NotImplementedError
+
+    def write_chapter(self, index, title, rendered):
+        self.file.write(rendered)
+
+    def close(self):
+        self.file.close()
+
+
+@writer("text")
+class TextWriter(ExportWriter):
+    extension = ".txt"
+    label = "テキスト"
+
+    def open(self):
+        super().open()
+        self.file.write(f"{self.title}\n" + "=" * 80 + "\n\n")
+
+    def render_chapter(self, index, title, episodes):
+        parts = [f"\n{'=' * 80}\n{title}\n{'=' * 80}\n\n"]
+        for ep_title, content in episodes:
+            parts.append(f"\n{'-' * 60}\n{ep_title}\n{'-' * 60}\n\n{content}\n\n")
+        return "".join(parts)
+
+
+@writer("markdown")
+class MarkdownWriter(ExportWriter):
+    extension = ".md"
+    label = "Markdown"
+
+    def open(self):
+        super().open()
+        self.file.write(f"# {self.title}\n\n")
+
+    def render_chapter(self, index, title, episodes):
+        parts = [f"## {title}\n\n"]
+        for ep_title, content in episodes:
+            parts.append(f"### {ep_title}\n\n")
+            # 改行をそのまま段落として扱う（Markdownでは空行で段落が分かれる）
+            body = convert_ruby(html.escape(content, quote=False),
+                                lambda base, reading: f"<ruby>{base}<rt>{reading}</rt></ruby>")
+            parts.append("\n\n".join(escape_markdown_line(line) if line.strip() else "&nbsp;"
+                                     for line in body.split("\n")))
+            parts.append("\n\n")
+        return "".join(parts)
+
+
+@writer("narou")
+class NarouWriter(TextWriter):
+    # 小説投稿サイト向け: ルビを「|漢字《かんじ》」にそろえ、話の区切りを簡潔にする
+    extension = ".txt"
+    label = "小説投稿サイト（ルビ |《》）"
+    bar = "|"
+
+    def open(self):
+        ExportWriter.open(self)
+        self.file.write(f"{self.title}\n\n")
+
+    def render_chapter(self, index, title, episodes):
+        parts = [f"【{title}】\n\n"]
+        for ep_title, content in episodes:
+            body = convert_ruby(content, lambda base, reading: f"{self.bar}{base}《{reading}》")
+            parts.append(f"◆{ep_title}\n\n{body}\n\n")
+        return "".join(parts)
+
+
+@writer("aozora")
+class AozoraWriter(NarouWriter):
+    # 青空文庫形式: ルビは全角縦棒「｜」、見出しは注記で示す
+    label = "青空文庫形式（ルビ ｜《》）"
+    bar = "｜"
+
+    def open(self):
+        ExportWriter.open(self)
+        self.file.write(f"{self.title}\n\n")
+
+    def render_chapter(self, index, title, episodes):
+        parts = [f"［＃改ページ］\n［＃大見出し］{title}［＃大見出し終わり］\n\n"]
+        for ep_title, content in episodes:
+            body = convert_ruby(content, lambda base, reading: f"{self.bar}{base}《{reading}》")
+            parts.append(f"［＃中見出し］{ep_title}［＃中見出し終わり］\n\n{body}\n\n")
+        return "".join(parts)
+
+
+@writer("epub")
+class EpubWriter(ExportWriter):
+    # EPUB3: XHTMLを章ごとにzipへ書き込み、目次とパッケージ文書は最後にまとめて書く
+    extension = ".epub"
+    label = "EPUB"
+
+    CONTAINER = (
+        '<?xml version="1.0" encoding="UTF-8"?>\n'
+        '<container version="1.0" xmlns="urn:oasis:names:tc:opendocument:xmlns:container">\n'
+        '<rootfiles><rootfile full-path="OEBPS/content.opf" media-type="application/oebps-package+xml"/></rootfiles>\n'
+        '</container>\n'
+    )
+    STYLE = "body { line-height: 1.8; } p { margin: 0; text-indent: 0; } h2, h3 { margin: 1em 0; }\n"
+
+    def open(self):
+        self.zip = zipfile.ZipFile(self.path, 'w')
+        # mimetypeは先頭に無圧縮で置く決まり
+        self.zip.writestr(zipfile.ZipInfo("mimetype"), "application/epub+zip", compress_type=zipfile.ZIP_STORED)
+        self.zip.writestr("META-INF/container.xml", self.CONTAINER, compress_type=zipfile.ZIP_DEFLATED)
+        self.zip.writestr("OEBPS/style.css", self.STYLE, compress_type=zipfile.ZIP_DEFLATED)
+        self.chapters = []  # (ファイル名, 章タイトル, [(アンカー, 話タイトル)])
+
+    def _page(self, title, body):
+        return (
+            '<?xml version="1.0" encoding="UTF-8"?>\n'
+            '<!DOCTYPE html>\n'
+            '<html xmlns="http://www.w3.org/1999/xhtml" xmlns:epub="http://www.idpf.org/2007/ops" '
+            'xml:lang="ja" lang="ja">\n'
+            f'<head><meta charset="UTF-8"/><title>{html.escape(title)}</title>'
+            '<link rel="stylesheet" type="text/css" href="style.css"/></head>\n'
+            f'<body>\n{body}</body>\n</html>\n'
+        )
+
+    def render_chapter(self, index, title, episodes):
+        parts = [f"<h2>{html.escape(title)}</h2>\n"]
+        for i, (ep_title, content) in enumerate(episodes):
+            parts.append(f'<h3 id="ep{i + 1}">{html.escape(ep_title)}</h3>\n')
+            body = convert_ruby(html.escape(content, quote=False),
+                                lambda base, reading: f"<ruby>{base}<rt>{reading}</rt></ruby>")
+            for line in body.split("\n"):
+                parts.append(f"<p>{line}</p>\n" if line else "<p><br/></p>\n")
+        return self._page(title, "".join(parts)).encode("utf-8"), [ep_title for ep_title, _ in episodes]
+
+    def write_chapter(self, index, title, rendered):
+        data, episode_titles = rendered
+        filename = f"chapter{index + 1:04d}.xhtml"
+        self.zip.writestr(f"OEBPS/{filename}", data, compress_type=zipfile.ZIP_DEFLATED)
+        self.chapters.append((filename, title, [(f"ep{i + 1}", t) for i, t in enumerate(episode_titles)]))
+
+    def close(self):
+        nav = ['<nav epub:type="toc" id="toc"><h1>目次</h1>\n<ol>\n']
+        for filename, title, episodes in self.chapters:
+            nav.append(f'<li><a href="{filename}">{html.escape(title)}</a>')
+            if episodes:
+                nav.append("<ol>")
+                nav.extend(f'<li><a href="{filename}#{anchor}">{html.escape(t)}</a></li>' for anchor, t in episodes)
+                nav.append("</ol>")
+            nav.append("</li>\n")
+        nav.append("</ol>\n</nav>\n")
+        self.zip.writestr("OEBPS/nav.xhtml", self._page("目次", "".join(nav)), compress_type=zipfile.ZIP_DEFLATED)
+
+        modified = datetime.now(timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ")
+        manifest = ['<item id="nav" href="nav.xhtml" media-type="application/xhtml+xml" properties="nav"/>',
+                    '<item id="style" href="style.css" media-type="text/css"/>']
+        spine = ['<itemref idref="nav"/>']
+        for i, (filename, _, _) in enumerate(self.chapters):
+            manifest.append(f'<item id="c{i + 1}" href="{filename}" media-type="application/xhtml+xml"/>')
+            spine.append(f'<itemref idref="c{i + 1}"/>')
+        opf = (
+            '<?xml version="1.0" encoding="UTF-8"?>\n'
+            '<package xmlns="http://www.idpf.org/2007/opf" version="3.0" unique-identifier="bookid" xml:lang="ja">\n'
+            '<metadata xmlns:dc="http://purl.org/dc/elements/1.1/">\n'
+            f'<dc:identifier id="bookid">urn:novel:{html.escape(self.book_id or self.title)}</dc:identifier>\n'
+            f'<dc:title>{html.escape(self.title)}</dc:title>\n'
+            '<dc:language>ja</dc:language>\n'
+            f'<meta property="dcterms:modified">{modified}</meta>\n'
+            '</metadata>\n'
+            f'<manifest>\n{chr(10).join(manifest)}\n</manifest>\n'
+            f'<spine page-progression-direction="ltr">\n{chr(10).join(spine)}\n</spine>\n'
+            '</package>\n'
+        )
+        self.zip.writestr("OEBPS/content.opf", opf, compress_type=zipfile.ZIP_DEFLATED)
+        self.zip.close()
+
+
+@timed("export")
+def _render(out, index, title, episodes):
+    # 本文が「本文を返す関数」なら、この章を描画するときに（作業スレッドで）読む
+    episodes = [(ep_title, body() if callable(body) else body) for ep_title, body in episodes]
+    return out.render_chapter(index, title, episodes)
+
+
+def export(fmt, path, title, chapters, task=None, book_id="", workers=RENDER_WORKERS):
+    # chapters: (章タイトル, [(話タイトル, 本文または本文を返す関数), ...]) のリスト
+    # （select_episodesで絞り込み済み）
+    # 章は作業スレッドで並行に描画し、章の順にファイルへ流し込む。
+    # 描画済みで書き込み待ちの章は最大 workers*2 個までに抑える。
+    tmp = path + ".tmp"
+    out = WRITERS[fmt](tmp, title, book_id)
+    out.open()
+    total = len(chapters) or 1
+    closed = False
+    try:
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="export") as pool:
+            pending = deque()
+            chapter_iter = iter(enumerate(chapters))
+
+            def fill():
+                while len(pending) < workers * 2:
+                    try:
+                        i, (ch_title, episodes) = next(chapter_iter)
+                    except StopIteration:
+                        return
+                    pending.append((i, ch_title, pool.submit(_render, out, i, ch_title, episodes)))
+
+            fill()
+            while pending:
+                i, ch_title, future = pending.popleft()
+                out.write_chapter(i, ch_title, future.result())
+                if task is not None:
+                    task.report((i + 1) / total)
+                fill()
+        closed = True
+        out.close()
+    except BaseException:
+        if not closed:
+            # close()自体が失敗したときは閉じ直さない（別の例外で元の例外が隠れる）
+            try:
+                out.close()
+            except Exception:
+                pass
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        raise
+    # 書き終わってから置き換えるので、途中で失敗しても以前のファイルは残る
+    os.replace(tmp, path)
@@ -0,0 +1,229 @@
+import os
+import re
+
+from model import Chapter, Project
+from storage import ensure_ids
+
+TEXT_EXTENSIONS = (".txt", ".md", ".markdown")
+DETECT_BYTES = 64 * 1024
+DEFAULT_CHAPTER = "第1章"
+
+_NUMBER = r"[0-9０-９一二三四五六七八九十百千〇零]+"
+
+# 見出しの形式。chapter/episode は1行に当てはめる正規表現（titleグループが見出し）、
+# frame は「区切り線・見出し・区切り線」の3行で見出しを表す形式（export_projectのテキスト形式）
+PRESETS = {
+    "export": {
+        "label": "このソフトのテキスト書き出し（====/----）",
+        "chapter_frame": "=" * 80,
+        "episode_frame": "-" * 60,
+    },
+    "markdown": {
+        "label": "Markdown（## 章 / ### 話）",
+        "chapter": r"^##\s+(?P<title>.+)$",
+        "episode": r"^###\s+(?P<title>.+)$",
+        "book": r"^#\s+(?P<title>.+)$",
+    },
+    "narou": {
+        "label": "小説投稿サイト形式（【章】/◆話）",
+        "chapter": r"^【(?P<title>.+)】$",
+        "episode": r"^◆(?P<title>.+)$",
+    },
+    "aozora": {
+        "label": "青空文庫形式（大見出し/中見出し）",
+        "chapter": r"^［＃大見出し］(?P<title>.+)［＃大見出し終わり］$",
+        "episode": r"^［＃中見出し］(?P<title>.+)［＃中見出し終わり］$",
+        "skip": r"^［＃改ページ］$",
+    },
+    "japanese": {
+        "label": "「第○章」「第○話」の見出し",
+        "chapter": rf"^(?P<title>第{_NUMBER}章.*)$",
+        "episode": rf"^(?P<title>(第{_NUMBER}話|{_NUMBER}[\.．、]).*)$",
+    },
+}
+
+
+def detect_style(head):
+    # ファイルの先頭部分から見出しの形式を推測する
+    if PRESETS["export"]["chapter_frame"] in head or PRESETS["export"]["episode_frame"] in head:
+        return "export"
+    for name in ("aozora", "narou", "markdown", "japanese"):
+        style = PRESETS[name]
+        if re.search(style["episode"], head, re.M) or re.search(style["chapter"], head, re.M):
+            return name
+    return "japanese"
+
+
+class ManuscriptParser:
+    # 行を順に受け取り、章・話に分けながらプロジェクトを組み立てる
+    # （ファイル全体を読み込まずに、1行ずつ流し込める）
+
+    def __init__(self, style, chapter_pattern=None, episode_pattern=None):
+        preset = PRESETS[style] if isinstance(style, str) else style
+        self.chapter_frame = preset.get("chapter_frame")
+        self.episode_frame = preset.get("episode_frame")
+        self.chapter_re = re.compile(chapter_pattern or preset.get("chapter") or r"(?!x)x")
+        self.episode_re = re.compile(episode_pattern or preset.get("episode") or r"(?!x)x")
+        self.book_re = re.compile(preset["book"]) if preset.get("book") else None
+        self.skip_re = re.compile(preset["skip"]) if preset.get("skip") else None
+
+        self.book_title = None
+        self.chapters = []
+        self.preamble = []
+        self._chapter = None
+        self._episode_title = None
+        self._lines = self.preamble
+        self._window = []  # 区切り線で囲む見出しを見分けるための先読み
+
+    # 組み立て
+    def _flush_episode(self):
+        title = self._episode_title
+        if title is None:
+            # 章見出しの直後に話見出しなしで本文が続いた場合は、章タイトルの話にする
+            if self._chapter is None or not "".join(self._lines).strip():
+                return
+            title = self._chapter["title"]
+        content = "\n".join(self._lines).strip("\n")  # 段落頭の全角スペースは残す
+        if self._chapter is None:
+            self._start_chapter(DEFAULT_CHAPTER)
+        self._chapter["episodes"].append({
+            "title": title,
+            "content": content,
+            "memo": "",
+            "word_count": len(content)  # 読み込みながら数える
+        })
+        self._episode_title = None
+        self._lines = []
+
+    def _start_chapter(self, title):
+        self._chapter = {"title": title, "episodes": []}
+        self.chapters.append(self._chapter)
+
+    def chapter(self, title):
+        self._flush_episode()
+        self._start_chapter(title.strip())
+        self._lines = []
+
+    def episode(self, title):
+        self._flush_episode()
+        self._episode_title = title.strip()
+        self._lines = []
+
+    # 行の処理
+    def feed(self, line):
+        line = line.rstrip("\r\n")
+        if self.chapter_frame or self.episode_frame:
+            self._window.append(line)
+            if len(self._window) < 3:
+                return
+            first, middle, last = self._window
+            for frame, start in ((self.chapter_frame, self.chapter), (self.episode_frame, self.episode)):
+                if frame and first == frame and last == frame and middle != frame:
+                    start(middle)
+                    self._window = []
+                    return
+            self._line(self._window.pop(0))
+        else:
+            self._line(line)
+
+    def _line(self, line):
+        stripped = line.strip()
+        if self.skip_re and self.skip_re.match(stripped):
+            return
+        match = self.chapter_re.match(stripped)
+        if match:
+            self.chapter(match.group("title"))
+            return
+        match = self.episode_re.match(stripped)
+        if match:
+            self.episode(match.group("title"))
+            return
+        if self.book_re and self.book_title is None and not self.chapters and self._episode_title is None:
+            match = self.book_re.match(stripped)
+            if match:
+                self.book_title = match.group("title").strip()
+                return
+        self._lines.append(line)
+
+    def finish(self):
+        for line in self._window:
+            self._line(line)
+        self._window = []
+        self._flush_episode()
+
+        # 最初の見出しより前の部分: 1行だけならタイトル、本文があれば「序」として先頭に置く
+        frames = {self.chapter_frame, self.episode_frame}
+        lines = [l for l in self.preamble if l.strip() and l not in frames]
+        if len(lines) == 1 and self.book_title is None:
+            self.book_title = lines[0].strip()
+        elif lines:
+            content = "\n".join(self.preamble).strip("\n")
+            if not self.chapters:
+                self._start_chapter(DEFAULT_CHAPTER)
+            self.chapters[0]["episodes"].insert(0, {"title": "序", "content": content, "memo": "",
+                                                    "word_count": len(content)})
+        return self.chapters
+
+
+def _natural_key(name):
+    return [int(part) if part.isdigit() else part for part in re.split(r"(\d+)", name)]
+
+
+def _text_files(directory):
+    return sorted((name for name in os.listdir(directory)
+                   if name.lower().endswith(TEXT_EXTENSIONS) and os.path.isfile(os.path.join(directory, name))),
+                  key=_natural_key)
+
+
+def _read_episode(path):
+    with open(path, 'r', encoding='utf-8-sig') as f:
+        content = f.read().replace("\r\n", "\n").strip("\n")
+    title = os.path.splitext(os.path.basename(path))[0]
+    return {"title": title, "content": content, "memo": "", "word_count": len(content)}
+
+
+def import_file(path, style=None, chapter_pattern=None, episode_pattern=None, task=None):
+    # 1つの大きな原稿ファイルを章・話に分ける。styleがNoneなら先頭から推測する
+    if style is None:
+        with open(path, 'r', encoding='utf-8-sig') as f:
+            style = detect_style(f.read(DETECT_BYTES))
+    parser = ManuscriptParser(style, chapter_pattern, episode_pattern)
+    size = os.path.getsize(path) or 1
+    done = 0
+    with open(path, 'rb') as f:
+        for i, raw in enumerate(f):
+            done += len(raw)
+            parser.feed(raw.decode('utf-8-sig' if i == 0 else 'utf-8'))
+            if task is not None and i % 4096 == 0:
+                task.report(done / size)
+    chapters = parser.finish()
+    name = parser.book_title or os.path.splitext(os.path.basename(path))[0]
+    return new_project(name, chapters)
+
+
+def import_directory(path, task=None):
+    # サブフォルダ＝章、その中のテキストファイル＝話（名前の数字順）
+    # 直下のテキストファイルはフォルダ名の章にまとめる
+    chapters = []
+    top = _text_files(path)
+    if top:
+        chapters.append({"title": os.path.basename(os.path.normpath(path)),
+                         "episodes": [_read_episode(os.path.join(path, name)) for name in top]})
+    subdirs = sorted((name for name in os.listdir(path) if os.path.isdir(os.path.join(path, name))),
+                     key=_natural_key)
+    for i, name in enumerate(subdirs):
+        if task is not None:
+            task.report(i / len(subdirs))
+        directory = os.path.join(path, name)
+        episodes = [_read_episode(os.path.join(directory, f)) for f in _text_files(directory)]
+        if episodes:
+            chapters.append({"title": name, "episodes": episodes})
+    return new_project(os.path.basename(os.path.normpath(path)), chapters)
+
+
+def new_project(name, chapters):
+    # chapters は {"title", "episodes": [{"title", "content", ...}]} のリスト
+    project = Project(name=name, chapters=[Chapter.from_dict(ch) for ch in chapters],
+                      current_chapter=0 if chapters else None)
+    ensure_ids(project)
+    return project
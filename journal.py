@@ -0,0 +1,97 @@
+import json
+import os
+import zlib
+
+
+def fsync_dir(path):
+    # rename結果をディスクに確定させる（Windowsではディレクトリをopenできない）
+    if os.name != "posix":
+        return
+    fd = os.open(path or ".", os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def write_atomic(path, data):
+    # 一時ファイルに書いてからrenameするので、途中で落ちても元のファイルは壊れない
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    tmp = path + ".tmp"
+    with open(tmp, 'wb') as f:
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+    fsync_dir(directory)
+
+
+class Journal:
+    # 先行書き込みログ
+    # 1行1レコード「<crc32> <json>」で追記し、1回の保存（バッチ）ごとに1度だけfsyncする。
+    # 途中で書き込みが途切れた末尾の行はcrcが合わないので再生時に捨てる。
+
+    def __init__(self, path):
+        self.path = path
+        self._file = None
+        self.size = os.path.getsize(path) if os.path.exists(path) else 0
+        self.records = 0
+
+    def _open(self):
+        if self._file is None:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            self._file = open(self.path, 'ab')
+        return self._file
+
+    def append_batch(self, lines):
+        if not lines:
+            return 0
+        chunks = []
+        for line in lines:
+            payload = line.encode("utf-8")
+            chunks.append(b"%08x " % zlib.crc32(payload) + payload + b"\n")
+        data = b"".join(chunks)
+
+        f = self._open()
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+        self.size += len(data)
+        self.records += len(lines)
+        return len(data)
+
+    def replay(self):
+        if not os.path.exists(self.path):
+            return []
+        records = []
+        with open(self.path, 'rb') as f:
+            for raw in f:
+                if not raw.endswith(b"\n") or len(raw) < 10:
+                    break
+                crc, payload = raw[:8], raw[9:-1]
+                try:
+                    if int(crc, 16) != zlib.crc32(payload):
+                        break
+                    records.append(json.loads(payload.decode("utf-8")))
+                except ValueError:
+                    break
+        return records
+
+    def reset(self):
+        self.close()
+        if not os.path.exists(self.path):
+            return
+        with open(self.path, 'wb') as f:
+            f.flush()
+            os.fsync(f.fileno())
+        self.size = 0
+        self.records = 0
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
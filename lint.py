@@ -0,0 +1,154 @@
+import re
+
+from textcount import line_col, line_starts
+
+MAX_SENTENCE_LENGTH = 80
+
+# 文字単位の規則: (名前, 正規表現, 判定関数)。すべてを1つの正規表現にまとめて1回で走査する
+# 判定関数は (一致, 状態) を受け取り、問題があればメッセージを返す
+TOKEN_RULES = []
+# 行単位の規則: (名前, 判定関数)。判定関数は (行, 状態) を受け取り (行内の位置, メッセージ) を返す
+LINE_RULES = []
+
+
+def token_rule(name, pattern):
+    def register(check):
+        TOKEN_RULES.append((name, pattern, check))
+        return check
+    return register
+
+
+def line_rule(name):
+    def register(check):
+        LINE_RULES.append((name, check))
+        return check
+    return register
+
+
+@token_rule("double_comma", r"、{2,}")
+def _double_comma(match, state):
+    return "読点が連続"
+
+
+@token_rule("double_period", r"。{2,}")
+def _double_period(match, state):
+    return "句点が連続"
+
+
+@token_rule("ellipsis", r"…+")
+def _ellipsis(match, state):
+    if len(match.group()) % 2:
+        return "三点リーダーは「……」のように2つ続けて使います"
+
+
+@token_rule("dots", r"・{2,}|\.{3,}|．{2,}")
+def _dots(match, state):
+    return f"「{match.group()}」ではなく「……」を使います"
+
+
+@token_rule("dash", r"[―—]+")
+def _dash(match, state):
+    text = match.group()
+    if "—" in text or len(text) % 2:
+        return "ダッシュは「――」のように全角ダッシュを2つ続けて使います"
+
+
+_PAIRS = {"」": "「", "』": "『"}
+
+
+@token_rule("brackets", r"[「」『』]")
+def _brackets(match, state):
+    stack = state.setdefault("brackets", [])
+    ch = match.group()
+    if ch in _PAIRS:
+        if stack and stack[-1][0] == _PAIRS[ch]:
+            stack.pop()
+            return None
+        return f"対応する「{_PAIRS[ch]}」がない「{ch}」"
+    stack.append((ch, match.start()))
+
+
+@line_rule("indent")
+def _indent(line, state):
+    # 会話文（括弧始まり）は字下げしないのが一般的なので対象外
+    if line and not line.startswith(("　", "「", "『", "（", "(", "―", "…")):
+        yield 0, "段落の先頭に全角スペースがありません"
+
+
+_SENTENCE_END = re.compile(r"[^。！？!?]+[。！？!?]*")
+
+
+@line_rule("sentence_length")
+def _sentence_length(line, state):
+    limit = state["max_sentence_length"]
+    if len(line) <= limit:
+        return
+    for match in _SENTENCE_END.finditer(line):
+        if len(match.group()) > limit:
+            yield match.start(), f"一文が長すぎます（{len(match.group())}文字）"
+
+
+class LintEngine:
+    def __init__(self, rules=None, max_sentence_length=MAX_SENTENCE_LENGTH):
+        # rules: 有効にする規則名の集合（Noneならすべて）
+        self.max_sentence_length = max_sentence_length
+        self.token_rules = [r for r in TOKEN_RULES if rules is None or r[0] in rules]
+        self.line_rules = [r for r in LINE_RULES if rules is None or r[0] in rules]
+        self._checks = {}
+        parts = []
+        for name, pattern, check in self.token_rules:
+            parts.append(f"(?P<{name}>{pattern})")
+            self._checks[name] = check
+        self._pattern = re.compile("|".join(parts)) if parts else None
+
+    def lint(self, text, label=""):
+        diagnostics = []
+        starts = line_starts(text)
+        state = {"max_sentence_length": self.max_sentence_length}
+
+        def report(rule, pos, message):
+            line, col = line_col(starts, pos)
+            diagnostics.append({"label": label, "rule": rule, "pos": pos,
+                                "line": line, "column": col, "message": message})
+
+        if self._pattern is not None:
+            for match in self._pattern.finditer(text):
+                rule = match.lastgroup
+                message = self._checks[rule](match, state)
+                if message:
+                    report(rule, match.start(), message)
+            for ch, pos in state.get("brackets", []):
+                report("brackets", pos, f"閉じられていない「{ch}」")
+
+        if self.line_rules:
+            for i, start in enumerate(starts):
+                end = starts[i + 1] - 1 if i + 1 < len(starts) else len(text)
+                line = text[start:end]
+                for rule, check in self.line_rules:
+                    for offset, message in check(line, state) or ():
+                        report(rule, start + offset, message)
+
+        diagnostics.sort(key=lambda d: d["pos"])
+        return diagnostics
+
+    def lint_documents(self, docs):
+        # docs: (ラベル, 本文を返す関数) のリスト
+        diagnostics = []
+        for label, load in docs:
+            diagnostics.extend(self.lint(load(), label))
+        return diagnostics
+
+    def check_documents(self, docs, with_labels=False):
+        # 句読点チェック: 句読点の数と規則違反を1回の走査でまとめて集める
+        # (問題の説明のリスト, 読点の数, 句点の数) を返す
+        issues = []
+        comma_count = 0
+        period_count = 0
+        for label, load in docs:
+            text = load()
+            comma_count += text.count('、')
+            period_count += text.count('。')
+            prefix = f"{label} " if with_labels else ""
+            for d in self.lint(text, label):
+                issues.append(f"{prefix}行{d['line']}:{d['column']}: {d['message']}")
+        return issues, comma_count, period_count
@@ -2,8 +2,32 @@ import tkinter as tk
 from tkinter import ttk, scrolledtext, messagebox, filedialog
 import json
 import os
+import re
+import time
 from datetime import datetime
 
+import charclass
+import diff
+import export
+import importer
+from autosave import AutoSaver
+from document import PAGE_LINES, PAGE_THRESHOLD, Document
+from editor import TextChangeTracker
+from lint import LintEngine
+from ngram import MAX_N, MIN_N, find_repetitions
+from model import Chapter, Episode, Project
+from outline import OutlineView
+from profiler import PROFILER, timed
+from project_index import ProjectIndex
+from replace import plan_replace, summary
+from stats import ProjectStats
+from sqlstore import SQLiteStore, migrate
+from storage import DATABASE_FILE, copy_library, new_id, open_store
+from tasks import TaskScheduler, track
+from textcount import WordCounter
+
+REPLACE_HISTORY_KEY = "replacements"  # 一括置換の取り消し用スナップショット（プロジェクトごと）
+
 class NovelWriterPro:
     def __init__(self, root):
         self.root = root
@@ -13,22 +37,32 @@ class NovelWriterPro:
         # データ構造
         self.projects = []  # 複数プロジェクト管理
         self.current_project_idx = None
-        self.current_project = {
-            "name": "新規プロジェクト",
-            "chapters": [],
-            "characters": [],
-            "settings": [],
-            "current_chapter": None,
-            "current_episode": None,
-            "writing_goal": 2000,
-            "versions": {}  # 下書き・校正版管理
-        }
-        
-        self.auto_save_timer = None
+        self.current_project = Project(new_id(), "新規プロジェクト")
+        
+        # 変更があったときだけ、入力が一段落してから保存する
+        self.autosave = AutoSaver(self.root, self.save_all, self.has_unsaved_changes)
+        self.word_counter = WordCounter()
+        self.word_count_timer = None
+        self.progress_timer = None
+        # 編集中の本文（挿入・削除をその場で反映する）。Tcl 8.6は𠮷などを2桁と数える
+        self.document = Document(wide=self.root.tk.call("string", "length", "\U00020BB7") == 2)
+        self.loading_editor = False
+        self.store = open_store()  # 変更分だけを書き込む分割保存（移行済みならSQLite）
+        self.store.on_dirty = self.autosave.changed
+        # チェック・保存・書き出しは作業スレッドで実行する
+        self.tasks = TaskScheduler(self.root, on_status=lambda text: self.status_label.config(text=text))
+        self.index = ProjectIndex(self.current_project)  # ID -> 章・話
+        self.stats = ProjectStats(self.current_project)  # 章別・全体の文字数合計
+        self.balance = charclass.BalanceAnalyzer()  # 文字種の集計（本文のハッシュでキャッシュ）
+        self.profiling_var = tk.BooleanVar(value=PROFILER.enabled)  # 処理時間の計測（NOVEL_PROFILE=1で起動時から）
+        self.overlay_var = tk.BooleanVar(value=False)  # 計測結果をステータスバーに出す
+        self.linter = LintEngine()
+        self.search = self.store.search_engine()  # 全文検索（保存先に合わせた索引）
         
         self.setup_ui()
         self.load_projects()
-        self.start_auto_save()
+        self.autosave.start()
+        self.root.protocol("WM_DELETE_WINDOW", self.on_close)
     
     def setup_ui(self):
         # メニューバー
@@ -39,10 +73,17 @@ class NovelWriterPro:
         menubar.add_cascade(label="ファイル", menu=file_menu)
         file_menu.add_command(label="新規プロジェクト", command=self.new_project)
         file_menu.add_command(label="プロジェクトを開く", command=self.open_project_dialog)
+        file_menu.add_command(label="原稿を取り込む", command=self.import_manuscript_dialog)
         file_menu.add_command(label="保存", command=self.save_all)
         file_menu.add_command(label="エクスポート", command=self.export_project)
+        file_menu.add_command(label="SQLiteデータベースへ移行", command=self.migrate_to_sqlite)
         file_menu.add_separator()
-        file_menu.add_command(label="終了", command=self.root.quit)
+        file_menu.add_command(label="終了", command=self.on_close)
+        
+        edit_menu = tk.Menu(menubar, tearoff=0)
+        menubar.add_cascade(label="編集", menu=edit_menu)
+        edit_menu.add_command(label="プロジェクト全体で置換", command=self.replace_dialog)
+        edit_menu.add_command(label="置換の取り消し", command=self.show_replace_history)
         
         version_menu = tk.Menu(menubar, tearoff=0)
         menubar.add_cascade(label="バージョン", menu=version_menu)
@@ -54,6 +95,13 @@ class NovelWriterPro:
         menubar.add_cascade(label="表示", menu=view_menu)
         view_menu.add_command(label="集中モード", command=self.focus_mode)
         view_menu.add_command(label="通常モード", command=self.normal_mode)
+        view_menu.add_separator()
+        view_menu.add_checkbutton(label="処理時間を計測", variable=self.profiling_var, command=self.toggle_profiling)
+        view_menu.add_checkbutton(label="計測結果をステータスバーに表示", variable=self.overlay_var,
+                                  command=self.toggle_overlay)
+        view_menu.add_command(label="計測結果...", command=self.show_profile)
+        view_menu.add_command(label="トレースを書き出す...", command=self.export_trace)
+        view_menu.add_command(label="詳細プロファイルの開始/停止", command=self.toggle_cprofile)
         
         # メインコンテナ
         self.main_container = ttk.PanedWindow(self.root, orient=tk.HORIZONTAL)
@@ -96,29 +144,17 @@ class NovelWriterPro:
         structure_tab = ttk.Frame(tab_control)
         tab_control.add(structure_tab, text="章・話")
         
-        ttk.Label(structure_tab, text="章一覧", font=("", 11, "bold")).pack(pady=5)
-        
-        chapter_btn = ttk.Frame(structure_tab)
-        chapter_btn.pack(fill=tk.X, padx=5, pady=5)
-        ttk.Button(chapter_btn, text="+ 章追加", command=self.add_chapter).pack(side=tk.LEFT, padx=2)
-        ttk.Button(chapter_btn, text="削除", command=self.delete_chapter).pack(side=tk.LEFT, padx=2)
-        
-        self.chapter_listbox = tk.Listbox(structure_tab, height=8)
-        self.chapter_listbox.pack(fill=tk.X, padx=5, pady=5)
-        self.chapter_listbox.bind("<<ListboxSelect>>", self.on_chapter_select)
+        structure_btn = ttk.Frame(structure_tab)
+        structure_btn.pack(fill=tk.X, padx=5, pady=5)
+        ttk.Button(structure_btn, text="+ 章追加", command=self.add_chapter).pack(side=tk.LEFT, padx=2)
+        ttk.Button(structure_btn, text="+ 話追加", command=self.add_episode).pack(side=tk.LEFT, padx=2)
+        ttk.Button(structure_btn, text="削除", command=self.delete_selected).pack(side=tk.LEFT, padx=2)
+        ttk.Button(structure_btn, text="↑", width=3, command=lambda: self.move_selected(-1)).pack(side=tk.LEFT, padx=2)
+        ttk.Button(structure_btn, text="↓", width=3, command=lambda: self.move_selected(1)).pack(side=tk.LEFT, padx=2)
         
-        ttk.Separator(structure_tab, orient=tk.HORIZONTAL).pack(fill=tk.X, pady=10)
-        
-        ttk.Label(structure_tab, text="話一覧", font=("", 11, "bold")).pack(pady=5)
-        
-        episode_btn = ttk.Frame(structure_tab)
-        episode_btn.pack(fill=tk.X, padx=5, pady=5)
-        ttk.Button(episode_btn, text="+ 話追加", command=self.add_episode).pack(side=tk.LEFT, padx=2)
-        ttk.Button(episode_btn, text="削除", command=self.delete_episode).pack(side=tk.LEFT, padx=2)
-        
-        self.episode_listbox = tk.Listbox(structure_tab, height=8)
-        self.episode_listbox.pack(fill=tk.X, padx=5, pady=5)
-        self.episode_listbox.bind("<<ListboxSelect>>", self.load_episode)
+        # 章を開いたときに話の行を作る。行は章・話のIDで選択する
+        self.outline = OutlineView(structure_tab, self.chapter_row, self.episode_row, on_select=self.on_outline_select)
+        self.outline.pack(fill=tk.BOTH, expand=True, padx=5, pady=5)
         
         # キャラクター管理タブ
         character_tab = ttk.Frame(tab_control)
@@ -186,7 +222,15 @@ class NovelWriterPro:
             undo=True
         )
         self.text_editor.pack(fill=tk.BOTH, expand=True)
-        self.text_editor.bind("<KeyRelease>", self.update_word_count)
+        # 入力のたびに全文を読み直さず、挿入・削除の差分で文字数を数える
+        self.text_tracker = TextChangeTracker(
+            self.text_editor,
+            on_insert=self.on_text_insert,
+            on_delete=self.on_text_delete,
+            on_reset=self.on_text_reset
+        )
+        self.text_editor.bind("<<Modified>>", self.on_text_modified)
+        self.title_entry.bind("<KeyRelease>", lambda e: self.autosave.changed())
         
         # 文字数表示
         count_frame = ttk.Frame(editor_frame)
@@ -200,6 +244,16 @@ class NovelWriterPro:
         
         self.chapter_count_label = ttk.Label(count_frame, text="章合計: 0", font=("", 10))
         self.chapter_count_label.pack(side=tk.LEFT, padx=10)
+        
+        # 長い話の分割表示
+        self.page_next = ttk.Button(count_frame, text="次 ▶", width=6, state=tk.DISABLED,
+                                    command=lambda: self.change_page(1))
+        self.page_next.pack(side=tk.RIGHT, padx=2)
+        self.page_label = ttk.Label(count_frame, text="", font=("", 10))
+        self.page_label.pack(side=tk.RIGHT, padx=5)
+        self.page_prev = ttk.Button(count_frame, text="◀ 前", width=6, state=tk.DISABLED,
+                                    command=lambda: self.change_page(-1))
+        self.page_prev.pack(side=tk.RIGHT, padx=2)
     
     def setup_tools(self):
         tools_frame = ttk.Frame(self.main_container, width=300)
@@ -207,12 +261,25 @@ class NovelWriterPro:
         
         tool_tabs = ttk.Notebook(tools_frame)
         tool_tabs.pack(fill=tk.BOTH, expand=True, padx=5, pady=5)
+        self.tool_tabs = tool_tabs
         
         # 文章チェックタブ
         check_tab = ttk.Frame(tool_tabs)
         tool_tabs.add(check_tab, text="文章チェック")
         
         ttk.Label(check_tab, text="文章分析", font=("", 11, "bold")).pack(pady=10)
+        
+        option_frame = ttk.Frame(check_tab)
+        option_frame.pack(fill=tk.X, padx=10, pady=5)
+        ttk.Label(option_frame, text="範囲:").pack(side=tk.LEFT)
+        self.check_scope = ttk.Combobox(option_frame, state="readonly", width=12,
+                                        values=["編集中の話", "この章", "プロジェクト全体"])
+        self.check_scope.current(0)
+        self.check_scope.pack(side=tk.LEFT, padx=5)
+        ttk.Label(option_frame, text="語句の長さ:").pack(side=tk.LEFT)
+        self.ngram_size = ttk.Spinbox(option_frame, from_=MIN_N, to=MAX_N, width=4)
+        self.ngram_size.set(3)
+        self.ngram_size.pack(side=tk.LEFT, padx=5)
         ttk.Button(check_tab, text="繰り返し語句検出", command=self.check_repetition).pack(fill=tk.X, padx=10, pady=5)
         ttk.Button(check_tab, text="文体バランス分析", command=self.check_balance).pack(fill=tk.X, padx=10, pady=5)
         ttk.Button(check_tab, text="句読点チェック", command=self.check_punctuation).pack(fill=tk.X, padx=10, pady=5)
@@ -220,9 +287,36 @@ class NovelWriterPro:
         self.check_result = scrolledtext.ScrolledText(check_tab, height=15, wrap=tk.WORD)
         self.check_result.pack(fill=tk.BOTH, expand=True, padx=10, pady=10)
         
+        # 検索タブ
+        search_tab = ttk.Frame(tool_tabs)
+        tool_tabs.add(search_tab, text="検索")
+        
+        ttk.Label(search_tab, text="全文検索", font=("", 11, "bold")).pack(pady=10)
+        
+        query_frame = ttk.Frame(search_tab)
+        query_frame.pack(fill=tk.X, padx=10, pady=5)
+        self.search_entry = ttk.Entry(query_frame)
+        self.search_entry.pack(side=tk.LEFT, fill=tk.X, expand=True)
+        self.search_entry.bind("<Return>", lambda e: self.run_search())
+        ttk.Button(query_frame, text="検索", command=self.run_search).pack(side=tk.LEFT, padx=5)
+        
+        self.search_scope = ttk.Combobox(search_tab, state="readonly",
+                                         values=["このプロジェクト", "全プロジェクト"])
+        self.search_scope.current(0)
+        self.search_scope.pack(fill=tk.X, padx=10, pady=5)
+        
+        self.search_listbox = tk.Listbox(search_tab, height=20)
+        self.search_listbox.pack(fill=tk.BOTH, expand=True, padx=10, pady=10)
+        self.search_listbox.bind("<Double-Button-1>", self.open_search_hit)
+        self.search_hits = []
+        
         # 進捗管理タブ
         progress_tab = ttk.Frame(tool_tabs)
         tool_tabs.add(progress_tab, text="進捗")
+        self.progress_tab = progress_tab
+        # 隠れている間の執筆記録は、タブを開いたときにまとめて反映する
+        tool_tabs.bind("<<NotebookTabChanged>>",
+                       lambda e: self.update_progress() if self.progress_visible() else None)
         
         ttk.Label(progress_tab, text="執筆進捗", font=("", 11, "bold")).pack(pady=10)
         
@@ -247,29 +341,30 @@ class NovelWriterPro:
         
         self.time_label = ttk.Label(statusbar, text="", relief=tk.SUNKEN)
         self.time_label.pack(side=tk.RIGHT, padx=2, pady=2)
+        
+        self.save_stats_label = ttk.Label(statusbar, text="", relief=tk.SUNKEN)
+        self.save_stats_label.pack(side=tk.RIGHT, padx=2, pady=2)
+        
+        # 計測結果（表示中のみpackする）
+        self.debug_label = ttk.Label(statusbar, text="", relief=tk.SUNKEN)
         self.update_time()
     
     # プロジェクト管理
     def new_project(self):
         name = tk.simpledialog.askstring("新規プロジェクト", "プロジェクト名を入力:")
         if name:
-            project = {
-                "name": name,
-                "chapters": [],
-                "characters": [],
-                "settings": [],
-                "current_chapter": None,
-                "current_episode": None,
-                "writing_goal": 2000,
-                "versions": {}
-            }
+            self.save_current_episode()
+            project = Project(new_id(), name)
             self.projects.append(project)
             self.current_project = project
             self.current_project_idx = len(self.projects) - 1
+            self.store.mark_project(project)
+            self.store.mark_library()
             self.refresh_project_list()
             self.refresh_ui()
             self.status_label.config(text=f"プロジェクト '{name}' を作成")
     
+    @timed()
     def switch_project(self):
         if not self.projects:
             messagebox.showinfo("情報", "プロジェクトがありません")
@@ -283,190 +378,308 @@ class NovelWriterPro:
         listbox.pack(fill=tk.BOTH, expand=True, padx=10, pady=10)
         
         for proj in self.projects:
-            listbox.insert(tk.END, proj["name"])
+            listbox.insert(tk.END, proj.name)
         
         def select_project():
             selection = listbox.curselection()
             if selection:
+                self.save_current_episode()
                 self.current_project_idx = selection[0]
                 self.current_project = self.projects[self.current_project_idx]
+                self.store.mark_library()
                 self.refresh_ui()
-                self.status_label.config(text=f"切替: {self.current_project['name']}")
+                self.status_label.config(text=f"切替: {self.current_project.name}")
                 dialog.destroy()
         
         ttk.Button(dialog, text="選択", command=select_project).pack(pady=10)
     
+    @timed()
     def on_project_select(self, event):
         idx = self.project_combo.current()
         if idx >= 0:
+            self.save_current_episode()
             self.current_project_idx = idx
             self.current_project = self.projects[idx]
+            self.store.mark_library()
             self.refresh_ui()
     
     def refresh_project_list(self):
-        names = [p["name"] for p in self.projects]
+        names = [p.name for p in self.projects]
         self.project_combo['values'] = names
         if self.current_project_idx is not None:
             self.project_combo.current(self.current_project_idx)
     
+    # 章・話の選択
+    @timed()
+    def on_outline_select(self, kind, iid):
+        if kind == "chapter":
+            self.on_chapter_select(None)
+        elif kind == "episode":
+            self.load_episode(None)
+    
+    def selected_chapter(self):
+        # ツリーで選ばれている章（話が選ばれていればその章）
+        kind, iid = self.outline.selected()
+        if kind == "chapter":
+            return self.index.chapter(iid)
+        if kind == "episode":
+            return self.index.chapter_of(iid)
+        return None
+    
+    def selected_episode(self):
+        kind, iid = self.outline.selected()
+        return self.index.episode(iid) if kind == "episode" else None
+    
+    def delete_selected(self):
+        if self.selected_episode() is not None:
+            self.delete_episode()
+        else:
+            self.delete_chapter()
+    
+    def move_selected(self, offset):
+        if self.selected_episode() is not None:
+            self.move_episode(offset)
+        else:
+            self.move_chapter(offset)
+    
     # 章管理
     def add_chapter(self):
-        chapter_num = len(self.current_project["chapters"]) + 1
-        chapter = {
-            "id": datetime.now().strftime("%Y%m%d%H%M%S"),
-            "title": f"第{chapter_num}章",
-            "episodes": []
-        }
-        self.current_project["chapters"].append(chapter)
-        self.refresh_chapters()
-        self.status_label.config(text=f"{chapter['title']}を追加")
+        chapter_num = len(self.current_project.chapters) + 1
+        chapter = Chapter(new_id(), f"第{chapter_num}章")
+        self.index.add_chapter(chapter)
+        self.stats.add_chapter(chapter)
+        self.store.mark_chapter(self.current_project, chapter)
+        self.store.mark_project(self.current_project)
+        self.search.update_chapter(self.current_project, chapter)
+        self.outline.add_chapter(chapter)
+        self.status_label.config(text=f"{chapter.title}を追加")
     
     def delete_chapter(self):
-        selection = self.chapter_listbox.curselection()
-        if selection:
+        chapter = self.selected_chapter()
+        if chapter is not None and self.selected_episode() is None:
             if messagebox.askyesno("確認", "選択した章とその話をすべて削除しますか?"):
-                idx = selection[0]
-                del self.current_project["chapters"][idx]
-                self.refresh_chapters()
-                self.episode_listbox.delete(0, tk.END)
+                idx = self.current_project.chapters.index(chapter)
+                self.index.remove_chapter(chapter.id)
+                self.stats.remove_chapter(chapter)
+                self.search.remove_chapter(self.current_project, chapter)
+                
+                # 選択中の位置を削除後の並びに合わせる
+                current = self.current_project.current_chapter
+                if current == idx:
+                    self.current_project.current_chapter = None
+                    self.current_project.current_episode = None
+                    self.set_editor_text("")
+                    self.title_entry.delete(0, tk.END)
+                elif current is not None and current > idx:
+                    self.current_project.current_chapter = current - 1
+                
+                self.store.mark_project(self.current_project)
+                self.outline.remove(chapter)
+    
+    def move_chapter(self, offset):
+        chapter = self.selected_chapter()
+        if chapter is None:
+            return
+        chapters = self.current_project.chapters
+        idx = chapters.index(chapter)
+        new_idx = idx + offset
+        if not 0 <= new_idx < len(chapters):
+            return
+        
+        self.save_current_episode()
+        current = self.current_project.current_chapter
+        current_chapter = chapters[current] if current is not None else None
+        
+        self.index.move_chapter(chapter.id, new_idx)
+        if current_chapter is not None:
+            self.current_project.current_chapter = chapters.index(current_chapter)
+        
+        self.store.mark_project(self.current_project)
+        self.outline.move(chapter, None, new_idx)
+        self.outline.select(chapter)
     
     def on_chapter_select(self, event):
-        selection = self.chapter_listbox.curselection()
-        if selection:
-            self.current_project["current_chapter"] = selection[0]
-            self.refresh_episodes()
+        chapter = self.selected_chapter()
+        if chapter is not None:
+            self.current_project.current_chapter = self.current_project.chapters.index(chapter)
+            self.store.mark_project(self.current_project)
     
-    def refresh_chapters(self):
-        self.chapter_listbox.delete(0, tk.END)
-        for ch in self.current_project["chapters"]:
-            episode_count = len(ch["episodes"])
-            self.chapter_listbox.insert(tk.END, f"{ch['title']} ({episode_count}話)")
+    def chapter_row(self, chapter):
+        return f"{chapter.title} ({len(chapter.episodes)}話)"
     
     # 話管理
     def add_episode(self):
-        if self.current_project["current_chapter"] is None:
+        chapter = self.selected_chapter()
+        if chapter is None and self.current_project.current_chapter is not None:
+            chapter = self.current_project.chapters[self.current_project.current_chapter]
+        if chapter is None:
             messagebox.showwarning("警告", "先に章を選択してください")
             return
         
-        ch_idx = self.current_project["current_chapter"]
-        chapter = self.current_project["chapters"][ch_idx]
-        
-        episode_num = len(chapter["episodes"]) + 1
-        episode = {
-            "id": datetime.now().strftime("%Y%m%d%H%M%S%f"),
-            "title": f"{chapter['title']} - 第{episode_num}話",
-            "content": "",
-            "memo": "",
-            "word_count": 0
-        }
-        chapter["episodes"].append(episode)
-        self.refresh_episodes()
-        self.refresh_chapters()
-        self.status_label.config(text=f"{episode['title']}を追加")
+        episode_num = len(chapter.episodes) + 1
+        episode = Episode(new_id(), f"{chapter.title} - 第{episode_num}話", content="", memo="")
+        self.index.add_episode(chapter, episode)
+        self.stats.add_episode(chapter, episode)
+        self.store.mark_episode(self.current_project, episode)
+        self.store.mark_chapter(self.current_project, chapter)
+        self.search.update_episode(self.current_project, episode)
+        self.outline.add_episode(chapter, episode)
+        self.status_label.config(text=f"{episode.title}を追加")
     
     def delete_episode(self):
-        selection = self.episode_listbox.curselection()
-        if selection and self.current_project["current_chapter"] is not None:
+        episode = self.selected_episode()
+        if episode is not None:
             if messagebox.askyesno("確認", "選択した話を削除しますか?"):
-                ch_idx = self.current_project["current_chapter"]
-                ep_idx = selection[0]
-                del self.current_project["chapters"][ch_idx]["episodes"][ep_idx]
-                self.refresh_episodes()
-                self.refresh_chapters()
-                self.text_editor.delete(1.0, tk.END)
-                self.title_entry.delete(0, tk.END)
+                chapter = self.index.chapter_of(episode.id)
+                ch_idx = self.current_project.chapters.index(chapter)
+                ep_idx = chapter.episodes.index(episode)
+                self.index.remove_episode(episode.id)
+                self.stats.remove_episode(chapter, episode)
+                self.search.remove_episode(self.current_project, episode)
+                self.store.mark_chapter(self.current_project, chapter)
+                
+                # 削除した話の位置に別の話が詰まるので、選択中の位置を合わせる
+                current = self.current_project.current_episode
+                if self.current_project.current_chapter == ch_idx:
+                    if current == ep_idx:
+                        self.current_project.current_episode = None
+                        self.set_editor_text("")
+                        self.title_entry.delete(0, tk.END)
+                    elif current is not None and current > ep_idx:
+                        self.current_project.current_episode = current - 1
+                self.store.mark_project(self.current_project)
+                
+                self.outline.remove(episode)
+                self.outline.update(chapter)
+                self.update_chapter_count()
+    
+    def move_episode(self, offset):
+        episode = self.selected_episode()
+        if episode is None:
+            return
+        chapter = self.index.chapter_of(episode.id)
+        ep_idx = chapter.episodes.index(episode)
+        new_idx = ep_idx + offset
+        if not 0 <= new_idx < len(chapter.episodes):
+            return
+        
+        self.save_current_episode()
+        current = self.current_project.current_episode
+        same_chapter = self.current_project.current_chapter == self.current_project.chapters.index(chapter)
+        current_episode = chapter.episodes[current] if same_chapter and current is not None else None
+        
+        self.index.move_episode(episode.id, chapter, new_idx)
+        if current_episode is not None:
+            self.current_project.current_episode = chapter.episodes.index(current_episode)
+        
+        self.store.mark_chapter(self.current_project, chapter)
+        self.store.mark_project(self.current_project)
+        self.outline.move(episode, chapter, new_idx)
+        self.outline.select(episode)
     
     def load_episode(self, event):
-        selection = self.episode_listbox.curselection()
-        if selection and self.current_project["current_chapter"] is not None:
-            ch_idx = self.current_project["current_chapter"]
-            ep_idx = selection[0]
+        episode = self.selected_episode()
+        if episode is not None:
+            chapter = self.index.chapter_of(episode.id)
             
+            self.tasks.cancel("check")  # 前の話に対するチェックは不要になる
             self.save_current_episode()
             
-            self.current_project["current_episode"] = ep_idx
-            chapter = self.current_project["chapters"][ch_idx]
-            episode = chapter["episodes"][ep_idx]
+            self.current_project.current_chapter = self.current_project.chapters.index(chapter)
+            self.current_project.current_episode = chapter.episodes.index(episode)
+            self.store.mark_project(self.current_project)
             
-            self.title_entry.delete(0, tk.END)
-            self.title_entry.insert(0, episode["title"])
-            
-            self.text_editor.delete(1.0, tk.END)
-            self.text_editor.insert(1.0, episode["content"])
-            
-            self.update_word_count()
-            self.update_chapter_count()
+            self.show_episode(episode)
+    
+    @timed()
+    def show_episode(self, episode):
+        self.title_entry.delete(0, tk.END)
+        self.title_entry.insert(0, episode.title)
+        self.set_editor_text(self.store.content(self.current_project, episode), episode.id)
+        self.update_word_count()
+        self.update_chapter_count()
     
+    @timed()
     def save_current_episode(self):
-        if (self.current_project["current_chapter"] is not None and 
-            self.current_project["current_episode"] is not None):
-            ch_idx = self.current_project["current_chapter"]
-            ep_idx = self.current_project["current_episode"]
+        if (self.current_project.current_chapter is not None and 
+            self.current_project.current_episode is not None):
+            ch_idx = self.current_project.current_chapter
+            ep_idx = self.current_project.current_episode
             
-            if ch_idx < len(self.current_project["chapters"]):
-                chapter = self.current_project["chapters"][ch_idx]
-                if ep_idx < len(chapter["episodes"]):
-                    episode = chapter["episodes"][ep_idx]
-                    episode["title"] = self.title_entry.get()
-                    episode["content"] = self.text_editor.get(1.0, tk.END).strip()
-                    episode["word_count"] = len(episode["content"])
-                    
-                    self.refresh_episodes()
-                    self.refresh_chapters()
-    
-    def refresh_episodes(self):
-        self.episode_listbox.delete(0, tk.END)
-        if self.current_project["current_chapter"] is not None:
-            ch_idx = self.current_project["current_chapter"]
-            chapter = self.current_project["chapters"][ch_idx]
-            for ep in chapter["episodes"]:
-                self.episode_listbox.insert(tk.END, f"{ep['title']} ({ep['word_count']}字)")
+            if ch_idx < len(self.current_project.chapters):
+                chapter = self.current_project.chapters[ch_idx]
+                if ep_idx < len(chapter.episodes):
+                    episode = chapter.episodes[ep_idx]
+                    if self.document.owner != episode.id:
+                        return  # エディタに出ているのは別の話（または何も出ていない）
+                    title = self.title_entry.get()
+                    self.sync_document()
+                    if title == episode.title and not self.document.modified:
+                        return  # 変更のない話は本文を比べ直さない
+                    content = self.document.text().strip()
+                    self.document.modified = False
+                    old_content = self.store.content(self.current_project, episode)
+                    if title != episode.title or content != old_content:
+                        self.stats.episode_changed(chapter, episode.word_count, len(content))
+                        self.store.sessions.record(self.current_project.id, episode.id,
+                                                   len(content) - episode.word_count)
+                        self.schedule_progress()
+                        episode.title = title
+                        episode.content = content
+                        episode.word_count = len(content)
+                        self.store.mark_episode(self.current_project, episode)
+                        self.store.mark_chapter(self.current_project, chapter)  # タイトル・文字数
+                        self.search.update_episode(self.current_project, episode)
+                        
+                        # 一覧は変わった行だけ書き換える
+                        self.outline.update(episode)
+    
+    def episode_row(self, episode):
+        return f"{episode.title} ({episode.word_count}字)"
     
     # バージョン管理
+    @timed()
     def save_version(self, version_type):
-        if (self.current_project["current_chapter"] is None or 
-            self.current_project["current_episode"] is None):
+        if (self.current_project.current_chapter is None or 
+            self.current_project.current_episode is None):
             messagebox.showwarning("警告", "話を選択してください")
             return
         
         self.save_current_episode()
         
-        ch_idx = self.current_project["current_chapter"]
-        ep_idx = self.current_project["current_episode"]
-        chapter = self.current_project["chapters"][ch_idx]
-        episode = chapter["episodes"][ep_idx]
+        ch_idx = self.current_project.current_chapter
+        ep_idx = self.current_project.current_episode
+        chapter = self.current_project.chapters[ch_idx]
+        episode = chapter.episodes[ep_idx]
         
-        version_key = f"{ch_idx}_{ep_idx}"
-        if version_key not in self.current_project["versions"]:
-            self.current_project["versions"][version_key] = []
+        version_key = episode.id  # 並べ替えや削除で履歴がずれないよう話IDで管理
         
         version_name = "下書き" if version_type == "draft" else "校正版"
         timestamp = datetime.now().strftime("%Y/%m/%d %H:%M:%S")
         
-        version = {
-            "type": version_type,
-            "name": f"{version_name} - {timestamp}",
-            "content": episode["content"],
-            "timestamp": timestamp
-        }
-        
-        self.current_project["versions"][version_key].append(version)
+        # 下書き・校正版管理（全文ではなく差分で保存）
+        self.store.versions.append(self.current_project.id, version_key,
+                                   self.store.content(self.current_project, episode),
+                                   version_type, f"{version_name} - {timestamp}", timestamp)
         self.save_all()
         
         messagebox.showinfo("保存完了", f"{version_name}として保存しました")
-        self.status_label.config(text=f"{version_name}保存: {episode['title']}")
+        self.status_label.config(text=f"{version_name}保存: {episode.title}")
     
+    @timed()
     def show_version_history(self):
-        if (self.current_project["current_chapter"] is None or 
-            self.current_project["current_episode"] is None):
+        if (self.current_project.current_chapter is None or 
+            self.current_project.current_episode is None):
             messagebox.showwarning("警告", "話を選択してください")
             return
         
-        ch_idx = self.current_project["current_chapter"]
-        ep_idx = self.current_project["current_episode"]
-        version_key = f"{ch_idx}_{ep_idx}"
+        ch_idx = self.current_project.current_chapter
+        ep_idx = self.current_project.current_episode
+        version_key = self.current_project.chapters[ch_idx].episodes[ep_idx].id
         
-        versions = self.current_project["versions"].get(version_key, [])
+        # 一覧にはメタ情報だけを使い、本文は読み込むときに復元する
+        pid = self.current_project.id
+        versions = self.store.versions.list_versions(pid, version_key)
         
         if not versions:
             messagebox.showinfo("情報", "バージョン履歴がありません")
@@ -476,26 +689,190 @@ class NovelWriterPro:
         dialog.title("バージョン履歴")
         dialog.geometry("600x400")
         
-        listbox = tk.Listbox(dialog)
+        listbox = tk.Listbox(dialog, selectmode=tk.EXTENDED)
         listbox.pack(fill=tk.BOTH, expand=True, padx=10, pady=10)
         
         for ver in versions:
-            listbox.insert(tk.END, ver["name"])
+            listbox.insert(tk.END, f"{ver.name} ({ver.size}字)")
         
         def load_version():
             selection = listbox.curselection()
+            if len(selection) > 1:
+                messagebox.showwarning("警告", "読み込むバージョンを1つ選択してください", parent=dialog)
+                return
             if selection:
                 ver = versions[selection[0]]
                 if messagebox.askyesno("確認", "このバージョンを読み込みますか?\n現在の内容は上書きされます。"):
-                    self.text_editor.delete(1.0, tk.END)
-                    self.text_editor.insert(1.0, ver["content"])
-                    self.version_label.config(text=f"[{ver['name']}]")
+                    content = self.store.versions.get_content(pid, version_key, selection[0])
+                    self.set_editor_text(content, version_key, modified=True)
+                    self.version_label.config(text=f"[{ver.name}]")
                     dialog.destroy()
         
+        def compare_version():
+            # 1つ選べば現在の内容と、2つ選べば古い方と新しい方を比べる
+            selection = listbox.curselection()
+            if len(selection) == 1:
+                idx = selection[0]
+                old = (versions[idx].name, self.store.versions.get_content(pid, version_key, idx))
+                new = ("作業中", self.editor_text())
+            elif len(selection) == 2:
+                first, second = selection
+                old = (versions[first].name, self.store.versions.get_content(pid, version_key, first))
+                new = (versions[second].name, self.store.versions.get_content(pid, version_key, second))
+            else:
+                messagebox.showwarning("警告", "比較するバージョンを1つか2つ選択してください", parent=dialog)
+                return
+            self.compare_texts(old, new, version_key, live=len(selection) == 1)
+        
         btn_frame = ttk.Frame(dialog)
         btn_frame.pack(pady=10)
         ttk.Button(btn_frame, text="読み込み", command=load_version).pack(side=tk.LEFT, padx=5)
+        ttk.Button(btn_frame, text="比較", command=compare_version).pack(side=tk.LEFT, padx=5)
+        ttk.Button(btn_frame, text="閉じる", command=dialog.destroy).pack(side=tk.LEFT, padx=5)
+    
+    def compare_texts(self, old, new, version_key, live=False):
+        # old, new: (名前, 本文)。差分は作業スレッドで計算する（同じ組み合わせは覚えておく）
+        # liveなら新しい側は編集画面の内容（戻すときに今の内容と比べ直す）
+        self.tasks.cancel("diff")
+        self.status_label.config(text="比較中…")
+        
+        def done(result):
+            self.status_label.config(text="比較完了")
+            self.show_diff(old[0], new[0], result, version_key, live)
+        
+        self.tasks.submit(lambda task: diff.cached_compare(old[1], new[1]), name="比較", group="diff",
+                          on_done=done, on_error=lambda e: messagebox.showerror("エラー", f"比較に失敗しました:\n{e}"))
+    
+    @timed()
+    def show_diff(self, old_name, new_name, result, version_key, live=False):
+        dialog = tk.Toplevel(self.root)
+        dialog.title(f"比較: {old_name} → {new_name}")
+        dialog.geometry("1100x700")
+        state = {"result": result}
+        
+        top = ttk.Frame(dialog)
+        top.pack(fill=tk.X, padx=10, pady=(10, 0))
+        summary_label = ttk.Label(top)
+        summary_label.pack(side=tk.LEFT)
+        mode_var = tk.StringVar(value="side")
+        ttk.Radiobutton(top, text="1列で表示", variable=mode_var, value="inline",
+                        command=lambda: render()).pack(side=tk.RIGHT, padx=5)
+        ttk.Radiobutton(top, text="並べて表示", variable=mode_var, value="side",
+                        command=lambda: render()).pack(side=tk.RIGHT, padx=5)
+        
+        paned = ttk.PanedWindow(dialog, orient=tk.HORIZONTAL)
+        paned.pack(fill=tk.BOTH, expand=True, padx=10, pady=10)
+        
+        # 変更箇所の一覧（選ぶとその箇所を表示する）
+        hunk_list = tk.Listbox(paned, selectmode=tk.EXTENDED, width=30, exportselection=False)
+        paned.add(hunk_list, weight=1)
+        
+        view = ttk.Frame(paned)
+        paned.add(view, weight=4)
+        panes = []
+        for side in range(2):
+            text = scrolledtext.ScrolledText(view, wrap=tk.CHAR)
+            text.tag_configure("deleted", background="#ffd7d7", overstrike=True)
+            text.tag_configure("inserted", background="#d7f5d7")
+            panes.append(text)
+        
+        def fill_list():
+            result = state["result"]
+            deleted, inserted = result.changed()
+            summary_label.config(text=f"変更 {len(result.hunks)}か所（削除 {deleted}字・追加 {inserted}字）")
+            hunk_list.delete(0, tk.END)
+            a, b = result.a, result.b
+            line, pos = 1, 0
+            for hunk in result.hunks:
+                line += a.count("\n", pos, hunk.a1)
+                pos = hunk.a1
+                changed = "".join(b[j1:j2] or a[i1:i2] for tag, i1, i2, j1, j2 in hunk.ops if tag != "equal")
+                hunk_list.insert(tk.END, f"{line}行: {changed[:20].replace(chr(10), ' ')}")
+        
+        def render():
+            # 区間ごとに (文字列, タグ) を並べて1回のinsertで入れる
+            result = state["result"]
+            a, b = result.a, result.b
+            inline = mode_var.get() == "inline"
+            for text in panes:
+                text.pack_forget()
+            panes[0].pack(side=tk.LEFT, fill=tk.BOTH, expand=True)
+            if not inline:
+                panes[1].pack(side=tk.LEFT, fill=tk.BOTH, expand=True)
+            left, right = [], []
+            marks = []  # 変更箇所ごとの左右の先頭の位置（字数）
+            left_pos = right_pos = 0
+            for tag, i1, i2, j1, j2 in result.opcodes():
+                if tag == "equal":
+                    left += [a[i1:i2], ()]
+                    right += [b[j1:j2], ()]
+                    left_pos += i2 - i1
+                    right_pos += j2 - j1
+                    continue
+                if len(marks) < len(result.hunks) and i1 >= result.hunks[len(marks)].a1:
+                    marks.append((left_pos, right_pos))
+                if i2 > i1:
+                    left += [a[i1:i2], ("deleted",)]
+                    left_pos += i2 - i1
+                if j2 > j1 and inline:
+                    left += [b[j1:j2], ("inserted",)]
+                    left_pos += j2 - j1
+                elif j2 > j1:
+                    right += [b[j1:j2], ("inserted",)]
+                    right_pos += j2 - j1
+            for side, (text, parts) in enumerate(((panes[0], left), (panes[1], right))):
+                text.config(state=tk.NORMAL)
+                text.delete("1.0", tk.END)
+                if parts:
+                    text.insert("1.0", *parts)
+                for n, mark in enumerate(marks):
+                    text.mark_set(f"hunk{n}", f"1.0 + {mark[side]} chars")
+                text.config(state=tk.DISABLED)
+        
+        def show_hunk(event=None):
+            selection = hunk_list.curselection()
+            if not selection:
+                return
+            for text in panes:
+                text.see(f"hunk{selection[-1]}")
+        
+        hunk_list.bind('<<ListboxSelect>>', show_hunk)
+        
+        def restore():
+            # 新しい側のうち、選んだ変更箇所だけを古い側の内容に戻して編集画面に読み込む
+            selection = hunk_list.curselection()
+            if not selection:
+                messagebox.showwarning("警告", "元に戻す変更箇所を選択してください", parent=dialog)
+                return
+            if self.document.owner != version_key:
+                # 比較のあとで別の話を開いた（このまま読み込むと別の話の本文になる）
+                messagebox.showwarning("警告", "比較した話が編集画面に開かれていません。\n"
+                                             "その話を開いてからもう一度比較してください。", parent=dialog)
+                return
+            if live:
+                current = self.editor_text()
+                if current != state["result"].b:
+                    # 比較のあとで書き換えられたので、今の内容と比べ直して選び直してもらう
+                    state["result"] = diff.cached_compare(state["result"].a, current)
+                    fill_list()
+                    render()
+                    messagebox.showinfo("比較", "比較のあとで本文が変更されたので、今の内容と比べ直しました。\n"
+                                              "戻す箇所を選び直してください。", parent=dialog)
+                    return
+            if not messagebox.askyesno("確認", f"選んだ{len(selection)}か所を「{old_name}」の内容に戻しますか?\n"
+                                             f"その箇所を戻した「{new_name}」が編集画面に読み込まれます。", parent=dialog):
+                return
+            self.set_editor_text(state["result"].revert(selection), version_key, modified=True)
+            self.version_label.config(text="[作業中]")
+            self.status_label.config(text=f"{len(selection)}か所を{old_name}に戻しました")
+            dialog.destroy()
+        
+        btn_frame = ttk.Frame(dialog)
+        btn_frame.pack(pady=(0, 10))
+        ttk.Button(btn_frame, text="選んだ変更を元に戻す", command=restore).pack(side=tk.LEFT, padx=5)
         ttk.Button(btn_frame, text="閉じる", command=dialog.destroy).pack(side=tk.LEFT, padx=5)
+        fill_list()
+        render()
     
     # キャラクター管理
     def add_character(self):
@@ -526,7 +903,9 @@ class NovelWriterPro:
                 "personality": personality_entry.get(),
                 "background": background_text.get(1.0, tk.END).strip()
             }
-            self.current_project["characters"].append(character)
+            self.current_project.characters.append(character)
+            self.store.mark_project(self.current_project)
+            self.search.update_profiles(self.current_project)
             self.refresh_characters()
             dialog.destroy()
         
@@ -539,7 +918,7 @@ class NovelWriterPro:
             return
         
         idx = selection[0]
-        char = self.current_project["characters"][idx]
+        char = self.current_project.characters[idx]
         
         dialog = tk.Toplevel(self.root)
         dialog.title("キャラクター情報")
@@ -561,12 +940,14 @@ class NovelWriterPro:
         selection = self.character_listbox.curselection()
         if selection:
             if messagebox.askyesno("確認", "選択したキャラクターを削除しますか?"):
-                del self.current_project["characters"][selection[0]]
+                del self.current_project.characters[selection[0]]
+                self.store.mark_project(self.current_project)
+                self.search.update_profiles(self.current_project)
                 self.refresh_characters()
     
     def refresh_characters(self):
         self.character_listbox.delete(0, tk.END)
-        for char in self.current_project["characters"]:
+        for char in self.current_project.characters:
             self.character_listbox.insert(tk.END, char["name"])
     
     # 世界設定管理
@@ -575,7 +956,9 @@ class NovelWriterPro:
         if name:
             detail = tk.simpledialog.askstring("世界設定", "詳細を入力:")
             setting = {"name": name, "detail": detail or ""}
-            self.current_project["settings"].append(setting)
+            self.current_project.settings.append(setting)
+            self.store.mark_project(self.current_project)
+            self.search.update_profiles(self.current_project)
             self.refresh_settings()
     
     def edit_setting(self):
@@ -585,7 +968,7 @@ class NovelWriterPro:
             return
         
         idx = selection[0]
-        setting = self.current_project["settings"][idx]
+        setting = self.current_project.settings[idx]
         
         dialog = tk.Toplevel(self.root)
         dialog.title("設定詳細")
@@ -601,58 +984,106 @@ class NovelWriterPro:
         selection = self.setting_listbox.curselection()
         if selection:
             if messagebox.askyesno("確認", "選択した設定を削除しますか?"):
-                del self.current_project["settings"][selection[0]]
+                del self.current_project.settings[selection[0]]
+                self.store.mark_project(self.current_project)
+                self.search.update_profiles(self.current_project)
                 self.refresh_settings()
     
     def refresh_settings(self):
         self.setting_listbox.delete(0, tk.END)
-        for setting in self.current_project["settings"]:
+        for setting in self.current_project.settings:
             self.setting_listbox.insert(tk.END, setting["name"])
     
     # 文章チェック機能
-    def check_repetition(self):
-        text = self.text_editor.get(1.0, tk.END)
-        words = {}
+    def check_documents(self):
+        # チェック対象を (ラベル, 本文を返す関数) のリストで返す（関数は作業スレッドで呼ばれる）
+        scope = self.check_scope.current()
+        if scope == 0:
+            text = self.editor_text()
+            return [(self.title_entry.get() or "編集中の話", lambda: text)]
         
-        # 3文字以上の繰り返しをチェック
-        for i in range(len(text) - 2):
-            word = text[i:i+3]
-            if word.strip() and not word.isspace():
-                words[word] = words.get(word, 0) + 1
+        self.save_current_episode()
+        if scope == 1:
+            ch_idx = self.current_project.current_chapter
+            chapters = [self.current_project.chapters[ch_idx]] if ch_idx is not None else []
+        else:
+            chapters = self.current_project.chapters
         
-        repeated = [(w, c) for w, c in words.items() if c > 3]
-        repeated.sort(key=lambda x: x[1], reverse=True)
+        project = self.current_project
+        return [(ep.title, self.content_loader(project, ep)) for ch in chapters for ep in ch.episodes]
+    
+    def content_loader(self, project, ep):
+        # 作業スレッドで本文を返す関数。メモリにある本文はここで取り出し、無ければ保存先から読む
+        if ep.content is not None:
+            text = ep.content
+            return lambda: text
+        store, pid, eid = self.store, project.id, ep.id
+        return lambda: store.read_content(pid, eid)
+    
+    def run_check(self, name, fn, show):
+        # 前のチェックが残っていれば取り消してから実行する
+        self.tasks.cancel("check")
+        self.status_label.config(text=f"{name}…")
+        
+        def done(result):
+            show(result)
+            self.status_label.config(text=f"{name}完了")
         
+        self.tasks.submit(fn, name=name, group="check", on_done=done,
+                          on_error=lambda e: messagebox.showerror("エラー", f"{name}に失敗しました:\n{e}"))
+    
+    @timed()
+    def check_repetition(self):
+        try:
+            n = int(self.ngram_size.get())
+            if not MIN_N <= n <= MAX_N:
+                raise ValueError(n)
+        except ValueError:
+            messagebox.showerror("エラー", f"語句の長さは{MIN_N}〜{MAX_N}で指定してください")
+            return
+        
+        docs = self.check_documents()
+        self.run_check("繰り返し語句検出",
+                       lambda task: find_repetitions(track(task, docs), n=n),
+                       lambda hits: self.show_repetition(hits, n))
+    
+    def show_repetition(self, hits, n):
         self.check_result.delete(1.0, tk.END)
-        if repeated:
-            self.check_result.insert(tk.END, "繰り返し語句検出:\n\n")
-            for word, count in repeated[:15]:
-                self.check_result.insert(tk.END, f"「{word}」: {count}回\n")
+        if hits:
+            self.check_result.insert(tk.END, f"繰り返し語句検出（{n}文字）:\n\n")
+            for hit in hits:
+                self.check_result.insert(tk.END, f"「{hit['gram']}」: {hit['count']}回\n")
+                for label, pos, line, col in hit["positions"][:3]:
+                    self.check_result.insert(tk.END, f"    {label} 行{line}:{col}\n")
         else:
             self.check_result.insert(tk.END, "目立った繰り返しは検出されませんでした。")
     
+    @timed()
     def check_balance(self):
-        text = self.text_editor.get(1.0, tk.END).strip()
+        docs = self.check_documents()
+        self.run_check("文体バランス分析",
+                       lambda task: self.balance.analyze_documents(track(task, docs)),
+                       self.show_balance)
+    
+    def show_balance(self, result):
+        per_doc, hist = result
+        total = charclass.letter_total(hist)
         
-        if not text:
+        if not total:
             self.check_result.delete(1.0, tk.END)
             self.check_result.insert(tk.END, "テキストがありません。")
             return
         
-        kanji_count = sum(1 for c in text if '\u4e00' <= c <= '\u9fff')
-        hiragana_count = sum(1 for c in text if '\u3040' <= c <= '\u309f')
-        katakana_count = sum(1 for c in text if '\u30a0' <= c <= '\u30ff')
-        
-        total = len(text)
-        
         self.check_result.delete(1.0, tk.END)
-        result = f"""文字種バランス分析:
-
-漢字: {kanji_count}文字 ({kanji_count/total*100:.1f}%)
-ひらがな: {hiragana_count}文字 ({hiragana_count/total*100:.1f}%)
-カタカナ: {katakana_count}文字 ({katakana_count/total*100:.1f}%)
-
-総文字数: {total}
+        result = "文字種バランス分析:\n\n"
+        for name, label in charclass.CLASSES:
+            if name == "space":
+                result += f"{label}: {hist[name]}文字\n"
+            else:
+                result += f"{label}: {hist[name]}文字 ({charclass.ratio(hist, name):.1f}%)\n"
+        
+        result += f"""
+総文字数（空白・改行除く）: {total}
 
 【推奨バランス】
 漢字: 20-30%
@@ -663,91 +1094,224 @@ class NovelWriterPro:
 """
         
         # 簡易評価
-        if 20 <= kanji_count/total*100 <= 30:
+        evaluation = charclass.evaluate(hist)
+        if evaluation["kanji"]:
             result += "✓ 漢字バランス良好\n"
         else:
             result += "△ 漢字の割合を調整してみてください\n"
         
-        if 60 <= hiragana_count/total*100 <= 70:
+        if evaluation["hiragana"]:
             result += "✓ ひらがなバランス良好\n"
         else:
             result += "△ ひらがなの割合を調整してみてください\n"
         
+        if len(per_doc) > 1:
+            result += "\n【話別】\n"
+            for label, doc_hist in per_doc:
+                result += (f"{label}: 漢字 {charclass.ratio(doc_hist, 'kanji'):.1f}% / "
+                           f"ひらがな {charclass.ratio(doc_hist, 'hiragana'):.1f}% / "
+                           f"カタカナ {charclass.ratio(doc_hist, 'katakana'):.1f}%\n")
+        
         self.check_result.insert(tk.END, result)
     
+    @timed()
     def check_punctuation(self):
-        text = self.text_editor.get(1.0, tk.END)
-        
-        # 句読点の連続をチェック
-        issues = []
-        
-        for i in range(len(text) - 1):
-            if text[i] == '、' and text[i+1] == '、':
-                issues.append(f"行{self.get_line_number(text, i)}: 読点が連続")
-            if text[i] == '。' and text[i+1] == '。':
-                issues.append(f"行{self.get_line_number(text, i)}: 句点が連続")
-        
-        comma_count = text.count('、')
-        period_count = text.count('。')
-        
+        docs = self.check_documents()
+        # 句読点・表記の規則をまとめて1回で走査する
+        self.run_check("句読点チェック",
+                       lambda task: self.linter.check_documents(track(task, docs), with_labels=len(docs) > 1),
+                       self.show_punctuation)
+    
+    def show_punctuation(self, result):
+        issues, comma_count, period_count = result
         self.check_result.delete(1.0, tk.END)
         self.check_result.insert(tk.END, f"句読点チェック:\n\n")
         self.check_result.insert(tk.END, f"読点（、）: {comma_count}個\n")
         self.check_result.insert(tk.END, f"句点（。）: {period_count}個\n\n")
         
         if issues:
-            self.check_result.insert(tk.END, "【検出された問題】\n")
-            for issue in issues:
-                self.check_result.insert(tk.END, f"- {issue}\n")
+            self.check_result.insert(tk.END, f"【検出された問題】{len(issues)}件\n")
+            self.check_result.insert(tk.END, "".join(f"- {issue}\n" for issue in issues[:500]))
+            if len(issues) > 500:
+                self.check_result.insert(tk.END, f"（ほか{len(issues) - 500}件）\n")
         else:
             self.check_result.insert(tk.END, "問題は検出されませんでした。")
     
-    def get_line_number(self, text, pos):
-        return text[:pos].count('\n') + 1
+    # 編集中の本文
+    @timed()
+    def set_editor_text(self, content, owner=None, modified=False):
+        # 長い話はPAGE_LINES行ずつに分けて表示する
+        paged = len(content) > PAGE_THRESHOLD
+        self.document.reset(content, PAGE_LINES if paged else None, owner)
+        self.document.modified = modified
+        self.word_counter.reset(content)
+        self.show_window()
+    
+    def show_window(self):
+        self.loading_editor = True
+        try:
+            self.text_editor.delete(1.0, tk.END)
+            self.text_editor.insert(1.0, self.document.window_text())
+        finally:
+            self.loading_editor = False
+        # 表示範囲をまたいで元に戻すと本文と食い違うので、履歴は表示のたびに消す
+        self.text_editor.edit_reset()
+        
+        if self.document.paged:
+            page, pages = self.document.page()
+            self.page_label.config(text=f"{page}/{pages}ページ")
+            self.page_prev.config(state=tk.NORMAL if page > 1 else tk.DISABLED)
+            self.page_next.config(state=tk.NORMAL if page < pages else tk.DISABLED)
+        else:
+            self.page_label.config(text="")
+            self.page_prev.config(state=tk.DISABLED)
+            self.page_next.config(state=tk.DISABLED)
+    
+    @timed()
+    def change_page(self, offset):
+        if not self.document.paged:
+            return
+        self.sync_document()
+        self.document.set_window(self.document.first + offset * PAGE_LINES)
+        self.show_window()
+    
+    def sync_document(self):
+        # 追えなかった変化があれば、表示中の範囲だけをウィジェットから読み直す
+        if self.document.stale or str(self.text_tracker.call("index", "end-1c")) != self.document.end_index():
+            self.document.sync(self.text_tracker.call("get", "1.0", "end-1c"))
+    
+    def editor_text(self):
+        self.sync_document()
+        return self.document.text()
+    
+    def editor_index(self, index):
+        # 位置を「行.桁」に直す（末尾の改行より後ろは末尾に寄せる）
+        if self.text_tracker.call("compare", index, ">", "end-1c"):
+            index = "end-1c"
+        line, col = str(self.text_tracker.call("index", index)).split(".")
+        return int(line), int(col)
     
     # 進捗管理
+    @timed()
+    def on_text_insert(self, index, text):
+        if self.loading_editor:
+            return
+        self.document.insert(*self.editor_index(index), text)
+        self.word_counter.inserted(text)
+        self.schedule_word_count()
+        self.autosave.changed(len(text))
+    
+    @timed()
+    def on_text_delete(self, index1, index2, text):
+        if self.loading_editor:
+            return
+        length = self.document.length
+        self.document.delete(*self.editor_index(index1), *self.editor_index(index2))
+        self.autosave.changed(length - self.document.length)
+        if text is None and not self.document.paged:
+            self.word_counter.clear()  # 全文削除
+        elif text is None:
+            self.word_counter.invalidate()
+        else:
+            self.word_counter.deleted(text)
+        self.schedule_word_count()
+    
+    def on_text_reset(self):
+        self.document.stale = True
+        self.word_counter.invalidate()
+        self.schedule_word_count()
+    
+    def on_text_modified(self, event):
+        # 挿入・削除として追えない変更も含め、Textの変更フラグで自動保存を予約する
+        if self.text_editor.edit_modified():
+            self.text_editor.edit_modified(False)
+            if not self.loading_editor:
+                self.autosave.changed()
+    
+    def editor_dirty(self):
+        episode = self.index.episode(self.document.owner) if self.document.owner else None
+        if episode is None:
+            return False
+        return (self.document.modified or self.document.stale or
+                self.title_entry.get() != episode.title)
+    
+    def has_unsaved_changes(self):
+        return self.store.is_dirty() or self.search.is_dirty() or self.editor_dirty()
+    
+    def schedule_word_count(self):
+        # 連続した入力は150msごとにまとめて表示へ反映する
+        if self.word_count_timer is None:
+            self.word_count_timer = self.root.after(150, self.update_word_count)
+    
+    @timed()
     def update_word_count(self, event=None):
-        text = self.text_editor.get(1.0, tk.END).strip()
-        count = len(text)
-        self.word_count_label.config(text=f"文字数: {count}")
+        if self.word_count_timer is not None:
+            self.root.after_cancel(self.word_count_timer)
+            self.word_count_timer = None
+        if self.word_counter.stale:
+            self.word_counter.reset(self.editor_text())
+        
+        count = self.word_counter.total
+        self.word_count_label.config(text=f"文字数: {count} (空白・改行除く: {self.word_counter.nonspace})")
         
-        goal = self.current_project["writing_goal"]
+        goal = self.current_project.writing_goal
         progress = min(100, (count / goal * 100))
         self.goal_label.config(text=f"目標: {goal} ({progress:.1f}%)")
     
     def update_chapter_count(self):
-        if self.current_project["current_chapter"] is not None:
-            ch_idx = self.current_project["current_chapter"]
-            chapter = self.current_project["chapters"][ch_idx]
-            total = sum(ep.get("word_count", 0) for ep in chapter["episodes"])
-            self.chapter_count_label.config(text=f"章合計: {total}")
+        if self.current_project.current_chapter is not None:
+            ch_idx = self.current_project.current_chapter
+            chapter = self.current_project.chapters[ch_idx]
+            self.chapter_count_label.config(text=f"章合計: {self.stats.chapter_total(chapter)}")
+    
+    def progress_visible(self):
+        return self.tool_tabs.select() == str(self.progress_tab)
+    
+    def schedule_progress(self):
+        # 保存のたびに書き直さず、1秒ごとにまとめて進捗タブ（表示中のときだけ）へ反映する
+        if self.progress_timer is None and self.progress_visible():
+            self.progress_timer = self.root.after(1000, self.update_progress)
     
     def set_goal(self):
         try:
             goal = int(self.goal_entry.get())
-            self.current_project["writing_goal"] = goal
+            self.current_project.writing_goal = goal
+            self.store.mark_project(self.current_project)
             self.update_progress()
             messagebox.showinfo("設定完了", f"目標文字数を{goal}に設定しました")
         except ValueError:
             messagebox.showerror("エラー", "数値を入力してください")
     
+    @timed()
     def update_progress(self):
-        total_words = 0
-        chapter_stats = []
-        
-        for ch in self.current_project["chapters"]:
-            ch_total = sum(ep.get("word_count", 0) for ep in ch["episodes"])
-            total_words += ch_total
-            chapter_stats.append((ch["title"], ch_total, len(ch["episodes"])))
-        
-        goal = self.current_project["writing_goal"]
+        if self.progress_timer is not None:
+            self.root.after_cancel(self.progress_timer)
+            self.progress_timer = None
+        total_words = self.stats.total
+        chapter_stats = self.stats.chapter_rows()
+        
+        goal = self.current_project.writing_goal
+        pid = self.current_project.id
+        sessions = self.store.sessions
+        today = max(0, sessions.day(pid))
+        streak, longest = sessions.streak(pid, goal=goal)
         
         self.progress_text.delete(1.0, tk.END)
         self.progress_text.insert(tk.END, f"【プロジェクト進捗】\n")
-        self.progress_text.insert(tk.END, f"プロジェクト名: {self.current_project['name']}\n\n")
+        self.progress_text.insert(tk.END, f"プロジェクト名: {self.current_project.name}\n\n")
         self.progress_text.insert(tk.END, f"総文字数: {total_words:,} 文字\n")
+        self.progress_text.insert(tk.END, f"今日の執筆: {today:,} 文字\n")
         self.progress_text.insert(tk.END, f"今日の目標: {goal:,} 文字\n")
-        self.progress_text.insert(tk.END, f"進捗率: {min(100, total_words/goal*100):.1f}%\n\n")
+        self.progress_text.insert(tk.END, f"進捗率: {min(100, today/goal*100) if goal else 0:.1f}%\n")
+        self.progress_text.insert(tk.END, f"目標達成の連続日数: {streak}日（最長 {longest}日）\n\n")
+        
+        self.progress_text.insert(tk.END, "【直近7日】\n")
+        for day, chars in sessions.daily(pid, days=7):
+            self.progress_text.insert(tk.END, f"  {day.strftime('%m/%d')}({'月火水木金土日'[day.weekday()]}): {chars:,} 文字\n")
+        self.progress_text.insert(tk.END, "\n【週別（月曜から）】\n")
+        for monday, chars in sessions.weekly(pid, weeks=4):
+            self.progress_text.insert(tk.END, f"  {monday.strftime('%m/%d')}の週: {chars:,} 文字\n")
+        self.progress_text.insert(tk.END, "\n")
         
         self.progress_text.insert(tk.END, "【章別統計】\n")
         for title, words, ep_count in chapter_stats:
@@ -779,99 +1343,711 @@ class NovelWriterPro:
         self.status_label.config(text="通常モード")
         self.root.unbind("<Escape>")
     
+    @timed()
     def export_project(self):
-        filename = filedialog.asksaveasfilename(
-            defaultextension=".txt",
-            filetypes=[("Text File", "*.txt"), ("All Files", "*.*")]
-        )
-        if filename:
-            with open(filename, 'w', encoding='utf-8') as f:
-                f.write(f"{self.current_project['name']}\n")
-                f.write("="*80 + "\n\n")
-                
-                for ch in self.current_project["chapters"]:
-                    f.write(f"\n{'='*80}\n")
-                    f.write(f"{ch['title']}\n")
-                    f.write(f"{'='*80}\n\n")
-                    
-                    for ep in ch["episodes"]:
-                        f.write(f"\n{'-'*60}\n")
-                        f.write(f"{ep['title']}\n")
-                        f.write(f"{'-'*60}\n\n")
-                        f.write(ep["content"])
-                        f.write("\n\n")
+        self.save_current_episode()
+        project = self.current_project
+        
+        dialog = tk.Toplevel(self.root)
+        dialog.title("エクスポート")
+        dialog.geometry("420x460")
+        
+        ttk.Label(dialog, text="形式:").pack(anchor=tk.W, padx=10, pady=(10, 0))
+        formats = list(export.WRITERS.values())
+        format_combo = ttk.Combobox(dialog, state="readonly", values=[w.label for w in formats])
+        format_combo.current(0)
+        format_combo.pack(fill=tk.X, padx=10, pady=5)
+        
+        ttk.Label(dialog, text="章（未選択ならすべて）:").pack(anchor=tk.W, padx=10)
+        chapter_list = tk.Listbox(dialog, selectmode=tk.EXTENDED, height=10, exportselection=False)
+        chapter_list.pack(fill=tk.BOTH, expand=True, padx=10, pady=5)
+        for ch in project.chapters:
+            chapter_list.insert(tk.END, self.chapter_row(ch))
+        
+        range_frame = ttk.Frame(dialog)
+        range_frame.pack(fill=tk.X, padx=10, pady=5)
+        ttk.Label(range_frame, text="話の範囲（通し番号）:").pack(side=tk.LEFT)
+        first_entry = ttk.Entry(range_frame, width=6)
+        first_entry.pack(side=tk.LEFT, padx=2)
+        ttk.Label(range_frame, text="〜").pack(side=tk.LEFT)
+        last_entry = ttk.Entry(range_frame, width=6)
+        last_entry.pack(side=tk.LEFT, padx=2)
+        
+        def start():
+            try:
+                first = int(first_entry.get()) if first_entry.get().strip() else None
+                last = int(last_entry.get()) if last_entry.get().strip() else None
+            except ValueError:
+                messagebox.showerror("エラー", "話の範囲は数字で入力してください", parent=dialog)
+                return
+            writer = formats[format_combo.current()]
+            filename = filedialog.asksaveasfilename(
+                parent=dialog,
+                defaultextension=writer.extension,
+                filetypes=[(writer.label, "*" + writer.extension), ("All Files", "*.*")]
+            )
+            if not filename:
+                return
+            
+            # 話の絞り込みだけをUIスレッドで行い、本文の読み込み・章ごとの描画・ファイルへの
+            # 書き込みは作業スレッドで行う（本文は章を描画するときに読む）
+            chapters = [(ch.title, [(ep.title, ep) for ep in ch.episodes]) for ch in project.chapters]
+            selected = set(chapter_list.curselection()) or None
+            chapters = [(title, [(ep_title, self.content_loader(project, ep)) for ep_title, ep in episodes])
+                        for title, episodes in export.select_episodes(chapters, selected, first, last)]
+            if not chapters:
+                messagebox.showinfo("エクスポート", "書き出す話がありません", parent=dialog)
+                return
+            dialog.destroy()
+            
+            def write(task):
+                export.export(writer.name, filename, project.name, chapters, task, book_id=project.id)
             
-            messagebox.showinfo("エクスポート完了", f"{filename}に保存しました")
-            self.status_label.config(text=f"エクスポート完了: {os.path.basename(filename)}")
+            def done(result):
+                messagebox.showinfo("エクスポート完了", f"{filename}に保存しました")
+                self.status_label.config(text=f"エクスポート完了: {os.path.basename(filename)}")
+            
+            self.tasks.submit(write, name="エクスポート", group="export", lane="io", on_done=done,
+                              on_error=lambda e: messagebox.showerror("エラー", f"エクスポートに失敗しました:\n{e}"))
+        
+        btn_frame = ttk.Frame(dialog)
+        btn_frame.pack(pady=10)
+        ttk.Button(btn_frame, text="書き出す", command=start).pack(side=tk.LEFT, padx=5)
+        ttk.Button(btn_frame, text="キャンセル", command=dialog.destroy).pack(side=tk.LEFT, padx=5)
+    
+    # 一括置換
+    def replace_dialog(self):
+        dialog = tk.Toplevel(self.root)
+        dialog.title("プロジェクト全体で置換")
+        dialog.geometry("600x500")
+        
+        form = ttk.Frame(dialog)
+        form.pack(fill=tk.X, padx=10, pady=10)
+        ttk.Label(form, text="検索:").grid(row=0, column=0, sticky=tk.W, pady=2)
+        find_entry = ttk.Entry(form, width=40)
+        find_entry.grid(row=0, column=1, sticky=tk.W, pady=2)
+        ttk.Label(form, text="置換後:").grid(row=1, column=0, sticky=tk.W, pady=2)
+        replace_entry = ttk.Entry(form, width=40)
+        replace_entry.grid(row=1, column=1, sticky=tk.W, pady=2)
+        regex_var = tk.BooleanVar(value=False)
+        ttk.Checkbutton(form, text="正規表現", variable=regex_var).grid(row=2, column=1, sticky=tk.W, pady=2)
+        
+        preview_text = scrolledtext.ScrolledText(dialog, wrap=tk.WORD)
+        preview_text.pack(fill=tk.BOTH, expand=True, padx=10, pady=5)
+        
+        state = {"params": None, "changes": []}
+        
+        def params():
+            return find_entry.get(), replace_entry.get(), regex_var.get()
+        
+        def preview():
+            find, replacement, regex = params()
+            try:
+                changes = self.plan_project_replace(find, replacement, regex)
+            except ValueError as e:
+                messagebox.showerror("エラー", str(e), parent=dialog)
+                return False
+            state["params"] = (find, replacement, regex)
+            state["changes"] = changes
+            
+            total, episodes = summary(changes)
+            preview_text.delete(1.0, tk.END)
+            preview_text.insert(tk.END, f"{episodes}話で{total}件が置換されます\n\n")
+            for change in changes:
+                places = ", ".join(f"{line}行{col}桁" for pos, line, col in change["positions"])
+                more = " …" if change["count"] > len(change["positions"]) else ""
+                preview_text.insert(tk.END, f"{change['label']}: {change['count']}件 ({places}{more})\n")
+            return True
+        
+        def apply():
+            # プレビュー後に条件や本文が変わっていれば計算し直す
+            self.save_current_episode()
+            if state["params"] != params() or any(
+                    self.store.content(self.current_project, self.index.episode(c["key"])) != c["old"]
+                    for c in state["changes"] if self.index.episode(c["key"]) is not None):
+                if not preview():
+                    return
+            if not state["changes"]:
+                messagebox.showinfo("置換", "一致する箇所はありません", parent=dialog)
+                return
+            total, episodes = summary(state["changes"])
+            if messagebox.askyesno("確認", f"{episodes}話で{total}件を置換しますか?\n"
+                                         f"（置換前の状態は「置換の取り消し」で戻せます）", parent=dialog):
+                self.apply_replace(state["changes"], *state["params"])
+                dialog.destroy()
+        
+        btn_frame = ttk.Frame(dialog)
+        btn_frame.pack(pady=10)
+        ttk.Button(btn_frame, text="プレビュー", command=preview).pack(side=tk.LEFT, padx=5)
+        ttk.Button(btn_frame, text="すべて置換", command=apply).pack(side=tk.LEFT, padx=5)
+        ttk.Button(btn_frame, text="閉じる", command=dialog.destroy).pack(side=tk.LEFT, padx=5)
+    
+    def plan_project_replace(self, find, replacement, regex):
+        self.save_current_episode()
+        project = self.current_project
+        docs = [(ep.id, ep.title, self.store.content(project, ep))
+                for ch in project.chapters for ep in ch.episodes]
+        start = datetime.now()
+        changes = plan_replace(docs, find, replacement, regex)
+        elapsed = (datetime.now() - start).total_seconds() * 1000
+        self.status_label.config(text=f"置換プレビュー: {len(changes)}話 ({elapsed:.0f}ms)")
+        return changes
+    
+    @timed()
+    def apply_replace(self, changes, find, replacement, regex):
+        project = self.current_project
+        timestamp = datetime.now().strftime("%Y/%m/%d %H:%M:%S")
+        
+        # 置換前の本文をまとめて1つのバージョンとして残す（取り消しはこれを丸ごと戻す）
+        snapshot = {change["key"]: change["old"] for change in changes}
+        self.store.versions.append(project.id, REPLACE_HISTORY_KEY,
+                                   json.dumps(snapshot, ensure_ascii=False), "replace",
+                                   f"「{find}」→「{replacement}」 ({len(changes)}話) - {timestamp}", timestamp)
+        
+        self.set_episode_contents({change["key"]: change["new"] for change in changes})
+        total, episodes = summary(changes)
+        self.status_label.config(text=f"置換完了: {episodes}話で{total}件")
+    
+    def set_episode_contents(self, contents):
+        # contents: 話ID -> 新しい本文。変わった話だけを保存対象にし、文字数・索引・一覧を更新する
+        project = self.current_project
+        current = None
+        if project.current_chapter is not None and project.current_episode is not None:
+            chapter = project.chapters[project.current_chapter]
+            if project.current_episode < len(chapter.episodes):
+                current = chapter.episodes[project.current_episode]
+        
+        for eid, content in contents.items():
+            episode = self.index.episode(eid)
+            if episode is None:
+                continue  # 置換後に削除された話
+            chapter = self.index.chapter_of(eid)
+            self.stats.episode_changed(chapter, episode.word_count, len(content))
+            self.store.sessions.record(project.id, eid, len(content) - episode.word_count)
+            episode.content = content
+            episode.word_count = len(content)
+            self.store.mark_episode(project, episode)
+            self.store.mark_chapter(project, chapter)
+            self.search.update_episode(project, episode)
+        
+        if current is not None and current.id in contents:
+            self.set_editor_text(current.content, current.id)
+        
+        for eid in contents:
+            episode = self.index.episode(eid)
+            if episode is not None:
+                self.outline.update(episode)
+        self.update_word_count()
+        self.update_chapter_count()
+        self.update_progress()
+        self.save_all()
+    
+    def show_replace_history(self):
+        pid = self.current_project.id
+        versions = self.store.versions.list_versions(pid, REPLACE_HISTORY_KEY)
+        if not versions:
+            messagebox.showinfo("情報", "置換の履歴がありません")
+            return
+        
+        dialog = tk.Toplevel(self.root)
+        dialog.title("置換の取り消し")
+        dialog.geometry("500x400")
+        
+        listbox = tk.Listbox(dialog)
+        listbox.pack(fill=tk.BOTH, expand=True, padx=10, pady=10)
+        for ver in reversed(versions):
+            listbox.insert(tk.END, ver.name)
+        
+        def restore():
+            selection = listbox.curselection()
+            if not selection:
+                return
+            idx = len(versions) - 1 - selection[0]
+            if not messagebox.askyesno("確認", "置換前の本文に戻しますか?", parent=dialog):
+                return
+            self.save_current_episode()
+            snapshot = json.loads(self.store.versions.get_content(pid, REPLACE_HISTORY_KEY, idx))
+            self.set_episode_contents(snapshot)
+            self.status_label.config(text=f"置換を取り消しました ({len(snapshot)}話)")
+            dialog.destroy()
+        
+        btn_frame = ttk.Frame(dialog)
+        btn_frame.pack(pady=10)
+        ttk.Button(btn_frame, text="置換前に戻す", command=restore).pack(side=tk.LEFT, padx=5)
+        ttk.Button(btn_frame, text="閉じる", command=dialog.destroy).pack(side=tk.LEFT, padx=5)
+    
+    # 全文検索
+    @timed()
+    def run_search(self):
+        query = self.search_entry.get().strip()
+        if not query:
+            return
+        self.save_current_episode()
+        projects = [self.current_project] if self.search_scope.current() == 0 else self.projects
+        
+        if any(self.search.loaded(p) is None for p in projects):
+            # 初回だけ索引を作る（以後は保存ごとに変わった話だけ更新される）
+            self.status_label.config(text="検索索引を作成中…")
+            self.root.update_idletasks()
+        
+        start = datetime.now()
+        self.search_hits = self.search.search(projects, query)
+        elapsed = (datetime.now() - start).total_seconds() * 1000
+        
+        self.search_listbox.delete(0, tk.END)
+        for hit in self.search_hits:
+            self.search_listbox.insert(tk.END, f"{self.search_label(hit)} ({hit['count']}件) {hit['snippet']}")
+        self.status_label.config(text=f"検索: 「{query}」 {len(self.search_hits)}件 ({elapsed:.0f}ms)")
+    
+    def search_label(self, hit):
+        project = hit["project"]
+        kind, oid, field = hit["key"]
+        prefix = f"[{project.name}] " if project is not self.current_project else ""
+        if kind == "character":
+            return f"{prefix}キャラクター: {project.characters[oid]['name']}"
+        if kind == "setting":
+            return f"{prefix}世界設定: {project.settings[oid]['name']}"
+        index = self.index if project is self.current_project else ProjectIndex(project)
+        if kind == "chapter":
+            return f"{prefix}{index.chapter(oid).title}"
+        label = index.episode(oid).title
+        return f"{prefix}{label}（メモ）" if field == "memo" else f"{prefix}{label}"
+    
+    def open_search_hit(self, event):
+        selection = self.search_listbox.curselection()
+        if not selection:
+            return
+        hit = self.search_hits[selection[0]]
+        project = hit["project"]
+        kind, oid, field = hit["key"]
+        
+        if project is not self.current_project:
+            if project not in self.projects:
+                return
+            self.save_current_episode()
+            self.current_project_idx = self.projects.index(project)
+            self.current_project = project
+            self.store.mark_library()
+            self.refresh_ui()
+        
+        if kind == "character":
+            self.character_listbox.selection_clear(0, tk.END)
+            self.character_listbox.selection_set(oid)
+            self.edit_character()
+            return
+        if kind == "setting":
+            self.setting_listbox.selection_clear(0, tk.END)
+            self.setting_listbox.selection_set(oid)
+            self.edit_setting()
+            return
+        
+        target = self.index.chapter(oid) if kind == "chapter" else self.index.episode(oid)
+        if target is None:
+            return
+        self.outline.select(target)
+        if kind == "chapter":
+            self.on_chapter_select(None)
+        else:
+            self.load_episode(None)
+            if field == "content":
+                # 最初の一致箇所へ移動する
+                pos = f"1.0+{hit['pos']}c"
+                self.text_editor.mark_set(tk.INSERT, pos)
+                self.text_editor.see(pos)
+                self.text_editor.focus_set()
     
     # データ保存・読込
-    def save_all(self):
+    @timed()
+    def save_all(self, wait=False):
+        start = time.perf_counter()
         self.save_current_episode()
         
-        data = {
-            "projects": self.projects,
-            "current_project_idx": self.current_project_idx
-        }
+        # 検索索引は変わった文書の分だけを、作業スレッドで変更ログに追記する
+        index_files = [] if self.store.read_only else self.search.prepare_save(self.projects)
+        if index_files:
+            if wait:
+                self.search.write(index_files)
+            else:
+                self.tasks.submit(lambda task: self.search.write(index_files), name="索引保存",
+                                  group="save", lane="io")
+        
+        # 変更のあった記録だけを書き込む（変更が無ければI/Oなし）
+        lines = self.store.prepare_save(self.projects, self.current_project_idx)
+        if not lines:
+            return
+        prepared = time.perf_counter() - start
         
-        with open("novels_data.json", 'w', encoding='utf-8') as f:
-            json.dump(data, f, ensure_ascii=False, indent=2)
+        if wait:
+            self.store.commit(lines)
+            self.store.sessions.flush()
+            self.autosave.saved(time.perf_counter() - start)
+            self.status_label.config(text=f"保存完了 ({len(lines)}件)")
+            return
         
-        self.status_label.config(text="自動保存完了")
+        def commit(task):
+            # 書き込みにかかった時間（作業スレッドの待ち時間は含めない）を返す
+            begin = time.perf_counter()
+            self.store.commit(lines)
+            self.store.sessions.flush()  # 執筆記録（今回の保存までの文字数の増減）
+            return time.perf_counter() - begin
+        
+        def done(elapsed):
+            self.autosave.saved(prepared + elapsed)
+            self.update_save_stats()
+            self.status_label.config(text=f"自動保存完了 ({len(lines)}件)")
+        
+        # ジャーナルへの追記とfsyncは作業スレッドで（投入順に実行される）
+        self.tasks.submit(commit, name="保存中", group="save", lane="io", on_done=done,
+                          on_error=lambda e: messagebox.showerror("保存エラー", f"保存に失敗しました:\n{e}"))
+    
+    def update_save_stats(self):
+        autosave = self.autosave
+        written = self.store.bytes_written + self.store.versions.bytes_written + self.search.bytes_written
+        latency = f"{autosave.last_latency * 1000:.0f}ms" if autosave.last_latency is not None else "-"
+        self.save_stats_label.config(
+            text=f"保存 {autosave.saves}回 / スキップ {autosave.skipped}回 / {written / 1024:.0f}KB / 前回 {latency}")
+    
+    # 処理時間の計測
+    def toggle_profiling(self):
+        PROFILER.enabled = self.profiling_var.get()
+        self.status_label.config(text="処理時間の計測を開始しました" if PROFILER.enabled else "処理時間の計測を停止しました")
+    
+    def toggle_overlay(self):
+        if self.overlay_var.get():
+            if not PROFILER.enabled:
+                self.profiling_var.set(True)
+                self.toggle_profiling()
+            self.debug_label.pack(side=tk.RIGHT, padx=2, pady=2, before=self.save_stats_label)
+            self.update_debug_overlay()
+        else:
+            self.debug_label.pack_forget()
+    
+    def update_debug_overlay(self):
+        # p95の大きい操作を3つと、読み書きしたバイト数
+        parts = [f"{name.rsplit('.', 1)[-1]} {s['p50'] * 1000:.0f}/{s['p95'] * 1000:.0f}/{s['max'] * 1000:.0f}ms"
+                 for name, s in list(PROFILER.summary().items())[:3]]
+        counters = PROFILER.counters
+        parts.append(f"読 {counters.get('read_bytes', 0) / 1024:.0f}KB 書 {counters.get('write_bytes', 0) / 1024:.0f}KB")
+        self.debug_label.config(text=" | ".join(parts))
+    
+    def show_profile(self):
+        dialog = tk.Toplevel(self.root)
+        dialog.title("計測結果（p50 / p95 / 最大）")
+        dialog.geometry("760x480")
+        
+        text = scrolledtext.ScrolledText(dialog, wrap=tk.NONE, font=("Courier", 10))
+        text.pack(fill=tk.BOTH, expand=True, padx=10, pady=10)
+        
+        def refresh():
+            text.delete("1.0", tk.END)
+            if not PROFILER.enabled and not PROFILER.histograms:
+                text.insert("1.0", "計測していません。「表示」→「処理時間を計測」で開始します。")
+            else:
+                text.insert("1.0", PROFILER.report())
+        
+        def reset():
+            PROFILER.reset()
+            refresh()
+        
+        button_frame = ttk.Frame(dialog)
+        button_frame.pack(pady=(0, 10))
+        ttk.Button(button_frame, text="更新", command=refresh).pack(side=tk.LEFT, padx=5)
+        ttk.Button(button_frame, text="リセット", command=reset).pack(side=tk.LEFT, padx=5)
+        ttk.Button(button_frame, text="閉じる", command=dialog.destroy).pack(side=tk.LEFT, padx=5)
+        refresh()
     
+    def export_trace(self):
+        if not PROFILER.events:
+            messagebox.showinfo("トレース", "記録された処理がありません。「表示」→「処理時間を計測」で開始します。")
+            return
+        filename = filedialog.asksaveasfilename(
+            defaultextension=".json",
+            filetypes=[("Chromeトレース", "*.json"), ("すべてのファイル", "*.*")],
+            initialfile=f"trace_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json")
+        if filename:
+            count = PROFILER.export_trace(filename)
+            messagebox.showinfo("トレース", f"{count}件のイベントを書き出しました。\n"
+                                            "chrome://tracing や Perfetto で開けます。")
+    
+    def toggle_cprofile(self):
+        # 関数単位の詳細（cProfile）。停止時にpstats形式で保存する
+        if not PROFILER.profiling:
+            PROFILER.start_profile()
+            self.status_label.config(text="詳細プロファイルを記録中...")
+            return
+        filename = filedialog.asksaveasfilename(
+            defaultextension=".prof",
+            filetypes=[("pstats", "*.prof"), ("すべてのファイル", "*.*")],
+            initialfile=f"profile_{datetime.now().strftime('%Y%m%d_%H%M%S')}.prof")
+        if filename:
+            PROFILER.stop_profile(filename)
+            self.status_label.config(text=f"詳細プロファイルを保存しました: {os.path.basename(filename)}")
+        else:
+            PROFILER.stop_profile(os.devnull)
+            self.status_label.config(text="詳細プロファイルを破棄しました")
+    
+    @timed()
     def load_projects(self):
-        if os.path.exists("novels_data.json"):
-            try:
-                with open("novels_data.json", 'r', encoding='utf-8') as f:
-                    data = json.load(f)
-                    self.projects = data.get("projects", [])
-                    self.current_project_idx = data.get("current_project_idx")
-                    
-                    if self.projects and self.current_project_idx is not None:
-                        if self.current_project_idx < len(self.projects):
-                            self.current_project = self.projects[self.current_project_idx]
-                    
-                    self.refresh_project_list()
-                    self.refresh_ui()
-            except Exception as e:
-                print(f"読込エラー: {e}")
+        try:
+            # 分割保存が無ければ旧形式のnovels_data.jsonから取り込む
+            self.projects, self.current_project_idx = self.store.load()
+            
+            if self.projects and self.current_project_idx is not None:
+                if self.current_project_idx < len(self.projects):
+                    self.current_project = self.projects[self.current_project_idx]
+            
+            self.refresh_project_list()
+            self.refresh_ui()
+        except Exception as e:
+            # 壊れたデータを自動保存で上書きしないよう、保存を止めて知らせる
+            self.store.read_only = True
+            messagebox.showerror("読込エラー",
+                                 f"データの読み込みに失敗しました:\n{e}\n\n"
+                                 f"データ保護のため自動保存を停止しています。")
+            self.status_label.config(text="読込エラー - 自動保存停止中")
     
     def open_project_dialog(self):
         filename = filedialog.askopenfilename(
-            filetypes=[("Novel Data", "*.json"), ("All Files", "*.*")]
+            filetypes=[("Novel Data", "*.json"), ("SQLite", "*.db"), ("All Files", "*.*")]
         )
-        if filename:
+        if not filename:
+            return
+        self.save_current_episode()
+        if filename.lower().endswith(".db"):
+            if os.path.abspath(filename) == os.path.abspath(getattr(self.store, "path", "")):
+                messagebox.showerror("エラー", "ファイルの読み込みに失敗しました:\n使用中のデータベースです")
+                return
+            self.open_database(filename)
+            return
+        try:
+            self.projects, self.current_project_idx = self.store.import_legacy(filename)
+        except Exception as e:
+            messagebox.showerror("エラー", f"ファイルの読み込みに失敗しました:\n{e}")
+            return
+        self.opened_library(filename)
+    
+    def open_database(self, filename):
+        # 別のデータベースの内容を本文・履歴ごと今の保存先へ写す
+        # 写すのは作業スレッドで、保存（自動保存の書き込み）と同じ順番待ちに入れる
+        self.save_all()
+        self.autosave.stop()
+        self.store.on_dirty = None  # 作業スレッドでの変更から自動保存を予約しない
+        
+        dialog = tk.Toplevel(self.root)
+        dialog.title("データベースを開く")
+        ttk.Label(dialog, text=f"{os.path.basename(filename)} を読み込んでいます…").pack(padx=20, pady=20)
+        dialog.protocol("WM_DELETE_WINDOW", lambda: None)
+        dialog.transient(self.root)
+        dialog.grab_set()
+        
+        def copy(task):
+            source = SQLiteStore(filename)
             try:
-                with open(filename, 'r', encoding='utf-8') as f:
-                    data = json.load(f)
-                    self.projects = data.get("projects", [])
-                    self.current_project_idx = data.get("current_project_idx")
-                    
-                    if self.projects and self.current_project_idx is not None:
-                        if self.current_project_idx < len(self.projects):
-                            self.current_project = self.projects[self.current_project_idx]
-                    
-                    self.refresh_project_list()
-                    self.refresh_ui()
-                    self.status_label.config(text=f"読込完了: {os.path.basename(filename)}")
-            except Exception as e:
-                messagebox.showerror("エラー", f"ファイルの読み込みに失敗しました:\n{e}")
-    
-    def start_auto_save(self):
+                return copy_library(source, self.store, task)
+            finally:
+                source.close()
+        
+        def resume():
+            dialog.destroy()
+            self.store.on_dirty = self.autosave.changed
+            self.autosave.start()
+        
+        def done(result):
+            resume()
+            self.projects, self.current_project_idx = result
+            self.opened_library(filename)
+        
+        def failed(e):
+            resume()
+            messagebox.showerror("エラー", f"ファイルの読み込みに失敗しました:\n{e}")
+        
+        self.tasks.submit(copy, name="データベースを開く", group="open", lane="io", on_done=done, on_error=failed)
+    
+    def opened_library(self, filename):
+        self.search = self.store.search_engine()
+        
+        if self.projects and self.current_project_idx is not None:
+            if self.current_project_idx < len(self.projects):
+                self.current_project = self.projects[self.current_project_idx]
+        
+        self.refresh_project_list()
+        self.refresh_ui()
+        self.status_label.config(text=f"読込完了: {os.path.basename(filename)}")
+    
+    def migrate_to_sqlite(self):
+        if isinstance(self.store, SQLiteStore):
+            messagebox.showinfo("SQLiteへ移行", f"既にSQLiteデータベース（{self.store.path}）を使っています")
+            return
+        if os.path.exists(DATABASE_FILE):
+            messagebox.showerror("SQLiteへ移行", f"{DATABASE_FILE} が既にあります")
+            return
+        if not messagebox.askyesno("SQLiteへ移行",
+                                   f"データを{DATABASE_FILE}へ移し、以後はSQLiteで保存します。\n"
+                                   f"（元の{self.store.root_dir}フォルダはそのまま残ります）\n続けますか？"):
+            return
+        
+        self.save_all(wait=True)
+        self.store.close()
+        self.store.read_only = True  # 移行中は元のデータへ書き込まない
+        
+        # 移行が終わるまで編集できないようにする
+        dialog = tk.Toplevel(self.root)
+        dialog.title("SQLiteへ移行")
+        ttk.Label(dialog, text="データを移行しています…").pack(padx=20, pady=20)
+        dialog.protocol("WM_DELETE_WINDOW", lambda: None)
+        dialog.transient(self.root)
+        dialog.grab_set()
+        
+        def done(store):
+            dialog.destroy()
+            self.use_store(store)
+            self.status_label.config(text=f"SQLiteへ移行しました: {store.path}")
+        
+        def failed(e):
+            dialog.destroy()
+            self.store.read_only = False
+            messagebox.showerror("SQLiteへ移行", f"移行に失敗しました:\n{e}")
+        
+        self.tasks.submit(lambda task: migrate(self.store.root_dir, DATABASE_FILE, task), name="SQLiteへ移行",
+                          group="migrate", lane="io", on_done=done, on_error=failed)
+    
+    def use_store(self, store):
+        # 保存先を切り替えて読み込み直す
+        self.store = store
+        self.store.on_dirty = self.autosave.changed
+        self.search = self.store.search_engine()
+        self.load_projects()
+    
+    def import_manuscript_dialog(self):
+        dialog = tk.Toplevel(self.root)
+        dialog.title("原稿の取り込み")
+        dialog.geometry("520x300")
+        
+        source = {"path": None, "is_dir": False}
+        source_label = ttk.Label(dialog, text="取り込む原稿: (未選択)")
+        source_label.pack(anchor=tk.W, padx=10, pady=(10, 0))
+        
+        def choose(is_dir):
+            if is_dir:
+                path = filedialog.askdirectory(parent=dialog)
+            else:
+                path = filedialog.askopenfilename(
+                    parent=dialog, filetypes=[("Text", "*.txt *.md"), ("All Files", "*.*")])
+            if path:
+                source["path"], source["is_dir"] = path, is_dir
+                source_label.config(text=f"取り込む原稿: {path}")
+        
+        pick_frame = ttk.Frame(dialog)
+        pick_frame.pack(fill=tk.X, padx=10, pady=5)
+        ttk.Button(pick_frame, text="ファイルを選択", command=lambda: choose(False)).pack(side=tk.LEFT, padx=2)
+        ttk.Button(pick_frame, text="フォルダを選択（フォルダ＝章、ファイル＝話）",
+                   command=lambda: choose(True)).pack(side=tk.LEFT, padx=2)
+        
+        styles = [None] + list(importer.PRESETS) + ["custom"]
+        ttk.Label(dialog, text="見出しの形式:").pack(anchor=tk.W, padx=10)
+        style_combo = ttk.Combobox(dialog, state="readonly", values=["自動判定"] + [
+            importer.PRESETS[name]["label"] for name in importer.PRESETS] + ["正規表現で指定"])
+        style_combo.current(0)
+        style_combo.pack(fill=tk.X, padx=10, pady=5)
+        
+        pattern_frame = ttk.Frame(dialog)
+        pattern_frame.pack(fill=tk.X, padx=10, pady=5)
+        ttk.Label(pattern_frame, text="章の見出し:").grid(row=0, column=0, sticky=tk.W)
+        chapter_entry = ttk.Entry(pattern_frame, width=40)
+        chapter_entry.insert(0, importer.PRESETS["japanese"]["chapter"])
+        chapter_entry.grid(row=0, column=1, sticky=tk.W, pady=2)
+        ttk.Label(pattern_frame, text="話の見出し:").grid(row=1, column=0, sticky=tk.W)
+        episode_entry = ttk.Entry(pattern_frame, width=40)
+        episode_entry.insert(0, importer.PRESETS["japanese"]["episode"])
+        episode_entry.grid(row=1, column=1, sticky=tk.W, pady=2)
+        
+        def start():
+            path = source["path"]
+            if not path:
+                messagebox.showwarning("警告", "原稿を選択してください", parent=dialog)
+                return
+            style = styles[style_combo.current()]
+            chapter_pattern = episode_pattern = None
+            if style == "custom":
+                style = {}
+                chapter_pattern, episode_pattern = chapter_entry.get(), episode_entry.get()
+                try:
+                    for pattern in (chapter_pattern, episode_pattern):
+                        if "(?P<title>" not in pattern:
+                            raise ValueError("見出しの部分を (?P<title>...) で囲んでください")
+                        re.compile(pattern)
+                except (re.error, ValueError) as e:
+                    messagebox.showerror("エラー", f"見出しの正規表現が正しくありません:\n{e}", parent=dialog)
+                    return
+            dialog.destroy()
+            
+            def read(task):
+                if source["is_dir"]:
+                    return importer.import_directory(path, task)
+                return importer.import_file(path, style, chapter_pattern, episode_pattern, task)
+            
+            self.tasks.submit(read, name="原稿の取り込み", group="import", lane="io",
+                              on_done=self.add_imported_project,
+                              on_error=lambda e: messagebox.showerror("エラー", f"取り込みに失敗しました:\n{e}"))
+        
+        btn_frame = ttk.Frame(dialog)
+        btn_frame.pack(pady=10)
+        ttk.Button(btn_frame, text="取り込む", command=start).pack(side=tk.LEFT, padx=5)
+        ttk.Button(btn_frame, text="キャンセル", command=dialog.destroy).pack(side=tk.LEFT, padx=5)
+    
+    def add_imported_project(self, project):
+        self.save_current_episode()
+        self.projects.append(project)
+        self.current_project = project
+        self.current_project_idx = len(self.projects) - 1
+        self.store.mark_all([project])  # 全体を1回の書き込み（ジャーナルの1バッチ）で保存する
+        self.refresh_ui()
         self.save_all()
-        self.auto_save_timer = self.root.after(60000, self.start_auto_save)  # 1分ごと
+        episodes = sum(len(ch.episodes) for ch in project.chapters)
+        self.status_label.config(text=f"取り込み完了: {project.name} ({len(project.chapters)}章 {episodes}話)")
+    
+    def on_close(self):
+        self.autosave.stop()
+        self.tasks.cancel("check")
+        self.tasks.shutdown()  # 実行中の保存・書き出しを待つ
+        self.save_all(wait=True)
+        self.store.close()  # ジャーナルを各ファイルへ反映してから終了
+        self.root.destroy()
     
     def update_time(self):
         now = datetime.now().strftime("%Y/%m/%d %H:%M:%S")
         self.time_label.config(text=now)
+        self.update_save_stats()
+        if self.overlay_var.get():
+            self.update_debug_overlay()
         self.root.after(1000, self.update_time)
     
+    @timed()
     def refresh_ui(self):
-        # 章リスト更新
-        self.refresh_chapters()
-        
-        # 話リスト更新
-        if self.current_project["current_chapter"] is not None:
-            self.refresh_episodes()
+        # プロジェクトが切り替わっていれば索引を作り直す
+        if self.index.project is not self.current_project:
+            self.index = ProjectIndex(self.current_project)
+            self.stats = ProjectStats(self.current_project)
+        
+        # 章・話ツリー更新（作り直すのはプロジェクトが変わったときだけ）
+        if self.outline.index is not self.index:
+            self.outline.reset(self.current_project, self.index)
+            ch_idx = self.current_project.current_chapter
+            ep_idx = self.current_project.current_episode
+            episode = None
+            if ch_idx is not None and ch_idx < len(self.current_project.chapters):
+                chapter = self.current_project.chapters[ch_idx]
+                if ep_idx is not None and ep_idx < len(chapter.episodes):
+                    episode = chapter.episodes[ep_idx]
+                    self.outline.select(episode)
+                else:
+                    self.outline.select(chapter)
+            # エディタには切り替え先のプロジェクトで開いていた話を出す
+            if episode is not None:
+                self.show_episode(episode)
+            else:
+                self.title_entry.delete(0, tk.END)
+                self.set_editor_text("")
         
         # キャラクターリスト更新
         self.refresh_characters()
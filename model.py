@@ -0,0 +1,190 @@
+import hashlib
+import sys
+
+# プロジェクト・章・話・バージョン履歴のメタ情報
+#
+# 以前は入れ子のdict/listで持っていたもの。__slots__で持つので、話ごとのdictと
+# キー文字列の分のメモリが要らず、属性の参照（episode.title）はdictの添字より速い。
+# 保存形式（JSON）は変わらない。from_dict() / to_dict() で相互に変換し、
+# このクラスが知らない項目は extra に取っておいて書き出すときに戻す。
+#
+# 章・話のタイトルは sys.intern() する（「第1話」「プロローグ」などが章ごとに並ぶため）。
+# 話の本文とメモは、読み込むまで None（storage.Store.content() で読む）。
+
+BODY_KEYS = ("content", "memo")  # 話のうち必要になるまで読み込まない項目
+
+
+def body_hash(content, memo):
+    # 本文とメモをまとめたハッシュ（本文を読まずに、検索索引が古くないかを確かめるのに使う）
+    return hashlib.sha1(f"{content}\0{memo}".encode("utf-8")).hexdigest()
+
+
+def _extra(data, known):
+    extra = {k: v for k, v in data.items() if k not in known}
+    return extra or None
+
+
+class Episode:
+    __slots__ = ("id", "title", "word_count", "content", "memo", "hash", "extra")
+    KEYS = ("id", "title", "word_count", "content", "memo", "hash")
+
+    def __init__(self, id=None, title="", content=None, memo=None, word_count=None, extra=None, hash=None):
+        self.id = id
+        self.title = sys.intern(title)
+        self.content = content
+        self.memo = memo
+        if word_count is None:
+            word_count = len(content) if content is not None else 0
+        self.word_count = word_count
+        self.hash = hash  # 最後に章ファイルへ書いたときの本文・メモのハッシュ（古いデータではNone）
+        self.extra = extra
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(data.get("id"), data.get("title", ""), data.get("content"), data.get("memo"),
+                   data.get("word_count"), _extra(data, cls.KEYS), data.get("hash"))
+
+    def body_hash(self):
+        # 読み込み済みなら今の本文・メモから求め直す
+        if self.content is not None:
+            self.hash = body_hash(self.content, self.memo or "")
+        return self.hash
+
+    def meta(self):
+        # 章ファイルに書く部分（本文・メモ以外）
+        data = {"id": self.id, "title": self.title, "word_count": self.word_count}
+        if self.body_hash() is not None:
+            data["hash"] = self.hash
+        if self.extra:
+            data.update(self.extra)
+        return data
+
+    def body(self):
+        return {"content": self.content or "", "memo": self.memo or ""}
+
+    def set_body(self, body):
+        self.content = body.get("content", "")
+        self.memo = body.get("memo", "")
+
+    def unload(self):
+        self.content = None
+        self.memo = None
+
+    def to_dict(self):
+        data = self.meta()
+        if self.content is not None:
+            data.update(self.body())
+        return data
+
+
+class Chapter:
+    __slots__ = ("id", "title", "episodes", "extra")
+    KEYS = ("id", "title", "episodes")
+
+    def __init__(self, id=None, title="", episodes=None, extra=None):
+        self.id = id
+        self.title = sys.intern(title)
+        self.episodes = episodes if episodes is not None else []
+        self.extra = extra
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(data.get("id"), data.get("title", ""),
+                   [ep if isinstance(ep, Episode) else Episode.from_dict(ep) for ep in data.get("episodes", [])],
+                   _extra(data, cls.KEYS))
+
+    def meta(self):
+        # 章ファイルに書く部分（話はメタ情報だけ）
+        data = {"id": self.id, "title": self.title}
+        if self.extra:
+            data.update(self.extra)
+        data["episodes"] = [ep.meta() for ep in self.episodes]
+        return data
+
+    def to_dict(self):
+        data = self.meta()
+        data["episodes"] = [ep.to_dict() for ep in self.episodes]
+        return data
+
+
+class Project:
+    __slots__ = ("id", "name", "chapters", "characters", "settings", "current_chapter", "current_episode",
+                 "writing_goal", "history_keys", "extra")
+    KEYS = ("id", "name", "chapters", "characters", "settings", "current_chapter", "current_episode",
+            "writing_goal", "history_keys")
+
+    def __init__(self, id=None, name="", chapters=None, characters=None, settings=None, current_chapter=None,
+                 current_episode=None, writing_goal=2000, history_keys=None, extra=None):
+        self.id = id
+        self.name = name
+        self.chapters = chapters if chapters is not None else []
+        self.characters = characters if characters is not None else []  # キャラクター（dictのリスト）
+        self.settings = settings if settings is not None else []      # 世界設定（dictのリスト）
+        self.current_chapter = current_chapter
+        self.current_episode = current_episode
+        self.writing_goal = writing_goal
+        self.history_keys = history_keys  # "id"ならバージョン履歴のキーは話ID
+        self.extra = extra
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(data.get("id"), data.get("name", ""),
+                   [ch if isinstance(ch, Chapter) else Chapter.from_dict(ch) for ch in data.get("chapters", [])],
+                   data.get("characters", []), data.get("settings", []), data.get("current_chapter"),
+                   data.get("current_episode"), data.get("writing_goal", 2000), data.get("history_keys"),
+                   _extra(data, cls.KEYS))
+
+    def meta(self):
+        # プロジェクトファイルに書く部分（章はIDの並び）
+        data = {"id": self.id, "name": self.name, "characters": self.characters, "settings": self.settings,
+                "current_chapter": self.current_chapter, "current_episode": self.current_episode,
+                "writing_goal": self.writing_goal}
+        if self.history_keys is not None:
+            data["history_keys"] = self.history_keys
+        if self.extra:
+            data.update(self.extra)
+        data["chapters"] = [ch.id for ch in self.chapters]
+        return data
+
+    def to_dict(self):
+        data = self.meta()
+        data["chapters"] = [ch.to_dict() for ch in self.chapters]
+        return data
+
+
+class Version:
+    # バージョン履歴の1件のメタ情報（versions.VersionStoreの.idxの1行）
+    __slots__ = ("type", "name", "timestamp", "size", "hash", "kind", "z", "offset", "length", "seq", "extra")
+    KEYS = ("type", "name", "timestamp", "size", "hash", "kind", "z", "offset", "length", "seq")
+    OPTIONAL = ("z", "offset", "length", "seq")  # 無ければ書かない項目
+
+    def __init__(self, type="draft", name="", timestamp="", size=0, hash="", kind="key", z=None,
+                 offset=None, length=None, seq=None, extra=None):
+        self.type = sys.intern(type)
+        self.name = name
+        self.timestamp = timestamp
+        self.size = size
+        self.hash = hash
+        self.kind = sys.intern(kind)
+        self.z = z
+        self.offset = offset
+        self.length = length
+        self.seq = seq
+        self.extra = extra
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(data.get("type", "draft"), data.get("name", ""), data.get("timestamp", ""), data.get("size", 0),
+                   data.get("hash", ""), data.get("kind", "key"), data.get("z"), data.get("offset"),
+                   data.get("length"), data.get("seq"), _extra(data, cls.KEYS))
+
+    def to_dict(self):
+        data = {"type": self.type, "name": self.name, "timestamp": self.timestamp, "size": self.size,
+                "hash": self.hash, "kind": self.kind}
+        for k in self.OPTIONAL:
+            value = getattr(self, k)
+            if value is not None:
+                data[k] = value
+        if self.extra:
+            data.update(self.extra)
+        return data
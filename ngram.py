@@ -0,0 +1,77 @@
+import re
+from collections import Counter
+
+from textcount import line_col, line_starts
+
+MIN_N = 2
+MAX_N = 10
+
+# 句読点・括弧・記号・空白・改行をまたぐ語句は数えない（長音符「ー」は語の一部なので含めない）
+SEPARATORS = re.compile(
+    r"[\s　、。，．,.!?！？「」『』（）()［］\[\]【】〈〉《》〔〕…‥―—・：:；;\"'“”‘’〜~／/]+"
+)
+
+
+def segments(text):
+    return [seg for seg in SEPARATORS.split(text) if seg]
+
+
+def count_ngrams(text, n, counter=None):
+    if counter is None:
+        counter = Counter()
+    for seg in segments(text):
+        length = len(seg)
+        if length < n:
+            continue
+        if length == n:
+            counter[seg] += 1
+        else:
+            counter.update(seg[i:i + n] for i in range(length - n + 1))
+    return counter
+
+
+def find_positions(text, gram, limit=None):
+    # 区切り文字を含まない語句なので、単純な検索でも区切りをまたいだ一致は出ない
+    positions = []
+    find = text.find
+    pos = find(gram)
+    while pos != -1:
+        positions.append(pos)
+        if limit is not None and len(positions) >= limit:
+            break
+        pos = find(gram, pos + 1)
+    return positions
+
+
+def find_repetitions(docs, n=3, min_count=4, top=15, max_positions=20):
+    # docs: (ラベル, 本文を返す関数) のリスト。話・章・プロジェクト全体のどれでも同じように流す
+    # 1回目で全体の出現回数を数え、2回目で上位の語句の位置（ラベル・行・桁）を集める
+    if not MIN_N <= n <= MAX_N:
+        raise ValueError(f"nは{MIN_N}〜{MAX_N}で指定してください")
+
+    counter = Counter()
+    for label, load in docs:
+        count_ngrams(load(), n, counter)
+
+    repeated = [(gram, count) for gram, count in counter.items() if count >= min_count]
+    repeated.sort(key=lambda x: x[1], reverse=True)
+    repeated = repeated[:top]
+
+    hits = [{"gram": gram, "count": count, "positions": []} for gram, count in repeated]
+    if not hits:
+        return hits
+
+    for label, load in docs:
+        text = load()
+        starts = None
+        for hit in hits:
+            remaining = max_positions - len(hit["positions"])
+            if remaining <= 0:
+                continue
+            found = find_positions(text, hit["gram"], remaining)
+            if found and starts is None:
+                starts = line_starts(text)
+            for pos in found:
+                line, col = line_col(starts, pos)
+                hit["positions"].append((label, pos, line, col))
+    return hits
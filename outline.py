@@ -0,0 +1,158 @@
+import tkinter as tk
+from tkinter import ttk
+
+PLACEHOLDER = ":placeholder"
+
+
+class OutlineView:
+    # 章を親、話を子とするツリー。行のIDは章・話のIDそのもの（並べ替えても選択がずれない）
+    #
+    # 話の行は章を開いたときに初めて作る。表示中の文字列を覚えておき、
+    # 変わった行だけを書き換える。
+
+    def __init__(self, parent, chapter_row, episode_row, on_select=None):
+        self.chapter_row = chapter_row
+        self.episode_row = episode_row
+        self.on_select = on_select
+        self.project = None
+        self.index = None
+
+        frame = ttk.Frame(parent)
+        self.frame = frame
+        self.tree = ttk.Treeview(frame, show="tree", selectmode="browse")
+        scrollbar = ttk.Scrollbar(frame, orient=tk.VERTICAL, command=self.tree.yview)
+        self.tree.configure(yscrollcommand=scrollbar.set)
+        self.tree.pack(side=tk.LEFT, fill=tk.BOTH, expand=True)
+        scrollbar.pack(side=tk.RIGHT, fill=tk.Y)
+        self.tree.bind("<<TreeviewOpen>>", self._on_open)
+        self.tree.bind("<<TreeviewSelect>>", self._on_select)
+
+        self._kind = {}      # 行ID -> "chapter" / "episode"
+        self._text = {}      # 行ID -> 表示中の文字列
+        self._loaded = set()  # 話の行を作った章
+        self._quiet = None   # プログラムから選択した行（その選択イベントは通知しない）
+
+    def pack(self, **kwargs):
+        self.frame.pack(**kwargs)
+
+    # 全体の作り直し（プロジェクト切り替え時のみ）。章の数に比例する
+    def reset(self, project, index):
+        self.project = project
+        self.index = index
+        self.tree.delete(*self.tree.get_children())
+        self._kind.clear()
+        self._text.clear()
+        self._loaded.clear()
+        for chapter in project.chapters:
+            self._insert_chapter(chapter, "end")
+
+    def _insert_chapter(self, chapter, pos):
+        cid = chapter.id
+        text = self.chapter_row(chapter)
+        self.tree.insert("", pos, iid=cid, text=text)
+        self._kind[cid] = "chapter"
+        self._text[cid] = text
+        if chapter.episodes:
+            self.tree.insert(cid, "end", iid=cid + PLACEHOLDER, text="…")
+
+    def _load(self, chapter):
+        cid = chapter.id
+        if cid in self._loaded:
+            return
+        self._loaded.add(cid)
+        if self.tree.exists(cid + PLACEHOLDER):
+            self.tree.delete(cid + PLACEHOLDER)
+        for episode in chapter.episodes:
+            self._insert_episode(cid, episode, "end")
+
+    def _insert_episode(self, cid, episode, pos):
+        eid = episode.id
+        text = self.episode_row(episode)
+        self.tree.insert(cid, pos, iid=eid, text=text)
+        self._kind[eid] = "episode"
+        self._text[eid] = text
+
+    def _on_open(self, event):
+        cid = self.tree.focus()
+        if self._kind.get(cid) == "chapter":
+            chapter = self.index.chapter(cid)
+            if chapter is not None:
+                self._load(chapter)
+
+    def _on_select(self, event):
+        selection = self.tree.selection()
+        if self._quiet is not None and selection == (self._quiet,):
+            self._quiet = None
+            return
+        self._quiet = None
+        if selection and self.on_select:
+            iid = selection[0]
+            self.on_select(self._kind.get(iid), iid)
+
+    # 差分の反映
+    def update(self, obj):
+        # 章・話の表示文字列が変わっていれば、その行だけ書き換える
+        iid = obj.id
+        kind = self._kind.get(iid)
+        if kind is None:
+            return
+        text = self.chapter_row(obj) if kind == "chapter" else self.episode_row(obj)
+        if self._text[iid] != text:
+            self._text[iid] = text
+            self.tree.item(iid, text=text)
+
+    def add_chapter(self, chapter, pos="end"):
+        self._insert_chapter(chapter, pos)
+
+    def remove(self, obj):
+        iid = obj.id
+        if not self.tree.exists(iid):
+            return
+        for child in self.tree.get_children(iid):
+            self._kind.pop(child, None)
+            self._text.pop(child, None)
+        self.tree.delete(iid)
+        self._kind.pop(iid, None)
+        self._text.pop(iid, None)
+        self._loaded.discard(iid)
+
+    def add_episode(self, chapter, episode, pos="end"):
+        cid = chapter.id
+        if cid in self._loaded:
+            self._insert_episode(cid, episode, pos)
+        elif not self.tree.exists(cid + PLACEHOLDER):
+            self.tree.insert(cid, "end", iid=cid + PLACEHOLDER, text="…")
+        self.update(chapter)
+
+    def move(self, obj, parent, pos):
+        # 同じ親の中での並べ替え（parent=Noneなら章）
+        iid = obj.id
+        if self.tree.exists(iid):
+            self.tree.move(iid, parent.id if parent else "", pos)
+
+    # 選択
+    def select(self, obj):
+        iid = obj.id
+        kind = self._kind.get(iid)
+        if kind is None:
+            # 未展開の章の話: 親の章の行を作ってから選ぶ
+            chapter = self.index.chapter_of(iid)
+            if chapter is not None:
+                self._load(chapter)
+            if not self.tree.exists(iid):
+                return
+        parent = self.tree.parent(iid)
+        if parent:
+            self.tree.item(parent, open=True)
+        if self.tree.selection() != (iid,):
+            self._quiet = iid
+            self.tree.selection_set(iid)
+        self.tree.focus(iid)
+        self.tree.see(iid)
+
+    def selected(self):
+        # (種類, ID) か (None, None)
+        selection = self.tree.selection()
+        if not selection:
+            return None, None
+        return self._kind.get(selection[0]), selection[0]
@@ -0,0 +1,172 @@
+import cProfile
+import functools
+import json
+import os
+import threading
+import time
+from collections import deque
+
+WINDOW = 256          # 分位点は操作ごとに直近この回数の所要時間から出す
+MAX_EVENTS = 200000   # トレースに残すイベントの上限（古いものから捨てる）
+
+
+class Histogram:
+    # 直近WINDOW回の所要時間（秒）。回数・合計・最大は起動からの通算
+
+    def __init__(self, window=WINDOW):
+        self.samples = deque(maxlen=window)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def add(self, seconds):
+        self.samples.append(seconds)
+        self.count += 1
+        self.total += seconds
+        if seconds > self.max:
+            self.max = seconds
+
+    def percentile(self, q):
+        if not self.samples:
+            return 0.0
+        ordered = sorted(self.samples)
+        return ordered[min(len(ordered) - 1, int(len(ordered) * q))]
+
+    def summary(self):
+        return {"count": self.count, "total": self.total, "p50": self.percentile(0.5),
+                "p95": self.percentile(0.95), "max": self.max}
+
+
+class Profiler:
+    # 操作ごとの所要時間・読み書きのバイト数・トレースを集める
+    #
+    # 無効のあいだ、@timed を付けた関数は enabled を見てそのまま呼ぶだけで、
+    # 時刻の取得や記録は一切しない。count() も同様にすぐ戻る。
+
+    def __init__(self, enabled=False):
+        self.enabled = enabled
+        self.histograms = {}  # 操作名 -> Histogram
+        self.counters = {}    # 名前 -> 合計（"read_bytes" / "write_bytes" など）
+        self.events = deque(maxlen=MAX_EVENTS)  # (操作名, 開始, 終了, スレッドID)
+        self._origin = time.perf_counter()
+        self._lock = threading.Lock()
+        self._profile = None
+
+    def record(self, name, start, end):
+        with self._lock:
+            histogram = self.histograms.get(name)
+            if histogram is None:
+                histogram = self.histograms[name] = Histogram()
+            histogram.add(end - start)
+            self.events.append((name, start, end, threading.get_ident()))
+
+    def count(self, name, amount):
+        if not self.enabled:
+            return
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + amount
+
+    def timed(self, name=None):
+        # 関数の所要時間を name（省略時は関数名）で記録するデコレーター
+        def decorate(fn):
+            label = name or fn.__qualname__
+
+            @functools.wraps(fn)
+            def wrapper(*args, **kwargs):
+                if not self.enabled:
+                    return fn(*args, **kwargs)
+                start = time.perf_counter()
+                try:
+                    return fn(*args, **kwargs)
+                finally:
+                    self.record(label, start, time.perf_counter())
+            return wrapper
+        return decorate
+
+    def span(self, name):
+        # with profiler.span("名前"): の形で区間を計る
+        return _Span(self, name)
+
+    def reset(self):
+        with self._lock:
+            self.histograms.clear()
+            self.counters.clear()
+            self.events.clear()
+
+    def summary(self):
+        # 操作名 -> {count, total, p50, p95, max}（p95の大きい順）
+        with self._lock:
+            items = [(name, h.summary()) for name, h in self.histograms.items()]
+        items.sort(key=lambda item: item[1]["p95"], reverse=True)
+        return dict(items)
+
+    def report(self):
+        lines = [f"{'操作':<36}{'回数':>8}{'p50':>10}{'p95':>10}{'最大':>10}{'合計':>10}"]
+        for name, s in self.summary().items():
+            lines.append(f"{name:<36}{s['count']:>8}{s['p50'] * 1000:>8.1f}ms{s['p95'] * 1000:>8.1f}ms"
+                         f"{s['max'] * 1000:>8.1f}ms{s['total']:>9.2f}s")
+        with self._lock:
+            counters = dict(self.counters)
+        if counters:
+            lines.append("")
+            lines.extend(f"{name}: {value:,}" for name, value in sorted(counters.items()))
+        return "\n".join(lines)
+
+    # トレースの書き出し
+    def export_trace(self, path):
+        # Chromeのトレース形式（chrome://tracing・Perfetto・speedscopeで開ける）
+        with self._lock:
+            events = list(self.events)
+            counters = dict(self.counters)
+        pid = os.getpid()
+        trace = [{"name": name, "ph": "X", "pid": pid, "tid": tid,
+                  "ts": (start - self._origin) * 1e6, "dur": (end - start) * 1e6}
+                 for name, start, end, tid in events]
+        if events:
+            ts = (events[-1][2] - self._origin) * 1e6
+            trace.extend({"name": name, "ph": "C", "pid": pid, "tid": 0, "ts": ts, "args": {name: value}}
+                         for name, value in counters.items())
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump({"traceEvents": trace, "displayTimeUnit": "ms"}, f, ensure_ascii=False)
+        return len(trace)
+
+    def start_profile(self):
+        # cProfileで関数単位の詳細を取る（UIスレッドのみ）
+        self._profile = cProfile.Profile()
+        self._profile.enable()
+
+    def stop_profile(self, path):
+        # pstats形式で保存する（python -m pstats・snakeviz などで読める）
+        profile, self._profile = self._profile, None
+        if profile is None:
+            return False
+        profile.disable()
+        profile.dump_stats(path)
+        return True
+
+    @property
+    def profiling(self):
+        return self._profile is not None
+
+
+class _Span:
+    def __init__(self, profiler, name):
+        self.profiler = profiler
+        self.name = name
+        self.start = None
+
+    def __enter__(self):
+        if self.profiler.enabled:
+            self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        if self.start is not None:
+            self.profiler.record(self.name, self.start, time.perf_counter())
+        return False
+
+
+# アプリ全体で1つ。環境変数 NOVEL_PROFILE=1 で起動時から有効にする
+PROFILER = Profiler(enabled=os.environ.get("NOVEL_PROFILE") == "1")
+timed = PROFILER.timed
+count = PROFILER.count
@@ -0,0 +1,97 @@
+import re
+
+POSITIONAL_KEY = re.compile(r"^(\d+)_(\d+)$")
+
+
+class ProjectIndex:
+    # ID -> 章・話オブジェクトの索引。追加・削除・移動のたびに更新する
+
+    def __init__(self, project):
+        self.project = project
+        self.rebuild()
+
+    def rebuild(self):
+        self.chapters = {}
+        self.episodes = {}
+        self.episode_chapter = {}  # episode_id -> chapter_id
+        for ch in self.project.chapters:
+            self.chapters[ch.id] = ch
+            for ep in ch.episodes:
+                self.episodes[ep.id] = ep
+                self.episode_chapter[ep.id] = ch.id
+
+    def chapter(self, cid):
+        return self.chapters.get(cid)
+
+    def episode(self, eid):
+        return self.episodes.get(eid)
+
+    def chapter_of(self, eid):
+        return self.chapters.get(self.episode_chapter.get(eid))
+
+    # 章
+    def add_chapter(self, chapter, pos=None):
+        chapters = self.project.chapters
+        chapters.insert(len(chapters) if pos is None else pos, chapter)
+        self.chapters[chapter.id] = chapter
+        for ep in chapter.episodes:
+            self.episodes[ep.id] = ep
+            self.episode_chapter[ep.id] = chapter.id
+
+    def remove_chapter(self, cid):
+        chapter = self.chapters.pop(cid)
+        self.project.chapters.remove(chapter)
+        for ep in chapter.episodes:
+            del self.episodes[ep.id]
+            del self.episode_chapter[ep.id]
+        return chapter
+
+    def move_chapter(self, cid, pos):
+        chapters = self.project.chapters
+        chapter = self.chapters[cid]
+        chapters.remove(chapter)
+        chapters.insert(pos, chapter)
+
+    # 話
+    def add_episode(self, chapter, episode, pos=None):
+        episodes = chapter.episodes
+        episodes.insert(len(episodes) if pos is None else pos, episode)
+        self.episodes[episode.id] = episode
+        self.episode_chapter[episode.id] = chapter.id
+
+    def remove_episode(self, eid):
+        episode = self.episodes.pop(eid)
+        chapter = self.chapters[self.episode_chapter.pop(eid)]
+        chapter.episodes.remove(episode)
+        return episode
+
+    def move_episode(self, eid, chapter, pos):
+        # 別の章への移動にも使える。移動元の章を返す
+        episode = self.episodes[eid]
+        source = self.chapters[self.episode_chapter[eid]]
+        source.episodes.remove(episode)
+        chapter.episodes.insert(pos, episode)
+        self.episode_chapter[eid] = chapter.id
+        return source
+
+
+def migrate_positional_keys(project, keys):
+    # 旧形式の「章番号_話番号」の履歴キーを、その時点の並びで話IDに対応付ける
+    mapping = {}
+    live = set()
+    for ch in project.chapters:
+        for ep in ch.episodes:
+            live.add(ep.id)
+
+    for key in keys:
+        if key in live:
+            continue
+        match = POSITIONAL_KEY.match(key)
+        if not match:
+            continue
+        ch_idx, ep_idx = int(match.group(1)), int(match.group(2))
+        if ch_idx < len(project.chapters):
+            episodes = project.chapters[ch_idx].episodes
+            if ep_idx < len(episodes):
+                mapping[key] = episodes[ep_idx].id
+    return mapping
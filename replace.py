@@ -0,0 +1,52 @@
+import re
+
+from textcount import line_col, line_starts
+
+MAX_POSITIONS = 20
+
+
+def compile_pattern(find, regex=False):
+    if not find:
+        raise ValueError("検索する文字列を入力してください")
+    try:
+        return re.compile(find if regex else re.escape(find))
+    except re.error as e:
+        raise ValueError(f"正規表現が正しくありません: {e}")
+
+
+def plan_replace(docs, find, replacement, regex=False, max_positions=MAX_POSITIONS):
+    # docs: (キー, ラベル, 本文) のリスト
+    # 一致のある文書だけについて、件数・位置（行・桁）と置換後の本文を返す（この時点では何も書き換えない）
+    pattern = compile_pattern(find, regex)
+    if regex:
+        try:
+            pattern.sub(replacement, "")  # 置換文字列の書式（\1など）を先に確かめる
+        except (re.error, IndexError) as e:
+            raise ValueError(f"置換文字列が正しくありません: {e}")
+
+    changes = []
+    for key, label, text in docs:
+        if not regex and find not in text:
+            continue
+        if regex:
+            new_text, count = pattern.subn(replacement, text)
+        else:
+            count = text.count(find)
+            new_text = text.replace(find, replacement)
+        if not count or new_text == text:
+            continue
+
+        starts = line_starts(text)
+        positions = []
+        for match in pattern.finditer(text):
+            line, col = line_col(starts, match.start())
+            positions.append((match.start(), line, col))
+            if len(positions) >= max_positions:
+                break
+        changes.append({"key": key, "label": label, "count": count,
+                        "positions": positions, "old": text, "new": new_text})
+    return changes
+
+
+def summary(changes):
+    return sum(change["count"] for change in changes), len(changes)
@@ -0,0 +1,59 @@
+import charclass
+from lint import LintEngine
+from ngram import find_repetitions
+from stats import ProjectStats
+
+# 画面を使わない集計・チェック。結果はJSONにそのまま書ける辞書で返す
+# （画面の「文章チェック」「進捗」タブと同じ関数を使う）
+
+
+def project_documents(project, content):
+    # プロジェクト全体を (ラベル, 本文を返す関数) のリストにする
+    # content(project, episode) で本文を得る（本文を遅延読み込みする保存先でも使える）
+    return [(f"{ch.title} / {ep.title}", lambda ep=ep: content(project, ep))
+            for ch in project.chapters for ep in ch.episodes]
+
+
+def stats_report(project):
+    stats = ProjectStats(project)
+    goal = project.writing_goal or 0
+    return {
+        "chapters": len(project.chapters),
+        "episodes": stats.episode_count,
+        "characters": stats.total,
+        "goal": goal,
+        "progress": min(100.0, stats.total / goal * 100) if goal else None,
+        "by_chapter": [{"title": title, "characters": words, "episodes": count}
+                       for title, words, count in stats.chapter_rows()],
+    }
+
+
+def repetition_report(docs, n=3, max_positions=3):
+    hits = find_repetitions(docs, n=n, max_positions=max_positions)
+    return {
+        "n": n,
+        "hits": [{"gram": hit["gram"], "count": hit["count"],
+                  "positions": [{"label": label, "line": line, "column": col}
+                                for label, pos, line, col in hit["positions"]]}
+                 for hit in hits],
+    }
+
+
+def balance_report(docs, analyzer=None):
+    per_doc, hist = (analyzer or charclass.BalanceAnalyzer()).analyze_documents(docs)
+    return {
+        "counts": hist,
+        "letters": charclass.letter_total(hist),
+        "ratios": {name: round(charclass.ratio(hist, name), 2) for name, _ in charclass.CLASSES if name != "space"},
+        "recommended": charclass.evaluate(hist),
+    }
+
+
+def punctuation_report(docs, linter=None, max_issues=100):
+    issues, comma_count, period_count = (linter or LintEngine()).check_documents(docs, with_labels=True)
+    return {
+        "commas": comma_count,
+        "periods": period_count,
+        "issue_count": len(issues),
+        "issues": issues[:max_issues],
+    }
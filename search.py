@@ -0,0 +1,417 @@
+import json
+import os
+import threading
+from array import array
+
+from journal import Journal, write_atomic
+from profiler import count, timed
+
+FORMAT_VERSION = 1
+COMPACT_BYTES = 1 << 20  # 変更ログがこれ（と索引ファイルの大きさ）を超えたら1つのファイルにまとめ直す
+SNIPPET_RADIUS = 30
+FIELD_WEIGHTS = {"title": 5, "name": 5, "content": 1, "memo": 1, "background": 1, "detail": 1}
+
+
+def bigrams(text):
+    # 日本語は空白で区切られないので2文字ずつの組で索引を作る（改行をまたぐ組は除く）
+    grams = {text[i:i + 2] for i in range(len(text) - 1)}
+    if "\n" in text:
+        grams = {gram for gram in grams if "\n" not in gram}
+    return grams
+
+
+def _split_grams(packed):
+    return [packed[i:i + 2] for i in range(0, len(packed), 2)]
+
+
+def read_docs(path, journal):
+    # 索引ファイルの文書に変更ログを順に当てる（key -> [key, 長さ, 組, ハッシュ]）。壊れていればValueError
+    docs = {}
+    if os.path.exists(path):
+        with open(path, 'rb') as f:
+            data = f.read()
+        count("read_bytes", len(data))
+        record = json.loads(data.decode('utf-8'))
+        if record.get("format") != FORMAT_VERSION:
+            raise ValueError("unsupported search index format")
+        for entry in record["docs"]:
+            docs[tuple(entry[0])] = entry
+    apply_changes(docs, journal.replay())
+    return docs
+
+
+def apply_changes(docs, records):
+    # [key] は削除、[key, 長さ, 組, ハッシュ] は追加・更新
+    for entry in records:
+        key = tuple(entry[0])
+        if len(entry) == 1:
+            docs.pop(key, None)
+        else:
+            docs[key] = entry
+
+
+def make_hit(key, text, query):
+    # 候補の文書を本文で確かめ、一致すれば検索結果にする
+    if not text:
+        return None
+    count = text.count(query)
+    if not count:
+        return None
+    pos = text.find(query)
+    start = max(0, pos - SNIPPET_RADIUS)
+    snippet = text[start:pos + len(query) + SNIPPET_RADIUS].replace("\n", " ")
+    return {
+        "key": key,
+        "count": count,
+        "score": count * FIELD_WEIGHTS.get(key[-1], 1),
+        "pos": pos,
+        "snippet": ("…" if start else "") + snippet
+    }
+
+
+class SearchIndex:
+    # 2文字組 -> 文書番号の配列 の転置索引
+    # 文書ごとに含まれる組を覚えておき、更新時は増減した組の分だけ書き換える
+
+    def __init__(self):
+        self._ids = {}       # key -> 文書番号
+        self._keys = []      # 文書番号 -> key（削除済みはNone）
+        self._grams = []     # 文書番号 -> 組を連結した文字列
+        self._sizes = []     # 文書番号 -> 本文の長さ（読み込み時の整合性確認用）
+        self._hashes = []    # 文書番号 -> 索引したときの本文・メモのハッシュ（話の本文だけ。他はNone）
+        self._postings = {}  # 2文字組 -> array('I')
+        self._changed = set()  # 前回の保存から変わった（消えた）key
+        self.fresh = True      # 保存済みのファイルから読んだものでなければTrue
+
+    @property
+    def dirty(self):
+        return bool(self._changed)
+
+    def __contains__(self, key):
+        return key in self._ids
+
+    def keys(self):
+        return list(self._ids)
+
+    def size_of(self, key):
+        doc = self._ids.get(key)
+        return self._sizes[doc] if doc is not None else None
+
+    def hash_of(self, key):
+        doc = self._ids.get(key)
+        return self._hashes[doc] if doc is not None else None
+
+    def update(self, key, text, hash=None):
+        new = bigrams(text)
+        doc = self._ids.get(key)
+        if doc is None:
+            doc = len(self._keys)
+            self._ids[key] = doc
+            self._keys.append(key)
+            self._grams.append("")
+            self._sizes.append(0)
+            self._hashes.append(None)
+            old = set()
+        else:
+            old = set(_split_grams(self._grams[doc]))
+            if old == new and self._sizes[doc] == len(text) and self._hashes[doc] == hash:
+                return
+
+        for gram in old - new:
+            self._postings[gram].remove(doc)
+        for gram in new - old:
+            self._postings.setdefault(gram, array('I')).append(doc)
+        self._grams[doc] = "".join(sorted(new))
+        self._sizes[doc] = len(text)
+        self._hashes[doc] = hash
+        self._changed.add(key)
+
+    def remove(self, key):
+        doc = self._ids.pop(key, None)
+        if doc is None:
+            return
+        for gram in _split_grams(self._grams[doc]):
+            self._postings[gram].remove(doc)
+        self._keys[doc] = None
+        self._grams[doc] = ""
+        self._changed.add(key)
+
+    def candidates(self, query):
+        if len(query) >= 2:
+            lists = []
+            for gram in bigrams(query):
+                posting = self._postings.get(gram)
+                if not posting:
+                    return set()
+                lists.append(posting)
+            lists.sort(key=len)
+            result = set(lists[0])
+            for posting in lists[1:]:
+                result.intersection_update(posting)
+                if not result:
+                    break
+            return result
+        # 1文字の検索語はその文字を含む組をすべてまとめる
+        result = set()
+        for gram, posting in self._postings.items():
+            if query in gram:
+                result.update(posting)
+        return result
+
+    def search(self, query, loader, limit=100):
+        # loader(key) は文書の本文を返す（候補の確認と抜粋に使う）
+        query = query.strip()
+        if not query:
+            return []
+        hits = []
+        for doc in self.candidates(query):
+            key = self._keys[doc]
+            hit = make_hit(key, loader(key), query)
+            if hit is not None:
+                hits.append(hit)
+        hits.sort(key=lambda h: h["score"], reverse=True)
+        return hits[:limit]
+
+    # 保存・読み込み
+    def changes(self):
+        # 前回から変わった文書だけを変更ログの記録にする（索引全体は書き出さない）
+        records = []
+        for key in self._changed:
+            doc = self._ids.get(key)
+            if doc is None:
+                records.append([list(key)])
+            else:
+                records.append([list(key), self._sizes[doc], self._grams[doc], self._hashes[doc]])
+        self._changed = set()
+        return records
+
+    @classmethod
+    def from_docs(cls, docs):
+        index = cls()
+        index.fresh = False
+        postings = index._postings
+        for key, size, packed, *rest in docs:  # ハッシュの無い古い索引も読める
+            doc = len(index._keys)
+            key = tuple(key)
+            index._ids[key] = doc
+            index._keys.append(key)
+            index._grams.append(packed)
+            index._sizes.append(size)
+            index._hashes.append(rest[0] if rest else None)
+            for gram in _split_grams(packed):
+                posting = postings.get(gram)
+                if posting is None:
+                    postings[gram] = posting = array('I')
+                posting.append(doc)
+        return index
+
+
+class LibrarySearch:
+    # プロジェクトごとの検索索引を <project_id>/search_index.json に置く
+    # 保存ごとの変更（変わった文書の分だけ）は search_index.log に追記し、
+    # ログが大きくなったら作業スレッドでsearch_index.jsonへまとめ直す
+    #
+    # key: ("episode", 話ID, "content"|"memo"|"title") / ("chapter", 章ID, "title")
+    #      ("character", 番号, "name"|"background") / ("setting", 番号, "name"|"detail")
+
+    def __init__(self, store):
+        self.store = store
+        self.indexes = {}  # project_id -> SearchIndex
+        self.bytes_written = 0
+        self._opened = set()    # このセッションでまとめ直し済みのproject_id（write()だけが使う）
+        self._base_sizes = {}   # project_id -> search_index.jsonの大きさ
+        self._write_lock = threading.Lock()
+
+    def _path(self, pid):
+        return os.path.join(self.store.root_dir, pid, "search_index.json")
+
+    def _journal(self, pid):
+        return Journal(os.path.join(self.store.root_dir, pid, "search_index.log"))
+
+    def loaded(self, project):
+        # 読み込み済み（なければ保存済みファイルから読む）の索引。未作成ならNone
+        pid = project.id
+        if pid in self.indexes:
+            return self.indexes[pid]
+        path = self._path(pid)
+        journal = self._journal(pid)
+        if not os.path.exists(path) and not journal.size:
+            return None
+        try:
+            index = SearchIndex.from_docs(read_docs(path, journal).values())
+        except ValueError:
+            return None  # 壊れていれば作り直す
+        self.indexes[pid] = index
+        self._verify(project, index)
+        return index
+
+    def ensure(self, project):
+        index = self.loaded(project)
+        if index is None:
+            index = SearchIndex()
+            self.indexes[project.id] = index
+            self._verify(project, index)
+        return index
+
+    def _verify(self, project, index):
+        # 保存後に変わった話（本文・メモのハッシュの違い）や消えた話だけを索引し直す
+        # ハッシュを書く前の章ファイルから読んだ話は、文字数の違いで確かめる
+        live = set()
+        for ch in project.chapters:
+            live.add(("chapter", ch.id, "title"))
+            index.update(("chapter", ch.id, "title"), ch.title)
+            for ep in ch.episodes:
+                content_key = ("episode", ep.id, "content")
+                live.update((content_key, ("episode", ep.id, "memo"), ("episode", ep.id, "title")))
+                index.update(("episode", ep.id, "title"), ep.title)
+                expected = ep.body_hash()
+                if expected is not None:
+                    stale = index.hash_of(content_key) != expected
+                else:
+                    stale = index.size_of(content_key) != ep.word_count
+                if stale:
+                    self._index_body(project, index, ep)
+        for key in index.keys():
+            if key[0] in ("chapter", "episode") and key not in live:
+                index.remove(key)
+        self._index_profiles(project, index)
+
+    def _index_body(self, project, index, episode):
+        content = self.store.content(project, episode)
+        index.update(("episode", episode.id, "content"), content, episode.body_hash())
+        index.update(("episode", episode.id, "memo"), episode.memo)
+
+    def _index_profiles(self, project, index):
+        # キャラクター・世界設定は件数が少ないので、まとめて索引し直す
+        live = set()
+        for kind, items, fields in (("character", project.characters, ("name", "background")),
+                                    ("setting", project.settings, ("name", "detail"))):
+            for i, item in enumerate(items):
+                for field in fields:
+                    live.add((kind, i, field))
+                    index.update((kind, i, field), item.get(field, ""))
+        for key in index.keys():
+            if key[0] in ("character", "setting") and key not in live:
+                index.remove(key)
+
+    # 編集に合わせた更新（索引が未作成のプロジェクトは後でまとめて作るので何もしない）
+    def update_episode(self, project, episode):
+        index = self.loaded(project)
+        if index is not None:
+            index.update(("episode", episode.id, "title"), episode.title)
+            self._index_body(project, index, episode)
+
+    def remove_episode(self, project, episode):
+        index = self.loaded(project)
+        if index is not None:
+            for field in ("content", "memo", "title"):
+                index.remove(("episode", episode.id, field))
+
+    def update_chapter(self, project, chapter):
+        index = self.loaded(project)
+        if index is not None:
+            index.update(("chapter", chapter.id, "title"), chapter.title)
+
+    def remove_chapter(self, project, chapter):
+        index = self.loaded(project)
+        if index is not None:
+            index.remove(("chapter", chapter.id, "title"))
+            for ep in chapter.episodes:
+                self.remove_episode(project, ep)
+
+    def update_profiles(self, project):
+        index = self.loaded(project)
+        if index is not None:
+            self._index_profiles(project, index)
+
+    def prepare_save(self, projects):
+        # 変更のあった索引の変更分を (project_id, 記録, 作り直しか) にする
+        # 書き込み（JSONにするのも含めて）はwrite()で別スレッドから行える
+        # ライブラリに無いプロジェクト（保存されない既定の新規プロジェクト）の分は書かない
+        live = {p.id for p in projects}
+        result = []
+        for pid, index in self.indexes.items():
+            if index.dirty and pid in live:
+                result.append((pid, index.changes(), index.fresh))
+                index.fresh = False
+        return result
+
+    def is_dirty(self):
+        return any(index.dirty for index in self.indexes.values())
+
+    def write(self, files):
+        with self._write_lock:
+            for pid, records, fresh in files:
+                journal = self._journal(pid)
+                if fresh or pid not in self._opened:
+                    # 作り直した索引は記録だけで、前回の終了時に途切れたログの末尾は捨ててまとめ直す
+                    self._compact(pid, journal, records, fresh)
+                    self._opened.add(pid)
+                    continue
+                try:
+                    written = journal.append_batch([json.dumps(r, ensure_ascii=False) for r in records])
+                except BaseException:
+                    self._opened.discard(pid)  # 途中まで書いた行は次の書き込みの前に捨てる
+                    raise
+                finally:
+                    journal.close()
+                self.bytes_written += written
+                count("write_bytes", written)
+                if journal.size >= max(COMPACT_BYTES, self._base_sizes.get(pid, 0)):
+                    self._compact(pid, journal)
+
+    def _compact(self, pid, journal, records=(), fresh=False):
+        path = self._path(pid)
+        docs = {}
+        if not fresh:
+            try:
+                docs = read_docs(path, journal)
+            except ValueError:
+                pass  # 記録の分だけで書き直す（足りない文書は次に読み込んだときの確認で索引し直される）
+        apply_changes(docs, records)
+        data = json.dumps({"format": FORMAT_VERSION, "docs": list(docs.values())},
+                          ensure_ascii=False).encode("utf-8")
+        write_atomic(path, data)
+        journal.reset()
+        self._base_sizes[pid] = len(data)
+        self.bytes_written += len(data)
+        count("write_bytes", len(data))
+
+    def forget(self, pid):
+        self.indexes.pop(pid, None)
+
+    # 検索
+    def _loader(self, project):
+        by_id = {}
+        for ch in project.chapters:
+            by_id[ch.id] = ch
+            for ep in ch.episodes:
+                by_id[ep.id] = ep
+
+        def load(key):
+            kind, oid, field = key
+            if kind == "character":
+                items = project.characters
+            elif kind == "setting":
+                items = project.settings
+            else:
+                obj = by_id.get(oid)
+                if obj is None:
+                    return None
+                if field in ("content", "memo"):
+                    self.store.content(project, obj)
+                return getattr(obj, field) or ""
+            return items[oid].get(field, "") if oid < len(items) else None
+
+        return load
+
+    @timed("search.search")
+    def search(self, projects, query, limit=100):
+        hits = []
+        for project in projects:
+            index = self.ensure(project)
+            for hit in index.search(query, self._loader(project), limit):
+                hit["project"] = project
+                hits.append(hit)
+        hits.sort(key=lambda h: h["score"], reverse=True)
+        return hits[:limit]
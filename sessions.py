@@ -0,0 +1,306 @@
+import os
+import struct
+import sys
+import threading
+import time
+from array import array
+from datetime import date, datetime, timedelta
+
+from journal import write_atomic
+from profiler import count, timed
+
+# 執筆記録: いつ・どの話で・何字増えた（減った）か
+#
+# <log>       1件16バイト固定長の追記のみのログ（時刻・プロジェクト番号・話番号・文字数の増減）
+# <log>.ids   番号 -> プロジェクト・話のID（1行1件、追記のみ）
+# <log>.idx   日ごとの集計（ログのどこまでを集計したかと、プロジェクトごとの日別合計）
+#
+# 集計はメモリ上で日ごとの配列（最初の日からの通し番号 -> 文字数）として持つので、
+# 日別・週別・連続日数は配列を引くだけで求まる。起動時は集計ファイルを読み、
+# その後に追記されたログだけを足し込む（集計ファイルが無い・壊れていればログから作り直す）。
+
+RECORD = struct.Struct("<IIIi")  # 時刻（秒）・プロジェクト番号・話番号・文字数の増減
+INDEX_HEADER = struct.Struct("<4sIQI")  # 識別子・形式・集計済みのログの長さ・項目数
+INDEX_ENTRY = struct.Struct("<iII")  # プロジェクト番号（-1は全体）・最初の日・日数
+INDEX_MAGIC = b"NWS" + (b"L" if sys.byteorder == "little" else b"B")  # 配列はそのままのバイト順で書く
+INDEX_FORMAT = 1
+ALL = -1  # 全プロジェクトの合計
+
+
+def _append(path, data, valid):
+    # 末尾に足す。validバイトより後ろ（書き込みの途中で落ちた残り）は先に切り詰める
+    with open(path, 'ab') as f:
+        if f.tell() > valid:
+            f.truncate(valid)
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+
+
+def day_number(timestamp):
+    # ローカル時刻での日付の通し番号
+    return datetime.fromtimestamp(timestamp).toordinal()
+
+
+class DailyTotals:
+    # 日ごとの合計。first日目からの配列で持つ
+
+    def __init__(self, first=0, totals=None):
+        self.first = first
+        self.totals = totals if totals is not None else array("i")
+
+    def add(self, day, chars):
+        totals = self.totals
+        if not totals:
+            self.first = day
+        elif day < self.first:
+            # 時計が戻された場合など。前に0を足して広げる
+            self.totals = totals = array("i", bytes(4 * (self.first - day))) + totals
+            self.first = day
+        i = day - self.first
+        if i >= len(totals):
+            totals.frombytes(bytes(4 * (i + 1 - len(totals))))
+        totals[i] += chars
+
+    def get(self, day):
+        i = day - self.first
+        return self.totals[i] if 0 <= i < len(self.totals) else 0
+
+    def span(self, start, end):
+        # start日目からend日目の前日までの日ごとの合計
+        lo = max(start, self.first)
+        hi = min(end, self.first + len(self.totals))
+        if lo >= hi:
+            return [0] * max(0, end - start)
+        return ([0] * (lo - start) + self.totals[lo - self.first:hi - self.first].tolist()
+                + [0] * (end - hi))
+
+    def streak(self, today, goal=1):
+        # todayまで続けて1日goal字以上書いた日数（今日がまだなら昨日まで）
+        day = today if self.get(today) >= goal else today - 1
+        days = 0
+        while self.get(day) >= goal:
+            days += 1
+            day -= 1
+        return days
+
+    def longest(self, goal=1):
+        best = run = 0
+        for chars in self.totals:
+            run = run + 1 if chars >= goal else 0
+            if run > best:
+                best = run
+        return best
+
+
+class SessionLog:
+    def __init__(self, path):
+        self.path = path
+        self.read_only = False
+        self.bytes_written = 0
+        self._lock = threading.Lock()  # flush()は作業スレッドからも呼ばれる
+        self._loaded = False
+        self._ids = []       # 番号 -> ID
+        self._refs = {}      # ID -> 番号
+        self._new_ids = []   # まだ書いていないID
+        self._pending = bytearray()  # まだ書いていない記録
+        self._daily = {}     # プロジェクト番号（ALLは全体） -> DailyTotals
+        self._indexed = 0    # 集計に入れたログの長さ（バイト）
+        self._log_size = 0   # ログ・IDファイルの有効な長さ（バイト。これより後ろは壊れた末尾）
+        self._ids_size = 0
+        self._index_stale = False
+
+    # 読み込み（最初に使うときまで読まない）
+    def _ensure(self):
+        if not self._loaded:
+            self._loaded = True
+            self._load()
+
+    @timed("sessions.load")
+    def _load(self):
+        ids_path = self.path + ".ids"
+        if os.path.exists(ids_path):
+            with open(ids_path, 'rb') as f:
+                data = f.read()
+            self._ids_size = data.rfind(b"\n") + 1  # 書き込みの途中で落ちた最後の行は捨てる
+            self._ids = data[:self._ids_size].decode("utf-8").splitlines()
+            self._refs = {oid: i for i, oid in enumerate(self._ids)}
+        if not os.path.exists(self.path):
+            return
+        size = os.path.getsize(self.path)
+        size -= size % RECORD.size  # 書き込みの途中で落ちた末尾は捨てる
+        self._log_size = size
+        if not self._read_index(size):
+            self._daily = {}
+            self._indexed = 0
+        if self._indexed < size:
+            with open(self.path, 'rb') as f:
+                f.seek(self._indexed)
+                data = f.read(size - self._indexed)
+            count("read_bytes", len(data))
+            self._add_records(data)
+            self._indexed = size
+            self._index_stale = True
+
+    def _read_index(self, size):
+        path = self.path + ".idx"
+        if not os.path.exists(path):
+            return False
+        with open(path, 'rb') as f:
+            data = f.read()
+        count("read_bytes", len(data))
+        try:
+            magic, version, indexed, entries = INDEX_HEADER.unpack_from(data)
+            if magic != INDEX_MAGIC or version != INDEX_FORMAT or indexed > size:
+                return False
+            pos = INDEX_HEADER.size
+            daily = {}
+            for _ in range(entries):
+                ref, first, days = INDEX_ENTRY.unpack_from(data, pos)
+                pos += INDEX_ENTRY.size
+                totals = array("i")
+                totals.frombytes(data[pos:pos + 4 * days])
+                if len(totals) != days:
+                    return False
+                pos += 4 * days
+                daily[ref] = DailyTotals(first, totals)
+        except struct.error:
+            return False
+        self._daily = daily
+        self._indexed = indexed
+        return True
+
+    def _add_records(self, data):
+        daily = self._daily
+        every = daily.get(ALL)
+        if every is None:
+            every = daily[ALL] = DailyTotals()
+        last_ts = None
+        day = 0
+        for timestamp, pref, eref, chars in RECORD.iter_unpack(data):
+            if timestamp != last_ts:
+                # 同じ保存の記録は時刻が同じなので、日付の計算は1度で済む
+                last_ts = timestamp
+                day = day_number(timestamp)
+            every.add(day, chars)
+            totals = daily.get(pref)
+            if totals is None:
+                totals = daily[pref] = DailyTotals()
+            totals.add(day, chars)
+
+    def _ref(self, oid):
+        ref = self._refs.get(oid)
+        if ref is None:
+            ref = self._refs[oid] = len(self._ids)
+            self._ids.append(oid)
+            self._new_ids.append(oid)
+        return ref
+
+    # 記録
+    def record(self, project_id, episode_id, chars, timestamp=None):
+        # 話の文字数がchars字増えた（負なら減った）。集計にはすぐ反映し、ファイルへはflush()で書く
+        if not chars:
+            return
+        self._ensure()
+        timestamp = int(timestamp if timestamp is not None else time.time())
+        with self._lock:
+            data = RECORD.pack(timestamp, self._ref(project_id), self._ref(episode_id), chars)
+            self._pending += data
+            self._add_records(data)
+
+    def flush(self):
+        # 未書き込みの記録をログの末尾に足す（保存ごとに1回）
+        with self._lock:
+            if not self._pending or self.read_only:
+                return 0
+            ids = "".join(oid + "\n" for oid in self._new_ids).encode("utf-8")
+            data = bytes(self._pending)
+            self._new_ids = []
+            self._pending = bytearray()
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        # IDを先に書くので、ログが番号の分からない記録を指すことはない
+        if ids:
+            _append(self.path + ".ids", ids, self._ids_size)
+            self._ids_size += len(ids)
+        _append(self.path, data, self._log_size)
+        self._log_size += len(data)
+        with self._lock:
+            self._indexed += len(data)
+            self._index_stale = True
+        written = len(ids) + len(data)
+        self.bytes_written += written
+        count("write_bytes", written)
+        return written
+
+    def write_index(self):
+        # 日ごとの集計を書き出す（次回の起動でログを読み直さなくて済む）
+        with self._lock:
+            if not self._index_stale or self.read_only or self._pending:
+                return
+            parts = [INDEX_HEADER.pack(INDEX_MAGIC, INDEX_FORMAT, self._indexed, len(self._daily))]
+            for ref, totals in self._daily.items():
+                parts.append(INDEX_ENTRY.pack(ref, totals.first, len(totals.totals)))
+                parts.append(totals.totals.tobytes())
+            self._index_stale = False
+        data = b"".join(parts)
+        write_atomic(self.path + ".idx", data)
+        self.bytes_written += len(data)
+        count("write_bytes", len(data))
+
+    def close(self):
+        if self._loaded:
+            self.flush()
+            self.write_index()
+
+    def records(self):
+        # (時刻, プロジェクトID, 話ID, 文字数の増減) を古い順に（保存先の移行用）
+        self._ensure()
+        if os.path.exists(self.path):
+            with open(self.path, 'rb') as f:
+                data = f.read()
+            data = data[:len(data) - len(data) % RECORD.size]
+            for timestamp, pref, eref, chars in RECORD.iter_unpack(data):
+                yield timestamp, self._ids[pref], self._ids[eref], chars
+        with self._lock:
+            pending = bytes(self._pending)
+        for timestamp, pref, eref, chars in RECORD.iter_unpack(pending):
+            yield timestamp, self._ids[pref], self._ids[eref], chars
+
+    # 集計
+    def _totals(self, project_id):
+        self._ensure()
+        if project_id is None:
+            return self._daily.get(ALL)
+        ref = self._refs.get(project_id)
+        return self._daily.get(ref) if ref is not None else None
+
+    def day(self, project_id=None, when=None):
+        # その日（既定は今日）に書いた文字数
+        totals = self._totals(project_id)
+        return totals.get((when or date.today()).toordinal()) if totals is not None else 0
+
+    def daily(self, project_id=None, days=7, end=None):
+        # 直近days日の [(日付, 文字数)]（古い順、endの日まで）
+        end = (end or date.today()).toordinal() + 1
+        totals = self._totals(project_id)
+        values = totals.span(end - days, end) if totals is not None else [0] * days
+        return [(date.fromordinal(end - days + i), chars) for i, chars in enumerate(values)]
+
+    def weekly(self, project_id=None, weeks=4, end=None):
+        # 直近weeks週（月曜始まり）の [(週の初日, 文字数)]（古い順）
+        end = end or date.today()
+        monday = (end - timedelta(days=end.weekday())).toordinal()
+        start = monday - 7 * (weeks - 1)
+        totals = self._totals(project_id)
+        values = totals.span(start, monday + 7) if totals is not None else [0] * (7 * weeks)
+        return [(date.fromordinal(start + 7 * w), sum(values[7 * w:7 * w + 7])) for w in range(weeks)]
+
+    def streak(self, project_id=None, goal=1, when=None):
+        # (今の連続日数, 最長の連続日数)。1日goal字以上書いた日を数える
+        totals = self._totals(project_id)
+        if totals is None:
+            return 0, 0
+        goal = max(1, goal)  # 0字の日を数えると途切れなくなる
+        return totals.streak((when or date.today()).toordinal(), goal), totals.longest(goal)
@@ -0,0 +1,480 @@
+import json
+import os
+import shutil
+import sqlite3
+import sys
+import tempfile
+import threading
+import zlib
+from collections import Counter
+
+from model import Chapter, Episode, Project, Version
+from profiler import count, timed
+from search import make_hit
+from sessions import SessionLog
+from storage import (BODY_KEYS, CONTENT_CACHE_BYTES, DATA_DIR, DATABASE_FILE, FORMAT_VERSION, ProjectStore, Store,
+                     copy_library)
+from versions import VersionStore
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS library (key TEXT PRIMARY KEY, value TEXT NOT NULL);
+CREATE TABLE IF NOT EXISTS projects (id TEXT PRIMARY KEY, data TEXT NOT NULL);
+CREATE TABLE IF NOT EXISTS chapters (id TEXT PRIMARY KEY, project_id TEXT NOT NULL, data TEXT NOT NULL);
+CREATE TABLE IF NOT EXISTS episodes (
+    num INTEGER PRIMARY KEY,
+    id TEXT NOT NULL UNIQUE,
+    project_id TEXT NOT NULL,
+    chapter_id TEXT,
+    position INTEGER,
+    meta TEXT,
+    content TEXT NOT NULL DEFAULT '',
+    memo TEXT NOT NULL DEFAULT ''
+);
+CREATE INDEX IF NOT EXISTS episodes_by_chapter ON episodes (project_id, chapter_id, position);
+CREATE TABLE IF NOT EXISTS characters (
+    project_id TEXT NOT NULL, position INTEGER NOT NULL, data TEXT NOT NULL, PRIMARY KEY (project_id, position)
+);
+CREATE TABLE IF NOT EXISTS settings (
+    project_id TEXT NOT NULL, position INTEGER NOT NULL, data TEXT NOT NULL, PRIMARY KEY (project_id, position)
+);
+CREATE TABLE IF NOT EXISTS versions (
+    project_id TEXT NOT NULL, key TEXT NOT NULL, seq INTEGER NOT NULL, meta TEXT NOT NULL, payload BLOB,
+    PRIMARY KEY (project_id, key, seq)
+);
+"""
+
+# 本文とメモの全文検索。日本語は空白で区切られないので3文字組（trigram）で索引する。
+# 本文・メモが変わったときだけトリガーで索引を更新する（タイトルや並び順の更新では触らない）
+FTS_SCHEMA = """
+CREATE VIRTUAL TABLE IF NOT EXISTS episodes_fts USING fts5(
+    content, memo, content='episodes', content_rowid='num', tokenize='trigram'
+);
+CREATE TRIGGER IF NOT EXISTS episodes_fts_insert AFTER INSERT ON episodes BEGIN
+    INSERT INTO episodes_fts (rowid, content, memo) VALUES (new.num, new.content, new.memo);
+END;
+CREATE TRIGGER IF NOT EXISTS episodes_fts_delete AFTER DELETE ON episodes BEGIN
+    INSERT INTO episodes_fts (episodes_fts, rowid, content, memo) VALUES ('delete', old.num, old.content, old.memo);
+END;
+CREATE TRIGGER IF NOT EXISTS episodes_fts_update AFTER UPDATE OF content, memo ON episodes BEGIN
+    INSERT INTO episodes_fts (episodes_fts, rowid, content, memo) VALUES ('delete', old.num, old.content, old.memo);
+    INSERT INTO episodes_fts (rowid, content, memo) VALUES (new.num, new.content, new.memo);
+END;
+"""
+
+# 書き込みに使うSQL。文字列を固定しておくと、接続ごとのキャッシュでコンパイル済みの文が使い回される
+PUT_LIBRARY = "INSERT OR REPLACE INTO library (key, value) VALUES ('library', ?)"
+PUT_PROJECT = "INSERT OR REPLACE INTO projects (id, data) VALUES (?, ?)"
+PUT_CHAPTER = "INSERT OR REPLACE INTO chapters (id, project_id, data) VALUES (?, ?, ?)"
+PUT_EPISODE_META = (
+    "INSERT INTO episodes (id, project_id, chapter_id, position, meta) VALUES (?, ?, ?, ?, ?) "
+    "ON CONFLICT (id) DO UPDATE SET project_id = excluded.project_id, chapter_id = excluded.chapter_id, "
+    "position = excluded.position, meta = excluded.meta"
+)
+PUT_EPISODE_BODY = (
+    "INSERT INTO episodes (id, project_id, content, memo) VALUES (?, ?, ?, ?) "
+    "ON CONFLICT (id) DO UPDATE SET content = excluded.content, memo = excluded.memo"
+)
+DELETE_CHAPTER = "DELETE FROM chapters WHERE id = ?"
+DELETE_EPISODE = "DELETE FROM episodes WHERE id = ?"
+DELETE_HISTORY = "DELETE FROM versions WHERE project_id = ? AND key = ?"
+PROFILE_TABLES = ("characters", "settings")
+PUT_PROFILE = {table: f"INSERT INTO {table} (project_id, position, data) VALUES (?, ?, ?)"
+               for table in PROFILE_TABLES}
+DELETE_PROFILES = {table: f"DELETE FROM {table} WHERE project_id = ?" for table in PROFILE_TABLES}
+DELETE_PROJECT = [f"DELETE FROM {table} WHERE {column} = ?" for table, column in (
+    ("projects", "id"), ("chapters", "project_id"), ("episodes", "project_id"),
+    ("characters", "project_id"), ("settings", "project_id"), ("versions", "project_id"))]
+PUT_VERSION = "INSERT INTO versions (project_id, key, seq, meta, payload) VALUES (?, ?, ?, ?, ?)"
+
+
+def _size(rows):
+    # 書き込んだおおよそのバイト数（文字列はUTF-8として数える）
+    total = 0
+    for row in rows:
+        for value in row:
+            if isinstance(value, str):
+                total += len(value.encode("utf-8"))
+            elif isinstance(value, bytes):
+                total += len(value)
+    return total
+
+
+class SQLVersionStore(VersionStore):
+    # versionsテーブルに置くバージョン履歴。差分・全文の作り方はVersionStoreと同じ
+
+    def __init__(self, store):
+        super().__init__(store.root_dir)
+        self.store = store
+
+    def _load_entries(self, pid, key):
+        rows = self.store.query("SELECT meta FROM versions WHERE project_id = ? AND key = ? ORDER BY seq",
+                                (pid, key))
+        return [Version.from_dict(json.loads(meta)) for meta, in rows]
+
+    def _write(self, pid, key, entry, payload):
+        entry.seq = len(self.list_versions(pid, key))
+        row = (pid, key, entry.seq, json.dumps(entry.to_dict(), ensure_ascii=False), payload)
+        self.store.execute(PUT_VERSION, row)
+        self.bytes_written += _size([row])
+        count("write_bytes", _size([row]))
+
+    def _read_payload(self, pid, key, entry):
+        payload, = self.store.query("SELECT payload FROM versions WHERE project_id = ? AND key = ? AND seq = ?",
+                                    (pid, key, entry.seq))[0]
+        count("read_bytes", len(payload))
+        if entry.z:
+            payload = zlib.decompress(payload)
+        return payload.decode("utf-8")
+
+    def keys(self, pid):
+        return [key for key, in self.store.query("SELECT DISTINCT key FROM versions WHERE project_id = ?", (pid,))]
+
+    def rename(self, pid, old_key, new_key):
+        self.store.execute("UPDATE versions SET key = ? WHERE project_id = ? AND key = ?", (new_key, pid, old_key))
+        self._forget(pid, old_key)
+        self._forget(pid, new_key)
+
+    def delete(self, pid, key):
+        self.store.execute(DELETE_HISTORY, (pid, key))
+        self._forget(pid, key)
+
+
+class SQLiteStore(Store):
+    # 1つのSQLiteデータベースにライブラリ全体を置く保存先（ProjectStoreと同じ使い方）
+    #
+    # library     プロジェクトの並び順と選択中のプロジェクト
+    # projects    プロジェクト情報（章の並びを含む）
+    # chapters    章情報
+    # episodes    話のメタ情報・本文・メモ（並び順はchapter_id・position）
+    # characters / settings   キャラクター・世界設定（position順）
+    # versions    バージョン履歴（versions.VersionStoreと同じ形式の差分・全文）
+    # episodes_fts  本文・メモの全文検索（FTS5が使えるときだけ）
+    #
+    # WALモードなので、作業スレッドの書き込み中もUIスレッドは別の接続から読める。
+    # prepare_save()は変更分を (SQL, 行のリスト) にし、commit()が1つのトランザクションで書き込む。
+
+    def __init__(self, path=DATABASE_FILE, cache_bytes=CONTENT_CACHE_BYTES):
+        super().__init__(cache_bytes)
+        self.path = path
+        self.root_dir = os.path.dirname(os.path.abspath(path))
+        self._lock = threading.RLock()       # 書き込み用の接続（commit()のスレッドからも使う）
+        self._read_lock = threading.RLock()  # 読み込み用の接続
+        self.db = self._connect()
+        self.db.executescript(SCHEMA)
+        try:
+            self.db.executescript(FTS_SCHEMA)
+            self.fts = True
+        except sqlite3.OperationalError:
+            self.fts = False  # FTS5（trigram）が無いSQLiteでは本文を順に調べる
+        self.reader = self._connect()
+        self.versions = SQLVersionStore(self)
+        self.sessions = SessionLog(os.path.splitext(path)[0] + "_sessions.bin")  # 固定長の追記ログなので別ファイル
+        self._known = {}  # project_id -> {"chapters": set(), "episodes": set()}
+        self._uncommitted = Counter()  # prepare_save済みでcommit前の話ID
+
+    def _connect(self):
+        db = sqlite3.connect(self.path, check_same_thread=False, cached_statements=256)
+        db.execute("PRAGMA journal_mode = WAL")
+        db.execute("PRAGMA synchronous = FULL")  # コミットごとにfsync（ジャーナル版と同じ）
+        return db
+
+    def execute(self, sql, params=()):
+        with self._lock, self.db:
+            self.db.execute(sql, params)
+
+    def query(self, sql, params=()):
+        with self._read_lock:
+            return self.reader.execute(sql, params).fetchall()
+
+    def _unsaved(self):
+        with self._lock:
+            return super()._unsaved() | set(self._uncommitted)
+
+    def _known_ids(self, pid):
+        return self._known.setdefault(pid, {"chapters": set(), "episodes": set()})
+
+    @timed("store.read_body")
+    def _read_body(self, pid, eid):
+        rows = self.query("SELECT content, memo FROM episodes WHERE id = ?", (eid,))
+        if not rows:
+            return {}
+        count("read_bytes", _size(rows))
+        return dict(zip(BODY_KEYS, rows[0]))
+
+    # 書き込み
+    def _project_record(self, project):
+        record = project.meta()
+        for table in PROFILE_TABLES:
+            del record[table]  # 別のテーブルに置く
+        return record
+
+    @timed("store.prepare_save")
+    def prepare_save(self, projects, current_project_idx):
+        if not self._dirty or self.read_only:
+            return []
+
+        dirty = self._dirty
+        self._dirty = {}
+        live = {p.id for p in projects}
+        touched = {}
+        records = []
+
+        for key, (kind, project, obj) in dirty.items():
+            if project is not None and project.id not in live:
+                continue
+            if kind == "library":
+                records.append((PUT_LIBRARY, [(json.dumps({
+                    "format": FORMAT_VERSION,
+                    "projects": [p.id for p in projects],
+                    "current_project_idx": current_project_idx
+                }, ensure_ascii=False),)]))
+                for pid in list(self._known):
+                    if pid not in live:
+                        records.extend((sql, [(pid,)]) for sql in DELETE_PROJECT)
+                        del self._known[pid]
+            elif kind == "project":
+                pid = project.id
+                records.append((PUT_PROJECT, [(pid, json.dumps(self._project_record(project), ensure_ascii=False))]))
+                for table in PROFILE_TABLES:
+                    records.append((DELETE_PROFILES[table], [(pid,)]))
+                    records.append((PUT_PROFILE[table], [(pid, i, json.dumps(item, ensure_ascii=False))
+                                                         for i, item in enumerate(getattr(project, table))]))
+                touched[pid] = project
+            elif kind == "chapter":
+                pid = project.id
+                record = obj.meta()
+                del record["episodes"]  # 話のメタ情報はepisodesテーブルに置く
+                records.append((PUT_CHAPTER, [(obj.id, pid, json.dumps(record, ensure_ascii=False))]))
+                records.append((PUT_EPISODE_META, [
+                    (ep.id, pid, obj.id, i, json.dumps(ep.meta(), ensure_ascii=False))
+                    for i, ep in enumerate(obj.episodes)
+                ]))
+                known = self._known_ids(pid)
+                known["chapters"].add(obj.id)
+                known["episodes"].update(ep.id for ep in obj.episodes)
+                touched[pid] = project
+            elif kind == "episode":
+                pid = project.id
+                body = obj.body()
+                records.append((PUT_EPISODE_BODY, [(obj.id, pid, body["content"], body["memo"])]))
+                self._known_ids(pid)["episodes"].add(obj.id)
+                with self._lock:
+                    self._uncommitted[obj.id] += 1
+
+        for project in touched.values():
+            self._collect_garbage(records, project)
+        self._trim_cache()
+        return records
+
+    def _collect_garbage(self, records, project):
+        pid = project.id
+        known = self._known_ids(pid)
+        live_chapters = {ch.id for ch in project.chapters}
+        live_episodes = {ep.id for ch in project.chapters for ep in ch.episodes}
+        removed_chapters = known["chapters"] - live_chapters
+        removed_episodes = known["episodes"] - live_episodes
+        if removed_chapters:
+            records.append((DELETE_CHAPTER, [(cid,) for cid in removed_chapters]))
+        if removed_episodes:
+            records.append((DELETE_EPISODE, [(eid,) for eid in removed_episodes]))
+            records.append((DELETE_HISTORY, [(pid, eid) for eid in removed_episodes]))
+            for eid in removed_episodes:
+                self.versions._forget(pid, eid)
+        known["chapters"] = live_chapters
+        known["episodes"] = live_episodes
+
+    @timed("store.commit")
+    def commit(self, records):
+        written = 0
+        with self._lock:
+            with self.db:
+                for sql, rows in records:
+                    if rows:
+                        self.db.executemany(sql, rows)
+                        written += _size(rows)
+            for sql, rows in records:
+                if sql is PUT_EPISODE_BODY:
+                    for row in rows:
+                        self._uncommitted[row[0]] -= 1
+            self._uncommitted += Counter()  # 0以下になったものを取り除く
+            self.bytes_written += written
+        count("write_bytes", written)
+        return written
+
+    @timed("store.checkpoint")
+    def checkpoint(self):
+        # WALの内容をデータベース本体へ反映する
+        if self.read_only:
+            return
+        with self._lock:
+            self.db.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+
+    def close(self):
+        self.checkpoint()
+        if not self.read_only:
+            self.sessions.close()
+        self.reader.close()
+        self.db.close()
+
+    # 読み込み
+    @timed("store.load")
+    def load(self):
+        rows = self.query("SELECT value FROM library WHERE key = 'library'")
+        if not rows:
+            return [], None
+        library = json.loads(rows[0][0])
+        projects = [self._load_project(pid) for pid in library.get("projects", [])]
+        return projects, library.get("current_project_idx")
+
+    def _load_project(self, pid):
+        record = json.loads(self.query("SELECT data FROM projects WHERE id = ?", (pid,))[0][0])
+        chapters = {}
+        for cid, data in self.query("SELECT id, data FROM chapters WHERE project_id = ?", (pid,)):
+            chapters[cid] = Chapter.from_dict(json.loads(data))
+        for cid, meta in self.query("SELECT chapter_id, meta FROM episodes WHERE project_id = ? "
+                                    "ORDER BY chapter_id, position", (pid,)):
+            chapter = chapters.get(cid)
+            if chapter is not None and meta:
+                chapter.episodes.append(Episode.from_dict(json.loads(meta)))
+        record["chapters"] = [chapters[cid] for cid in record.get("chapters", []) if cid in chapters]
+        for table in PROFILE_TABLES:
+            record[table] = [json.loads(data) for data, in self.query(
+                f"SELECT data FROM {table} WHERE project_id = ? ORDER BY position", (pid,))]
+        project = Project.from_dict(record)
+
+        known = self._known_ids(pid)
+        for ch in project.chapters:
+            known["chapters"].add(ch.id)
+            known["episodes"].update(ep.id for ep in ch.episodes)
+        return project
+
+    # 検索
+    def matching_episodes(self, query):
+        # 本文かメモにqueryを含む（可能性のある）話のID。未保存の話は内容にかかわらず含める
+        # 索引はライブラリ全体で1つなので、プロジェクトを問わず1回の問い合わせで済ませる
+        if self.fts and len(query) >= 3:
+            phrase = '"' + query.replace('"', '""') + '"'
+            rows = self.query("SELECT e.id FROM episodes_fts JOIN episodes e ON e.num = episodes_fts.rowid "
+                              "WHERE episodes_fts MATCH ?", (phrase,))
+        else:
+            rows = self.query("SELECT id FROM episodes WHERE instr(content, ?) > 0 OR instr(memo, ?) > 0",
+                              (query, query))
+        return {eid for eid, in rows} | self._unsaved()
+
+    def search_engine(self):
+        return SQLiteSearch(self)
+
+
+class SQLiteSearch:
+    # FTS5を使う全文検索（LibrarySearchと同じ使い方）
+    #
+    # 索引はデータベースへの書き込みと一緒にトリガーで更新されるので、
+    # 編集ごとの更新や索引ファイルの保存は要らない。タイトル・キャラクター・世界設定は
+    # メモリ上のものをそのまま調べる。
+
+    def __init__(self, store):
+        self.store = store
+        self.bytes_written = 0
+
+    def loaded(self, project):
+        return self
+
+    def ensure(self, project):
+        return self
+
+    def update_episode(self, project, episode):
+        pass
+
+    def remove_episode(self, project, episode):
+        pass
+
+    def update_chapter(self, project, chapter):
+        pass
+
+    def remove_chapter(self, project, chapter):
+        pass
+
+    def update_profiles(self, project):
+        pass
+
+    def prepare_save(self, projects):
+        return []
+
+    def is_dirty(self):
+        return False
+
+    def write(self, files):
+        pass
+
+    def forget(self, pid):
+        pass
+
+    def search(self, projects, query, limit=100):
+        query = query.strip()
+        if not query:
+            return []
+        hits = []
+        matching = self.store.matching_episodes(query)
+        for project in projects:
+            found = []
+            for ch in project.chapters:
+                found.append(make_hit(("chapter", ch.id, "title"), ch.title, query))
+                for ep in ch.episodes:
+                    found.append(make_hit(("episode", ep.id, "title"), ep.title, query))
+                    if ep.id in matching:
+                        found.append(make_hit(("episode", ep.id, "content"), self.store.content(project, ep), query))
+                        found.append(make_hit(("episode", ep.id, "memo"), ep.memo, query))
+            for kind, items, fields in (("character", project.characters, ("name", "background")),
+                                        ("setting", project.settings, ("name", "detail"))):
+                for i, item in enumerate(items):
+                    for field in fields:
+                        found.append(make_hit((kind, i, field), item.get(field, ""), query))
+            for hit in found:
+                if hit is not None:
+                    hit["project"] = project
+                    hits.append(hit)
+        hits.sort(key=lambda h: h["score"], reverse=True)
+        return hits[:limit]
+
+
+def migrate(source=DATA_DIR, database=DATABASE_FILE, task=None):
+    # JSON形式のデータをSQLiteへ移す
+    # source: 分割保存のフォルダ（novels_data）か、単一のJSONファイル（旧形式のnovels_data.json）
+    if os.path.isdir(source):
+        temp_dir = None
+        origin = ProjectStore(source, legacy_file="")
+    else:
+        temp_dir = tempfile.mkdtemp()
+        origin = ProjectStore(temp_dir, legacy_file=source)
+    existed = os.path.exists(database)
+    target = SQLiteStore(database)
+    try:
+        if target.query("SELECT 1 FROM library"):
+            raise ValueError(f"{database} には既にデータがあります")
+        copy_library(origin, target, task)
+        return target
+    except BaseException:
+        target.close()
+        if not existed:
+            # 途中までのデータベースが残ると次回の起動で使われてしまう
+            for suffix in ("", "-wal", "-shm"):
+                if os.path.exists(database + suffix):
+                    os.remove(database + suffix)
+            for suffix in ("", ".ids", ".idx"):
+                if os.path.exists(target.sessions.path + suffix):
+                    os.remove(target.sessions.path + suffix)
+        raise
+    finally:
+        origin.close()
+        if temp_dir:
+            shutil.rmtree(temp_dir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    # python sqlstore.py [移行元（既定: novels_data）] [データベース（既定: novels_data.db）]
+    args = sys.argv[1:]
+    store = migrate(*args[:2])
+    projects, _ = store.load()
+    episodes = sum(len(ch.episodes) for p in projects for ch in p.chapters)
+    print(f"{store.path}: {len(projects)}プロジェクト / {episodes}話を移行しました")
+    store.close()
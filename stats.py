@@ -0,0 +1,52 @@
+class ProjectStats:
+    # 章ごと・プロジェクト全体の文字数合計。話1つの文字数が変わったときは差分だけ足し引きする
+
+    def __init__(self, project):
+        self.project = project
+        self.rebuild()
+
+    def rebuild(self):
+        self.chapter_totals = {}
+        self.total = 0
+        self.episode_count = 0
+        for ch in self.project.chapters:
+            ch_total = sum(ep.word_count for ep in ch.episodes)
+            self.chapter_totals[ch.id] = ch_total
+            self.total += ch_total
+            self.episode_count += len(ch.episodes)
+
+    def chapter_total(self, chapter):
+        return self.chapter_totals.get(chapter.id, 0)
+
+    def chapter_rows(self):
+        # 進捗表示用の (章タイトル, 文字数, 話数) の並び
+        return [(ch.title, self.chapter_totals.get(ch.id, 0), len(ch.episodes))
+                for ch in self.project.chapters]
+
+    def episode_changed(self, chapter, old_count, new_count):
+        delta = new_count - old_count
+        self.chapter_totals[chapter.id] = self.chapter_totals.get(chapter.id, 0) + delta
+        self.total += delta
+
+    def add_chapter(self, chapter):
+        ch_total = sum(ep.word_count for ep in chapter.episodes)
+        self.chapter_totals[chapter.id] = ch_total
+        self.total += ch_total
+        self.episode_count += len(chapter.episodes)
+
+    def remove_chapter(self, chapter):
+        self.total -= self.chapter_totals.pop(chapter.id, 0)
+        self.episode_count -= len(chapter.episodes)
+
+    def add_episode(self, chapter, episode):
+        self.episode_changed(chapter, 0, episode.word_count)
+        self.episode_count += 1
+
+    def remove_episode(self, chapter, episode):
+        self.episode_changed(chapter, episode.word_count, 0)
+        self.episode_count -= 1
+
+    def move_episode(self, source, target, episode):
+        count = episode.word_count
+        self.episode_changed(source, count, 0)
+        self.episode_changed(target, 0, count)
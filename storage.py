@@ -0,0 +1,522 @@
+import json
+import os
+import shutil
+import sys
+import threading
+from collections import Counter, OrderedDict
+from datetime import datetime
+
+from journal import Journal, write_atomic
+from model import BODY_KEYS, Chapter, Episode, Project
+from profiler import count, timed
+from project_index import migrate_positional_keys
+from search import LibrarySearch
+from sessions import SessionLog
+from versions import VersionStore
+
+DATA_DIR = "novels_data"
+LEGACY_FILE = "novels_data.json"
+DATABASE_FILE = "novels_data.db"  # これがあればSQLite版（sqlstore.SQLiteStore）を使う
+FORMAT_VERSION = 2
+CHECKPOINT_BYTES = 1 << 20    # ジャーナルがこの大きさを超えたら各ファイルへ反映する
+CHECKPOINT_RECORDS = 500
+CONTENT_CACHE_BYTES = 64 << 20  # メモリに置いておく本文の上限
+
+
+def new_id():
+    return datetime.now().strftime("%Y%m%d%H%M%S%f")
+
+
+def ensure_ids(project):
+    # 旧形式のデータにはIDが無い／重複している場合があるので振り直す
+    seen = set()
+
+    def fix(obj):
+        oid = obj.id
+        while not oid or oid in seen:
+            oid = new_id() + f"_{len(seen)}"
+        obj.id = oid
+        seen.add(oid)
+
+    fix(project)
+    for ch in project.chapters:
+        fix(ch)
+        for ep in ch.episodes:
+            fix(ep)
+
+
+class ContentCache:
+    # 読み込んだ本文のLRU。上限を超えたら古いものから本文を手放す（未保存のものは残す）
+
+    def __init__(self, max_bytes=CONTENT_CACHE_BYTES):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self._entries = OrderedDict()  # episode_id -> (episode, size)
+
+    def touch(self, episode):
+        self.discard(episode.id)
+        size = sys.getsizeof(episode.content or "") + sys.getsizeof(episode.memo or "")
+        self._entries[episode.id] = (episode, size)
+        self.size += size
+
+    def discard(self, eid):
+        entry = self._entries.pop(eid, None)
+        if entry:
+            self.size -= entry[1]
+
+    def trim(self, keep):
+        for eid in list(self._entries):
+            if self.size <= self.max_bytes:
+                break
+            episode, size = self._entries[eid]
+            if keep(episode):
+                continue
+            del self._entries[eid]
+            self.size -= size
+            episode.unload()
+
+
+class Store:
+    # 保存先の共通部分（変更の記録・本文の遅延読み込み・旧形式の取り込み）
+    #
+    # 保存先ごとに実装するもの:
+    #   load() -> (projects, current_project_idx)   model.Projectのリスト。本文（BODY_KEYS）は読まなくてよい
+    #   prepare_save(projects, current_project_idx) -> 書き込む記録のリスト（UIスレッド）
+    #   commit(records) -> 書き込んだバイト数（作業スレッドで実行してよい）
+    #   checkpoint() / close()
+    #   _read_body(project_id, episode_id) -> {"content": ..., "memo": ...}
+    #   versions   バージョン履歴（versions.VersionStoreと同じ使い方）
+    #   sessions   執筆記録（sessions.SessionLog）
+
+    def __init__(self, cache_bytes=CONTENT_CACHE_BYTES):
+        self.cache = ContentCache(cache_bytes)
+        self.read_only = False  # 読み込みに失敗したときはデータを上書きしない
+        self._dirty = {}
+        self.bytes_written = 0
+        self.on_dirty = None  # 変更が記録されたときに呼ぶ（自動保存の予約など）
+
+    # 変更の記録
+    def _mark(self, key, record):
+        self._dirty[key] = record
+        if self.on_dirty is not None:
+            self.on_dirty()
+
+    def mark_library(self):
+        self._mark(("library",), ("library", None, None))
+
+    def mark_project(self, project):
+        self._mark(("project", project.id), ("project", project, project))
+
+    def mark_chapter(self, project, chapter):
+        self._mark(("chapter", project.id, chapter.id), ("chapter", project, chapter))
+
+    def mark_episode(self, project, episode):
+        self._mark(("episode", project.id, episode.id), ("episode", project, episode))
+        self.cache.touch(episode)
+
+    def mark_all(self, projects):
+        self.mark_library()
+        for project in projects:
+            self.mark_project(project)
+            for ch in project.chapters:
+                self.mark_chapter(project, ch)
+                for ep in ch.episodes:
+                    self.mark_episode(project, ep)
+
+    def is_dirty(self):
+        return bool(self._dirty)
+
+    def _unsaved(self):
+        # メモリから本文を手放してはいけない話のID
+        return {key[2] for key in self._dirty if key[0] == "episode"}
+
+    def _trim_cache(self):
+        unsaved = self._unsaved()
+        self.cache.trim(lambda episode: episode.id in unsaved)
+
+    # 本文の遅延読み込み
+    def content(self, project, episode):
+        if episode.content is None:
+            episode.set_body(self._read_body(project.id, episode.id))
+        self.cache.touch(episode)
+        if self.cache.size > self.cache.max_bytes:
+            self._trim_cache()
+        return episode.content
+
+    def read_content(self, project_id, episode_id):
+        # 保存済みの本文を読むだけで、話にもキャッシュにも入れない（作業スレッドから呼んでよい）
+        return self._read_body(project_id, episode_id).get("content", "")
+
+    def save(self, projects, current_project_idx):
+        records = self.prepare_save(projects, current_project_idx)
+        if records:
+            self.commit(records)
+        return len(records)
+
+    def search_engine(self):
+        # この保存先に合った全文検索
+        return LibrarySearch(self)
+
+    def _read_json(self, path):
+        with open(path, 'rb') as f:
+            data = f.read()
+        count("read_bytes", len(data))
+        return json.loads(data.decode('utf-8'))
+
+    def import_legacy(self, filename):
+        # 旧形式（単一のnovels_data.json）を読み込み、全体を書き込み対象にする
+        data = self._read_json(filename)
+        projects = []
+        for raw in data.get("projects", []):
+            versions = raw.pop("versions", {})
+            project = Project.from_dict(raw)
+            ensure_ids(project)
+            mapping = migrate_positional_keys(project, versions)
+            if not self.read_only:
+                self.versions.import_versions(project.id, {
+                    mapping.get(key, key): items for key, items in versions.items()
+                })
+            project.history_keys = "id"
+            for ch in project.chapters:
+                for ep in ch.episodes:
+                    if ep.content is None:
+                        ep.set_body({})
+                    self.cache.touch(ep)
+            projects.append(project)
+        current_idx = data.get("current_project_idx")
+        self.mark_all(projects)
+        return projects, current_idx
+
+
+def open_store(root_dir=DATA_DIR, database=DATABASE_FILE):
+    # SQLiteのデータベースがあればそれを、無ければ分割保存のファイルを使う
+    if database and os.path.exists(database):
+        from sqlstore import SQLiteStore
+        return SQLiteStore(database)
+    return ProjectStore(root_dir)
+
+
+def copy_library(source, target, task=None):
+    # sourceの全プロジェクトを本文・バージョン履歴ごとtargetへ写して保存する（保存先の移行）
+    # 本文はキャッシュの上限を超えないよう章ごとに読み込んで書き込む
+    # 同じライブラリを2回写しても増えないよう、targetに既にある履歴・執筆記録は写さない
+    projects, current_idx = source.load()
+    pids = {p.id for p in projects}
+    existing_sessions = Counter(record for record in target.sessions.records() if record[1] in pids)
+    total = sum(len(ch.episodes) for p in projects for ch in p.chapters) or 1
+    done = 0
+    for project in projects:
+        pid = project.id
+        target.mark_project(project)
+        for ch in project.chapters:
+            for ep in ch.episodes:
+                source.content(project, ep)
+                target.mark_episode(project, ep)
+            target.mark_chapter(project, ch)
+            target.save(projects, current_idx)
+            done += len(ch.episodes)
+            if task is not None:
+                task.report(done / total)
+        for key in source.versions.keys(pid):
+            existing = {(e.timestamp, e.hash) for e in target.versions.list_versions(pid, key)}
+            for i, entry in enumerate(source.versions.list_versions(pid, key)):
+                if (entry.timestamp, entry.hash) in existing:
+                    continue
+                target.versions.append(pid, key, source.versions.get_content(pid, key, i),
+                                       entry.type, entry.name, entry.timestamp)
+    for record in source.sessions.records():
+        if existing_sessions[record]:
+            existing_sessions[record] -= 1
+            continue
+        timestamp, pid, eid, chars = record
+        target.sessions.record(pid, eid, chars, timestamp)
+    target.sessions.flush()
+    target.mark_library()
+    target.save(projects, current_idx)
+    return projects, current_idx
+
+
+class ProjectStore(Store):
+    # プロジェクト・章・話ごとにファイルを分け、変更があったものだけを書き込む
+    #
+    # novels_data/
+    #   library.json                 プロジェクトの並び順と選択中のプロジェクト
+    #   <project_id>/project.json    プロジェクト情報・キャラクター・世界設定・章の並び
+    #   <project_id>/history/        バージョン履歴（versions.VersionStore）
+    #   <project_id>/chapters/<chapter_id>.json  章情報と話のメタ情報（タイトル・文字数など）
+    #   <project_id>/episodes/<episode_id>.json  話の本文とメモ
+    #   journal.log                  未反映の変更（先行書き込みログ）
+    #   sessions.bin(.ids/.idx)      執筆記録（sessions.SessionLog）
+    #
+    # 保存はjournal.logへの追記1回で済ませ、ある程度たまったらチェックポイントとして
+    # 各ファイルを一時ファイル経由のrenameで置き換えてからログを空にする。
+    #
+    # 起動時に読むのは章ファイルまでで、話の本文はcontent()で初めて読み込む。
+    #
+    # save()はprepare_save()（UIスレッドで変更分をJSON文字列にする）とcommit()
+    # （ジャーナルへの追記・チェックポイント、別スレッドで実行してよい）に分けられる。
+
+    def __init__(self, root_dir=DATA_DIR, legacy_file=LEGACY_FILE,
+                 checkpoint_bytes=CHECKPOINT_BYTES, checkpoint_records=CHECKPOINT_RECORDS,
+                 cache_bytes=CONTENT_CACHE_BYTES):
+        super().__init__(cache_bytes)
+        self.root_dir = root_dir
+        self.legacy_file = legacy_file
+        self.checkpoint_bytes = checkpoint_bytes
+        self.checkpoint_records = checkpoint_records
+        self.journal = Journal(os.path.join(root_dir, "journal.log"))
+        self.versions = VersionStore(root_dir)
+        self.sessions = SessionLog(os.path.join(root_dir, "sessions.bin"))
+        self._pending = OrderedDict()  # 相対パス -> (op, data) チェックポイント待ち
+        self._lock = threading.RLock()  # _pending・ジャーナルはcommit()のスレッドからも触る
+        self._known = {}  # project_id -> {"chapters": set(), "episodes": set()}
+
+    @timed("store.read_body")
+    def _read_body(self, pid, eid):
+        path = os.path.join(self.root_dir, self._episode_path(pid, eid))
+        if not self._exists(path):
+            return {}
+        return self._read_json(path)
+
+    # チェックポイント前の内容はまだジャーナルにしか無いので、ファイルより先に_pendingを見る
+    # （読み込み専用で開いたときはチェックポイントをしないので、起動中もずっとそうなる）
+    def _pending_record(self, path):
+        rel = os.path.relpath(path, self.root_dir).replace(os.sep, "/")
+        with self._lock:
+            return self._pending.get(rel)
+
+    def _exists(self, path):
+        pending = self._pending_record(path)
+        return pending[0] == "put" if pending else os.path.exists(path)
+
+    def _read_json(self, path):
+        pending = self._pending_record(path)
+        if pending:
+            op, data = pending
+            if op != "put":
+                raise FileNotFoundError(path)
+            return json.loads(data)
+        return super()._read_json(path)
+
+    # パス（root_dirからの相対パス）
+    def _chapter_path(self, pid, cid):
+        return f"{pid}/chapters/{cid}.json"
+
+    def _episode_path(self, pid, eid):
+        return f"{pid}/episodes/{eid}.json"
+
+    def _history_paths(self, pid, key):
+        return [f"{pid}/history/{key}.idx", f"{pid}/history/{key}.dat"]
+
+    def _known_ids(self, pid):
+        return self._known.setdefault(pid, {"chapters": set(), "episodes": set()})
+
+    # 書き込み
+    def _put(self, batch, rel, obj):
+        batch.append((rel, "put", json.dumps(obj, ensure_ascii=False)))
+
+    def _remove(self, batch, rel):
+        batch.append((rel, "del", None))
+
+    @timed("store.prepare_save")
+    def prepare_save(self, projects, current_project_idx):
+        # 変更のあった記録をジャーナル行にする。呼び出し後のデータ変更は次回の保存に回る
+        if not self._dirty or self.read_only:
+            return []
+
+        dirty = self._dirty
+        self._dirty = {}
+        live = {p.id for p in projects}
+        touched = {}
+        batch = []
+
+        for key, (kind, project, obj) in dirty.items():
+            if project is not None and project.id not in live:
+                # ライブラリに登録されていないプロジェクトは保存しない
+                continue
+            if kind == "library":
+                self._put(batch, "library.json", {
+                    "format": FORMAT_VERSION,
+                    "projects": [p.id for p in projects],
+                    "current_project_idx": current_project_idx
+                })
+                self._collect_projects(batch, projects)
+            elif kind == "project":
+                pid = project.id
+                self._put(batch, f"{pid}/project.json", project.meta())
+                touched[pid] = project
+            elif kind == "chapter":
+                pid = project.id
+                self._put(batch, self._chapter_path(pid, obj.id), obj.meta())
+                self._known_ids(pid)["chapters"].add(obj.id)
+                touched[pid] = project
+            elif kind == "episode":
+                pid = project.id
+                self._put(batch, self._episode_path(pid, obj.id), obj.body())
+                self._known_ids(pid)["episodes"].add(obj.id)
+
+        # 構成が変わったプロジェクトだけ、削除された章・話のファイルを片付ける
+        for project in touched.values():
+            self._collect_garbage(batch, project)
+
+        lines = []
+        with self._lock:
+            for rel, op, data in batch:
+                if op == "put":
+                    lines.append(f'{{"op":"put","path":{json.dumps(rel)},"data":{data}}}')
+                else:
+                    lines.append(json.dumps({"op": op, "path": rel}))
+                self._pending.pop(rel, None)
+                self._pending[rel] = (op, data)
+        self._trim_cache()
+        return lines
+
+    @timed("store.commit")
+    def commit(self, lines):
+        with self._lock:
+            written = self.journal.append_batch(lines)
+            self.bytes_written += written
+            count("write_bytes", written)
+            if (self.journal.size >= self.checkpoint_bytes or
+                    self.journal.records >= self.checkpoint_records):
+                self.checkpoint()
+        return written
+
+    def checkpoint(self):
+        # ジャーナルの内容を各ファイルへ反映し、ログを空にする
+        if self.read_only:
+            return
+        with self._lock:
+            self._checkpoint()
+
+    @timed("store.checkpoint")
+    def _checkpoint(self):
+        for rel, (op, data) in self._pending.items():
+            path = os.path.join(self.root_dir, rel)
+            if op == "put":
+                encoded = data.encode("utf-8")
+                write_atomic(path, encoded)
+                self.bytes_written += len(encoded)
+                count("write_bytes", len(encoded))
+            elif op == "del":
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+            elif op == "rmtree":
+                shutil.rmtree(path, ignore_errors=True)
+        self._pending.clear()
+        self.journal.reset()
+
+    def close(self):
+        self.checkpoint()
+        self.journal.close()
+        if not self.read_only:
+            self.sessions.close()
+
+    def _recover(self):
+        # 前回終了時に反映されなかったジャーナルを再生する
+        for record in self.journal.replay():
+            op = record.get("op")
+            data = json.dumps(record["data"], ensure_ascii=False) if op == "put" else None
+            self._pending.pop(record["path"], None)
+            self._pending[record["path"]] = (op, data)
+        self.checkpoint()
+
+    def _collect_garbage(self, batch, project):
+        pid = project.id
+        known = self._known_ids(pid)
+        live_chapters = set()
+        live_episodes = set()
+        for ch in project.chapters:
+            live_chapters.add(ch.id)
+            for ep in ch.episodes:
+                live_episodes.add(ep.id)
+
+        for cid in known["chapters"] - live_chapters:
+            self._remove(batch, self._chapter_path(pid, cid))
+        for eid in known["episodes"] - live_episodes:
+            self._remove(batch, self._episode_path(pid, eid))
+            # 履歴のファイルも、話を外した章ファイルと同じバッチでジャーナルに書いてから消す
+            for rel in self._history_paths(pid, eid):
+                self._remove(batch, rel)
+            self.versions._forget(pid, eid)
+        known["chapters"] = live_chapters
+        known["episodes"] = live_episodes
+
+    def _collect_projects(self, batch, projects):
+        live = {p.id for p in projects}
+        for pid in list(self._known):
+            if pid not in live:
+                batch.append((pid, "rmtree", None))
+                del self._known[pid]
+        for pid in live:
+            self._known_ids(pid)
+
+    # 読み込み
+    @timed("store.load")
+    def load(self):
+        self._recover()
+        library_path = os.path.join(self.root_dir, "library.json")
+        if not self._exists(library_path):
+            if os.path.exists(self.legacy_file):
+                projects, current_idx = self.import_legacy(self.legacy_file)
+                self.save(projects, current_idx)
+                return projects, current_idx
+            return [], None
+
+        library = self._read_json(library_path)
+        projects = []
+        for pid in library.get("projects", []):
+            projects.append(self._load_project(pid))
+        if library.get("format", 1) < FORMAT_VERSION:
+            self.mark_library()
+        return projects, library.get("current_project_idx")
+
+    def _load_project(self, pid):
+        project_dir = os.path.join(self.root_dir, pid)
+        record = self._read_json(os.path.join(project_dir, "project.json"))
+        known = self._known_ids(pid)
+
+        chapters = []
+        migrated = set()  # 形式1から移行した章
+        for cid in record.get("chapters", []):
+            data = self._read_json(os.path.join(self.root_dir, self._chapter_path(pid, cid)))
+            episodes = []
+            for meta in data.pop("episodes", []):
+                if isinstance(meta, str):
+                    # 形式1: 章ファイルには話IDしか無いので、一度だけ話ファイルから移行する
+                    episode = Episode.from_dict(self._read_body(pid, meta))
+                    if episode.content is None:
+                        episode.set_body({})
+                    self.cache.touch(episode)
+                    migrated.add(cid)
+                else:
+                    episode = Episode.from_dict(meta)
+                episodes.append(episode)
+                known["episodes"].add(episode.id)
+            chapter = Chapter.from_dict(data)
+            chapter.episodes = episodes
+            chapters.append(chapter)
+            known["chapters"].add(cid)
+        record["chapters"] = chapters
+        project = Project.from_dict(record)
+        for chapter in chapters:
+            if chapter.id in migrated:
+                self.mark_chapter(project, chapter)
+
+        if self.read_only:
+            return project  # 履歴の形式の移行はファイルを書き換えるので、次に書き込めるときに回す
+        versions_path = os.path.join(project_dir, "versions.json")
+        if os.path.exists(versions_path):
+            # 全文スナップショット形式の履歴を差分形式へ移行する
+            self.versions.import_versions(pid, self._read_json(versions_path))
+            os.remove(versions_path)
+        if project.history_keys != "id":
+            # 履歴のキーを「章番号_話番号」から話IDへ移行する
+            mapping = migrate_positional_keys(project, self.versions.keys(pid))
+            for old_key, eid in mapping.items():
+                self.versions.rename(pid, old_key, eid)
+            project.history_keys = "id"
+            self.mark_project(project)
+        return project
@@ -0,0 +1,155 @@
+import queue
+import threading
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+
+from profiler import PROFILER
+
+POLL_MS = 50
+
+
+class TaskCancelled(Exception):
+    pass
+
+
+class Task:
+    def __init__(self, name, group, on_done, on_error):
+        self.name = name
+        self.group = group
+        self.on_done = on_done
+        self.on_error = on_error
+        self.progress = 0.0
+        self.future = None
+        self._cancel = threading.Event()
+
+    @property
+    def cancelled(self):
+        return self._cancel.is_set()
+
+    def cancel(self):
+        self._cancel.set()
+        if self.future is not None:
+            self.future.cancel()
+
+    def check(self):
+        if self._cancel.is_set():
+            raise TaskCancelled()
+
+    def report(self, fraction):
+        # 作業スレッドから進捗を知らせる。取り消されていればここで中断する
+        self.progress = fraction
+        self.check()
+
+
+def track(task, docs):
+    # (ラベル, 本文を返す関数) のリストを、読むたびに進捗を報告するものに包む
+    total = len(docs) or 1
+
+    def wrap(i, load):
+        def tracked():
+            task.report(i / total)
+            return load()
+        return tracked
+
+    return [(label, wrap(i, load)) for i, (label, load) in enumerate(docs)]
+
+
+class TaskScheduler:
+    # 重い処理を作業スレッドで動かし、結果はroot.afterのポーリングでUIスレッドに返す
+    #
+    # lane: "io"（保存・書き出し。投入順に1つずつ） / "analysis"（文章チェック）
+    # fnは (task, *args) で呼ばれ、task.report()で進捗を伝える。
+    # on_done/on_errorは必ずUIスレッドで呼ばれる。
+
+    def __init__(self, root, on_status=None):
+        self.root = root
+        self.on_status = on_status
+        self._lanes = {
+            "io": ThreadPoolExecutor(max_workers=1, thread_name_prefix="io"),
+            "analysis": ThreadPoolExecutor(max_workers=1, thread_name_prefix="analysis"),
+        }
+        self._results = queue.Queue()
+        self._active = []
+        self._poll_id = None
+
+    def submit(self, fn, *args, name="", group=None, lane="analysis", on_done=None, on_error=None):
+        task = Task(name, group, on_done, on_error)
+
+        def run():
+            if task.cancelled:
+                return
+            try:
+                with PROFILER.span(f"{lane}:{name}"):
+                    result = fn(task, *args)
+            except TaskCancelled:
+                return
+            except Exception as e:
+                self._results.put((task, None, e))
+                return
+            self._results.put((task, result, None))
+
+        task.future = self._lanes[lane].submit(run)
+        self._active.append(task)
+        self._schedule_poll()
+        return task
+
+    def cancel(self, group):
+        for task in self._active:
+            if task.group == group:
+                task.cancel()
+
+    def busy(self, group=None):
+        return any(group is None or task.group == group for task in self._active)
+
+    def _schedule_poll(self):
+        if self._poll_id is None:
+            self._poll_id = self.root.after(POLL_MS, self._poll)
+
+    def _deliver(self, task, result, error):
+        if task in self._active:
+            self._active.remove(task)
+        if task.cancelled:
+            return
+        with PROFILER.span(f"完了:{task.name}"):
+            if error is not None:
+                if task.on_error:
+                    task.on_error(error)
+            elif task.on_done:
+                task.on_done(result)
+
+    def _poll(self):
+        self._poll_id = None
+        try:
+            while True:
+                try:
+                    task, result, error = self._results.get_nowait()
+                except queue.Empty:
+                    break
+                try:
+                    self._deliver(task, result, error)
+                except Exception as e:
+                    # 1つの完了処理の失敗で、残りの結果の受け渡しやポーリングを止めない
+                    traceback.print_exc()
+                    if self.on_status:
+                        self.on_status(f"{task.name}の完了処理に失敗しました: {e}")
+
+            # 結果を返さずに終わったもの（取り消し）を片付ける
+            self._active = [t for t in self._active if not (t.future.done() and t.cancelled)]
+
+            if self.on_status and self._active:
+                task = self._active[0]
+                self.on_status(f"{task.name}… {task.progress * 100:.0f}%")
+        finally:
+            if self._active or not self._results.empty():
+                self._schedule_poll()
+
+    def shutdown(self):
+        # 終了時: 取り消されていない作業を最後まで待ち、結果を受け取ってから止める
+        for lane in self._lanes.values():
+            lane.shutdown(wait=True)
+        while True:
+            try:
+                task, result, error = self._results.get_nowait()
+            except queue.Empty:
+                break
+            self._deliver(task, result, error)
@@ -0,0 +1,43 @@
+import unittest
+
+from document import Document, char_column, widget_units
+
+
+class DocumentColumnTest(unittest.TestCase):
+    # Tcl 8.6のTextウィジェットは𠮷（拡張B）を2桁と数える
+
+    def test_char_column(self):
+        line = "吉野の𠮷野家で"
+        self.assertEqual(widget_units(line), 8)
+        self.assertEqual(char_column(line, 3), 3)
+        self.assertEqual(char_column(line, 5), 4)  # 𠮷の後ろ
+        self.assertEqual(char_column(line, 8), 7)
+        self.assertEqual(char_column("abc", 2), 2)
+
+    def test_insert_after_non_bmp(self):
+        doc = Document("一行目\n𠮷野家で食べた\n三行目", wide=True)
+        doc.insert(2, 5, "牛丼を")  # 「家で」と「食べた」のあいだ（𠮷の分だけ桁が1つ多い）
+        self.assertEqual(doc.text(), "一行目\n𠮷野家で牛丼を食べた\n三行目")
+        self.assertEqual(doc.length, len(doc.text()))
+
+    def test_delete_after_non_bmp(self):
+        doc = Document("𠮷野家で牛丼を食べた", wide=True)
+        doc.delete(1, 5, 1, 8)
+        self.assertEqual(doc.text(), "𠮷野家で食べた")
+        self.assertEqual(doc.length, len(doc.text()))
+
+    def test_delete_across_lines(self):
+        doc = Document("𠮷田\n𠮷野家", wide=True)
+        doc.delete(1, 3, 2, 2)
+        self.assertEqual(doc.text(), "𠮷田野家")
+        self.assertEqual(doc.end_index(), "1.5")
+
+    def test_narrow_columns(self):
+        # Tcl 9など、1文字を1桁と数える場合はそのまま
+        doc = Document("𠮷野家で食べた")
+        doc.insert(1, 4, "牛丼を")
+        self.assertEqual(doc.text(), "𠮷野家で牛丼を食べた")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,55 @@
+from bisect import bisect_right
+
+WHITESPACE = " \t\r\n　\v\f"
+_STRIP_WHITESPACE = str.maketrans("", "", WHITESPACE)
+
+
+def count_nonspace(text):
+    return len(text.translate(_STRIP_WHITESPACE))
+
+
+class WordCounter:
+    # 挿入・削除された分だけ文字数を増減させる
+    # total: 改行・空白を含む文字数 / nonspace: 改行・空白（全角含む）を除いた文字数
+
+    def __init__(self):
+        self.total = 0
+        self.nonspace = 0
+        self.stale = False  # 増減を追えない操作（元に戻す等）の後は数え直す
+
+    def reset(self, text=""):
+        self.total = len(text)
+        self.nonspace = count_nonspace(text)
+        self.stale = False
+
+    def clear(self):
+        self.total = 0
+        self.nonspace = 0
+        self.stale = False
+
+    def inserted(self, text):
+        self.total += len(text)
+        self.nonspace += count_nonspace(text)
+
+    def deleted(self, text):
+        self.total -= len(text)
+        self.nonspace -= count_nonspace(text)
+
+    def invalidate(self):
+        self.stale = True
+
+
+def line_starts(text):
+    # 各行の先頭位置。位置から行・桁を求めるときはbisectで引く
+    starts = [0]
+    find = text.find
+    pos = find("\n")
+    while pos != -1:
+        starts.append(pos + 1)
+        pos = find("\n", pos + 1)
+    return starts
+
+
+def line_col(starts, pos):
+    line = bisect_right(starts, pos)
+    return line, pos - starts[line - 1] + 1
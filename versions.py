@@ -0,0 +1,249 @@
+import difflib
+import hashlib
+import json
+import os
+import zlib
+from collections import OrderedDict
+
+from model import Version
+from profiler import count, timed
+
+KEYFRAME_INTERVAL = 20   # この数ごとに全文を保存する
+CACHE_SIZE = 8
+
+
+def make_delta(old, new):
+    # 差分は「正の数=旧文からコピー」「負の数=旧文を読み飛ばす」「文字列=挿入」の列
+    prefix = 0
+    limit = min(len(old), len(new))
+    while prefix < limit and old[prefix] == new[prefix]:
+        prefix += 1
+    suffix = 0
+    limit -= prefix
+    while suffix < limit and old[-1 - suffix] == new[-1 - suffix]:
+        suffix += 1
+
+    ops = []
+    if prefix:
+        ops.append(prefix)
+
+    old_mid = old[prefix:len(old) - suffix]
+    new_mid = new[prefix:len(new) - suffix]
+    if old_mid or new_mid:
+        # 変更箇所が散らばっている場合は段落（行）単位で比較する
+        a = old_mid.splitlines(keepends=True)
+        b = new_mid.splitlines(keepends=True)
+        matcher = difflib.SequenceMatcher(None, a, b, autojunk=False)
+        for tag, i1, i2, j1, j2 in matcher.get_opcodes():
+            if tag == "equal":
+                ops.append(sum(len(line) for line in a[i1:i2]))
+                continue
+            if i2 > i1:
+                ops.append(-sum(len(line) for line in a[i1:i2]))
+            if j2 > j1:
+                ops.append("".join(b[j1:j2]))
+
+    if suffix:
+        ops.append(suffix)
+    return ops
+
+
+def apply_delta(old, ops):
+    parts = []
+    pos = 0
+    for op in ops:
+        if isinstance(op, str):
+            parts.append(op)
+        elif op > 0:
+            parts.append(old[pos:pos + op])
+            pos += op
+        else:
+            pos -= op
+    return "".join(parts)
+
+
+class VersionStore:
+    # 話ごとのバージョン履歴
+    #
+    # <project_id>/history/<key>.idx  1行1バージョンのメタ情報（一覧表示はこれだけ読む）
+    # <project_id>/history/<key>.dat  本文（一定間隔の全文＋前版からの差分、zlib圧縮）
+    #
+    # どちらも追記のみなので、書き込み中に落ちても既存の履歴は壊れない。
+    # 書きかけの末尾は読み込むときに読み飛ばし、次の追記の前に切り詰める。
+
+    def __init__(self, root_dir, compress=True, keyframe_interval=KEYFRAME_INTERVAL):
+        self.root_dir = root_dir
+        self.compress = compress
+        self.keyframe_interval = keyframe_interval
+        self.bytes_written = 0
+        self._index = {}   # (pid, key) -> メタ情報のリスト
+        self._valid = {}   # (pid, key) -> (.idxの有効な長さ, .datの有効な長さ)
+        self._cache = OrderedDict()  # (pid, key, idx) -> 本文
+
+    def _base(self, pid, key):
+        return os.path.join(self.root_dir, pid, "history", key)
+
+    def _append_file(self, path, data, valid):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'ab') as f:
+            if f.tell() > valid:
+                f.truncate(valid)  # 書きかけの末尾の上に追記しない
+                f.seek(valid)
+            offset = f.tell()
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        self.bytes_written += len(data)
+        count("write_bytes", len(data))
+        return offset
+
+    def list_versions(self, pid, key):
+        cache_key = (pid, key)
+        if cache_key in self._index:
+            return self._index[cache_key]
+
+        entries = self._load_entries(pid, key)
+        self._index[cache_key] = entries
+        return entries
+
+    def _load_entries(self, pid, key):
+        entries = []
+        size = 0
+        path = self._base(pid, key) + ".idx"
+        if os.path.exists(path):
+            with open(path, 'rb') as f:
+                for line in f:
+                    if not line.endswith(b"\n"):
+                        break  # 書きかけの末尾行
+                    try:
+                        entries.append(Version.from_dict(json.loads(line)))
+                    except ValueError:
+                        break
+                    size += len(line)
+        dat_size = max((e.offset + e.length for e in entries if e.offset is not None), default=0)
+        self._valid[(pid, key)] = (size, dat_size)
+        return entries
+
+    @timed("versions.append")
+    def append(self, pid, key, content, version_type, name, timestamp):
+        entries = self.list_versions(pid, key)
+        digest = hashlib.sha1(content.encode("utf-8")).hexdigest()
+        entry = Version(version_type, name, timestamp, len(content), digest)
+
+        payload = None
+        if entries and entries[-1].hash == digest:
+            # 前の版と同じ内容なら本文は保存しない
+            entry.kind = "same"
+        else:
+            since_key = 0
+            for prev in reversed(entries):
+                if prev.kind == "key":
+                    break
+                since_key += 1
+            if entries and since_key < self.keyframe_interval:
+                previous = self.get_content(pid, key, len(entries) - 1)
+                delta = json.dumps(make_delta(previous, content), ensure_ascii=False)
+                # 差分が全文と大差なければ全文で持つ
+                if len(delta) < len(content) // 2:
+                    entry.kind = "delta"
+                    payload = delta.encode("utf-8")
+            if payload is None:
+                entry.kind = "key"
+                payload = content.encode("utf-8")
+
+            if self.compress:
+                payload = zlib.compress(payload)
+                entry.z = True
+
+        self._write(pid, key, entry, payload)
+        entries.append(entry)
+        self._remember((pid, key, len(entries) - 1), content)
+        return entry
+
+    def _write(self, pid, key, entry, payload):
+        # 本文（payload、"same"ならNone）を.datに、メタ情報を.idxに追記する
+        idx_size, dat_size = self._valid.get((pid, key), (0, 0))
+        if payload is not None:
+            entry.offset = self._append_file(self._base(pid, key) + ".dat", payload, dat_size)
+            entry.length = len(payload)
+            dat_size = entry.offset + entry.length
+        line = (json.dumps(entry.to_dict(), ensure_ascii=False) + "\n").encode("utf-8")
+        self._append_file(self._base(pid, key) + ".idx", line, idx_size)
+        self._valid[(pid, key)] = (idx_size + len(line), dat_size)
+
+    def _read_payload(self, pid, key, entry):
+        with open(self._base(pid, key) + ".dat", 'rb') as f:
+            f.seek(entry.offset)
+            payload = f.read(entry.length)
+        count("read_bytes", len(payload))
+        if entry.z:
+            payload = zlib.decompress(payload)
+        return payload.decode("utf-8")
+
+    def _remember(self, cache_key, content):
+        self._cache[cache_key] = content
+        self._cache.move_to_end(cache_key)
+        while len(self._cache) > CACHE_SIZE:
+            self._cache.popitem(last=False)
+
+    @timed("versions.get_content")
+    def get_content(self, pid, key, idx):
+        cache_key = (pid, key, idx)
+        if cache_key in self._cache:
+            self._cache.move_to_end(cache_key)
+            return self._cache[cache_key]
+
+        entries = self.list_versions(pid, key)
+        # 直近の全文まで遡ってから差分を順に当てる
+        start = idx
+        while entries[start].kind != "key" and (pid, key, start) not in self._cache:
+            start -= 1
+        if (pid, key, start) in self._cache:
+            content = self._cache[(pid, key, start)]
+        else:
+            content = self._read_payload(pid, key, entries[start])
+
+        for i in range(start + 1, idx + 1):
+            entry = entries[i]
+            if entry.kind == "key":
+                content = self._read_payload(pid, key, entry)
+            elif entry.kind == "delta":
+                content = apply_delta(content, json.loads(self._read_payload(pid, key, entry)))
+
+        self._remember(cache_key, content)
+        return content
+
+    def keys(self, pid):
+        directory = os.path.join(self.root_dir, pid, "history")
+        if not os.path.isdir(directory):
+            return []
+        return [name[:-4] for name in os.listdir(directory) if name.endswith(".idx")]
+
+    def rename(self, pid, old_key, new_key):
+        for ext in (".idx", ".dat"):
+            src = self._base(pid, old_key) + ext
+            if os.path.exists(src):
+                os.replace(src, self._base(pid, new_key) + ext)
+        self._forget(pid, old_key)
+        self._forget(pid, new_key)
+
+    def delete(self, pid, key):
+        for ext in (".idx", ".dat"):
+            try:
+                os.remove(self._base(pid, key) + ext)
+            except FileNotFoundError:
+                pass
+        self._forget(pid, key)
+
+    def _forget(self, pid, key):
+        self._index.pop((pid, key), None)
+        self._valid.pop((pid, key), None)
+        for cache_key in [k for k in self._cache if k[0] == pid and k[1] == key]:
+            del self._cache[cache_key]
+
+    def import_versions(self, pid, versions):
+        # 旧形式（全文をそのまま並べたリスト）を取り込む
+        for key, items in versions.items():
+            for ver in items:
+                self.append(pid, key, ver.get("content", ""), ver.get("type", "draft"),
+                            ver.get("name", ""), ver.get("timestamp", ""))